@@ -0,0 +1,76 @@
+""" Python code for encoding the catalog's JSON API responses.
+
+API responses are encoded with ujson when it is installed, which is
+several times faster than the standard json module, and fall back to the
+json module otherwise. A client that prefers MessagePack in its Accept
+header (application/msgpack or application/x-msgpack) gets the same data
+as MessagePack instead, which is smaller and quicker to decode, when the
+msgpack package is installed. Both packages are optional.
+
+Responses that depend on the Accept header carry "Vary: Accept", and the
+response cache keeps one copy per format (see "response_cache.py").
+"""
+import json
+
+from flask import current_app, request
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ['application/msgpack', 'application/x-msgpack']
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def dumpJSON(data):
+    """ Encode data as compact JSON text """
+    if ujson is not None:
+        return ujson.dumps(data, ensure_ascii=True,
+            escape_forward_slashes=False)
+    return json.dumps(data, separators=(',', ':'))
+
+
+def dumpMsgpack(data):
+    """ Encode data as MessagePack bytes """
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def apiFormat():
+    """ Return the format the current request asks for: 'msgpack' if its
+    Accept header prefers MessagePack and msgpack is installed, otherwise
+    'json'
+    """
+    if msgpack is None or not request.accept_mimetypes:
+        return 'json'
+    best = request.accept_mimetypes.best_match(
+        [JSON_MIMETYPE] + MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+    return 'msgpack' if best in MSGPACK_MIMETYPES else 'json'
+
+
+def negotiated(my_function):
+    """ Decorator for API endpoints whose format follows the Accept
+    header, so the response cache keeps a copy per format
+    """
+    my_function.cache_variant = apiFormat
+    return my_function
+
+
+def apiResponse(data, status=200):
+    """ Return a response with data encoded in the format the request
+    asks for
+    """
+    if apiFormat() == 'msgpack':
+        response = current_app.response_class(dumpMsgpack(data),
+            status=status, mimetype=MSGPACK_MIMETYPES[0])
+    else:
+        response = current_app.response_class(dumpJSON(data),
+            status=status, mimetype=JSON_MIMETYPE)
+    if msgpack is not None:
+        response.vary.add('Accept')
+    return response
@@ -1,5 +1,18 @@
 """ The main Python code for running the plant catalog website
 
+create_app() builds the Flask application. Neither importing this file
+nor creating the application connects to the database: the engine is
+created on first use in each process, so a preforking server (gunicorn
+--preload "application:create_app()", for example) can load the
+application once and fork workers that never share database connections.
+
+Pages marked @readOnly read from the DATABASE_REPLICA_URL database when
+one is configured, or otherwise through a separate pool of read-only
+connections to a SQLite database; everything else, including every write,
+goes to the DATABASE_URL database. For READ_PRIMARY_AFTER_WRITE seconds
+after a user writes, their reads go to the primary too, so they see their
+change even while the replica lags behind.
+
 Dependencies:
     "database_setup.py" - which defines the User, PlantCategory, and
         Plant Item tables and sets up the database
@@ -9,48 +22,355 @@ Dependencies:
     "static/images" - all the image assets, including banner image and
         plant images for the sample plant items
     "static/styles.css" - style file for the HTML templates
+    "assets.py" - which serves the fingerprinted static files built by
+        "build_assets.py"
+    "image_store.py" - which stores uploaded plant images and their
+        resized variants
     "client_secrets.json" - Google API client ID and secrets needed for
         3rd-party login authentication
+    "config.py" - which loads the application settings and client secrets
+    "instrumentation.py" - which optionally times each request and serves
+        the metrics
+    "session_store.py" - which keeps the login sessions on the server
+    "fragment_cache.py" - which caches rendered sections of the templates
+    "compression.py" - which compresses the responses
+    "maintenance.py" - which deletes and reassigns plants in bulk
 """
 # Imports for running flask and rendering pages
 from flask import Flask, render_template, url_for, request, redirect, jsonify, flash
+from flask import Blueprint, Response, stream_with_context, g, has_app_context
+from flask import current_app, has_request_context
 # Imports for SQLalchemy
-from sqlalchemy import create_engine, asc
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import asc, event, func, inspect, or_, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker, scoped_session, joinedload
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.exc import IntegrityError
+from werkzeug.routing import BaseConverter
+import hmac
+import os
+import threading
+import time
 # Imports for creating anti-forgery state tokens
 from flask import session as login_session
 import random
+import re
 import string
 # Imports for handling Google callback method
-from oauth2client.client import flow_from_clientsecrets
 from oauth2client.client import FlowExchangeError
-import httplib2
 import json
 from flask import make_response
-import requests
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+from oauth_client import exchangeCode, getTokenInfo, getGoogleProfile
+from oauth_client import revokeToken, GoogleUnavailable, tokeninfo_cache
+# Imports for settings and client secrets
+from config import settings, getClientId
+# Imports for serving fingerprinted static assets
+from assets import registerAssets
+# Imports for encoding the JSON API responses
+from api_format import apiResponse, dumpJSON, dumpMsgpack, negotiated
+from api_format import apiFormat, MSGPACK_MIMETYPES, NDJSON_MIMETYPE
+# Imports for the optional request instrumentation
+from instrumentation import registerInstrumentation, timedPhase
+# Imports for storing uploaded plant images
+from image_store import registerImages, storeUpload, ImageError
+# Imports for caching templates and rendered template sections
+from jinja2 import FileSystemBytecodeCache
+from fragment_cache import registerFragmentCache, fragment_cache
+# Imports for compressing responses
+from compression import registerCompression
+# Imports for bulk maintenance
+from maintenance import deleteCategory, reassignPlants, purgeCatalog
+from maintenance import MaintenanceError
+# Imports for keeping login sessions on the server
+from session_store import createSessionInterface
 # Imports for creating login decorator
 from functools import wraps
 # Imports for checking input data
 import bleach
 
 # Database objects
-from database_setup import Base, PlantCategory, PlantItem, User
+from database_setup import PlantCategory, PlantItem, PlantChange, User
+from database_setup import CatalogState, PLANT_FIELD_LENGTHS
+from database_setup import createEngine
+# In-process caches
+from cache import LRUCache
+from response_cache import cachedResponse, catalog_version, response_cache
 
 
-# Create Flask application
-app = Flask(__name__)
+# All the catalog pages, registered on the application by create_app
+catalog = Blueprint('catalog', __name__)
 
-# Get client id from Google client_secrets json file
-CLIENT_ID = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
 APPLICATION_NAME = 'Plant Catalog App'
 
-# Connect to plant catalog database
-engine = create_engine('sqlite:///plantcatalog.db')
-Base.metadata.bind = engine
-# Create a session to interface with the database
-DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
+# Page sizes for the catalog JSON API
+PLANTS_PAGE_SIZE = 100
+PLANTS_PAGE_MAX = 1000
+PLANTS_STREAM_BATCH = 500
+# Plants shown on each page of a category
+CATEGORY_PAGE_SIZE = 24
+# Page sizes for the change feed
+CHANGES_PAGE_SIZE = 500
+CHANGES_PAGE_MAX = 5000
+# Most plants in one batch write
+BATCH_MAX = 1000
+# Number of plants returned by a search
+SEARCH_RESULTS_SIZE = 20
+SEARCH_RESULTS_MAX = 100
+
+# Plant catalog database engines, by role ('primary' or 'replica')
+_engines = {}
+_engines_pid = None
+_engine_lock = threading.Lock()
+
+
+def createEngines():
+    """ Return the primary and replica engines for the configured
+    database URLs. Without a replica URL, a SQLite database gets a second
+    pool of read-only connections as its replica, and any other database
+    is read through the primary.
+    """
+    primary_url = settings.get('DATABASE_URL')
+    replica_url = settings.get('DATABASE_REPLICA_URL')
+    primary = createEngine(primary_url)
+    if replica_url:
+        replica = createEngine(replica_url, read_only=True)
+    elif primary_url.startswith('sqlite'):
+        replica = createEngine(primary_url, read_only=True)
+    else:
+        replica = primary
+    return {'primary': primary, 'replica': replica}
+
+
+def getEngine(role='primary'):
+    """ Return this process's database engine for the given role,
+    creating the engines on first use. A process forked from one that
+    already had engines gets new ones of its own, so pooled connections
+    are never shared across a fork.
+    """
+    global _engines, _engines_pid
+    if _engines_pid != os.getpid():
+        with _engine_lock:
+            if _engines_pid != os.getpid():
+                # Leave inherited engines alone: closing their connections
+                # here would close them under the parent process too
+                _engines = createEngines()
+                _engines_pid = os.getpid()
+    return _engines[role]
+
+
+def readOnly(my_function):
+    """ Decorator that marks a page as only reading the catalog, so its
+    queries can go to the replica
+    """
+    my_function.read_only = True
+    return my_function
+
+
+class SegmentConverter(BaseConverter):
+    """ URL converter for one path segment, matched like the path
+    converter rather than segment by segment. On Werkzeug 2.2 and later,
+    a rule with a plain string variable would lose to the path rules of
+    the plant pages, which match the same URLs as a whole.
+    """
+    regex = '[^/]+'
+    part_isolating = False
+
+
+def isReadOnlyRequest():
+    """ Return whether the current request is for a @readOnly page """
+    if not has_request_context() or request.endpoint is None:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'read_only', False)
+
+
+def readPrimaryAfterWrite():
+    """ Send the current user's reads to the primary for the next
+    READ_PRIMARY_AFTER_WRITE seconds. Called after every commit a user
+    makes, since the replica may not have the change yet.
+    """
+    login_session['read_primary_until'] = time.time() + \
+        settings.get('READ_PRIMARY_AFTER_WRITE')
+
+
+def readsPrimary():
+    """ Return whether the current user wrote recently enough that their
+    reads must go to the primary
+    """
+    return has_request_context() and \
+        login_session.get('read_primary_until', 0) > time.time()
+
+
+class CatalogSession(Session):
+    """ Session that connects through this process's engines unless it
+    was given a bind of its own: the replica while handling a @readOnly
+    page for a user who hasn't just written, and the primary otherwise
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.bind is not None:
+            return super(CatalogSession, self).get_bind(mapper, clause)
+        if isReadOnlyRequest() and not readsPrimary():
+            return getEngine('replica')
+        return getEngine('primary')
+
+
+# Create a session registry to interface with the database. Each thread
+# (and so each request) gets its own session, which is thrown away when
+# the request is done.
+DBSession = sessionmaker(class_=CatalogSession)
+db_session = scoped_session(DBSession)
+
+
+def removeSession(exception=None):
+    """ Close the request's session, rolling back anything it left
+    uncommitted, and return its connection to the pool so a failed
+    request can't leak into the next one
+    """
+    db_session.remove()
+
+
+# Read caches for lookups that rarely change. Cached objects are detached
+# from any session, so they are shared between requests and must be
+# treated as read-only. Entries are loaded for the catalog version, so a
+# change made by any process retires them.
+CACHE_TTL = 300
+category_cache = LRUCache(max_size=1, ttl=CACHE_TTL)
+plant_cache = LRUCache(max_size=4096, ttl=CACHE_TTL)
+user_cache = LRUCache(max_size=1024, ttl=CACHE_TTL)
+schema_cache = LRUCache(max_size=16, ttl=CACHE_TTL)
+
+
+def loadDetached(load):
+    """ Call load(session) with a short-lived session of its own and
+    return the result detached from it, ready to be cached
+    """
+    session = DBSession()
+    try:
+        result = load(session)
+        session.expunge_all()
+        return result
+    finally:
+        session.close()
+
+
+def cachedLookup(cache, key, load):
+    """ Return the cached result of load(session) for key, loading it on
+    a miss or when the catalog version has moved on. A user whose reads
+    go to the primary skips the cache: the version is read from the
+    replica, so entries cached for it may predate their write.
+    """
+    if readsPrimary():
+        return loadDetached(load)
+    return cache.getOrLoad(key, lambda: loadDetached(load),
+        catalog_version.value)
+
+
+def fragmentVersion():
+    """ Return the catalog version cached template fragments must match,
+    or None to render them afresh for a user whose reads go to the
+    primary
+    """
+    if readsPrimary():
+        return None
+    return catalog_version.value
+
+
+def invalidatePlants(*plant_names):
+    """ Drop the cached lookups for the given plant names and read the
+    catalog version again, which the commit moved on, so every cached
+    response is retired. Called after every commit that creates, edits or
+    deletes a plant.
+    """
+    for plant_name in plant_names:
+        plant_cache.invalidate(plant_name)
+    # The cached categories hold their plant counts
+    category_cache.clear()
+    catalog_version.bump()
+
+
+def invalidateCatalog():
+    """ Drop every cached lookup and read the catalog version again.
+    Called after bulk maintenance, which can change any number of plants,
+    categories and users.
+    """
+    for cache in (category_cache, plant_cache, user_cache):
+        cache.clear()
+    catalog_version.bump()
+
+
+def loadCatalogVersion():
+    """ Read the catalog version from the database that the read-only
+    pages read, so a page is never cached under a version newer than what
+    it shows. The query doesn't count towards the page's query budget.
+    """
+    with getEngine('replica').connect() as connection:
+        return connection.execution_options(in_query_budget=False).scalar(
+            select([CatalogState.version])) or 0
+
+
+def cacheStats():
+    """ Return the hit/miss statistics for each of the read caches """
+    return {
+        'categories': category_cache.stats(),
+        'plants': plant_cache.stats(),
+        'users': user_cache.stats(),
+        'responses': response_cache.stats(),
+        'fragments': fragment_cache.stats(),
+        'tokeninfo': tokeninfo_cache.stats()
+    }
+
+
+# Query counting, used to hold each page to its query budget
+class QueryBudgetExceeded(AssertionError):
+    """ Raised in testing mode when a page issues more SQL statements
+    than its query budget allows
+    """
+
+
+def queryBudget(max_queries):
+    """ Decorator that records the maximum number of SQL statements the
+    page handler may issue for one request
+    """
+    def decorator(my_function):
+        my_function.query_budget = max_queries
+        return my_function
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def countQuery(conn, cursor, statement, parameters, context, executemany):
+    """ Count the SQL statements issued while handling a request, other
+    than those on connections with the in_query_budget=False execution
+    option
+    """
+    if has_app_context() and \
+            context.execution_options.get('in_query_budget', True):
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def checkQueryBudget(response):
+    """ In testing mode, report the request's query count in the
+    X-Query-Count header and fail if the page went over its budget
+    """
+    if current_app.testing:
+        count = g.get('query_count', 0)
+        response.headers['X-Query-Count'] = str(count)
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None and count > budget:
+            raise QueryBudgetExceeded('%s issued %d queries (budget %d)'
+                % (request.endpoint, count, budget))
+    return response
+
+
+def sanitize(text):
+    """ Strip any markup from user input, timed as the "bleach" phase """
+    with timedPhase('bleach'):
+        return bleach.clean(text)
 
 
 # Helper functions for creating and handling new Users
@@ -63,12 +383,14 @@ def createUser(login_session):
         picture=login_session['picture'])
     db_session.add(newUser)
     db_session.commit()
+    readPrimaryAfterWrite()
     user = db_session.query(User).filter_by(email=login_session['email']).one()
     return user.id
 
 def getUserInfo(user_id):
     """ Given a user_id return the corresponding User database object """
-    user = db_session.query(User).filter_by(id=user_id).one()
+    user = cachedLookup(user_cache, user_id,
+        lambda session: session.query(User).filter_by(id=user_id).one())
     return user
 
 def getUserID(email):
@@ -83,18 +405,19 @@ def getUserID(email):
 
 
 # Login handler
-@app.route('/login')
+@catalog.route('/login')
 def showLogin():
     """ This page handles logins """
     # Create and save state token to prevent request forgery
     state = ''.join(random.choice(string.ascii_uppercase + string.digits)
         for x in range(32))
     login_session['state'] = state
-    return render_template('login.html', STATE=login_session['state'])
+    return render_template('login.html', STATE=login_session['state'],
+        CLIENT_ID=getClientId() or '')
 
 
 # Google connection handler
-@app.route('/gconnect', methods=['POST'])
+@catalog.route('/gconnect', methods=['POST'])
 def gconnect():
     """ This page handles the server-side callback from Google sign in """
     # Validate state token
@@ -107,21 +430,20 @@ def gconnect():
 
     try:
         # Try to exchange one-time auth code for a credentials object
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = exchangeCode(code)
+        # Check that returned credentials object contained a valid
+        # access token
+        result = getTokenInfo(credentials.access_token)
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
-
-    # Check that returned credentials object contained a valid access token
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-        % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+    except GoogleUnavailable:
+        response = make_response(
+            json.dumps('Failed to reach Google to check credentials.'), 503)
+        response.headers['Content-Type'] = 'application/json'
+        return response
     # Abort if this didn't work
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
@@ -137,7 +459,7 @@ def gconnect():
         return response
 
     # Verify that the client IDs also match
-    if result['issued_to'] != CLIENT_ID:
+    if result['issued_to'] != getClientId():
         response = make_response(
             json.dumps("Token client ID doesn't match the app's."), 401)
         response.headers['Content-Type'] = 'application/json'
@@ -153,6 +475,11 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
+    # Give the session a new ID now that it holds the user's
+    # credentials, so an ID seen before the login can't be used
+    if hasattr(login_session, 'regenerate'):
+        login_session.regenerate()
+
     # New user, so store credentials in session data for later use
     # NOTE: I received an error message when I tried to store the
     # entire credentials object, so I opted to store only access token
@@ -160,10 +487,15 @@ def gconnect():
     login_session['gplus_id'] = gplus_id
 
     # Use Google API to retrieve more information about the user
-    userinfo_url = 'https://www.googleapis.com/oauth2/v1/userinfo'
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-    data = answer.json()
+    try:
+        data = getGoogleProfile(credentials.access_token)
+    except GoogleUnavailable:
+        del login_session['credentials']
+        del login_session['gplus_id']
+        response = make_response(
+            json.dumps('Failed to reach Google for user information.'), 503)
+        response.headers['Content-Type'] = 'application/json'
+        return response
 
     # Record user information
     login_session['username'] = data['name']
@@ -184,7 +516,7 @@ def gconnect():
 
 
 # Google Disconnect and Logout Handler
-@app.route('/disconnect')
+@catalog.route('/disconnect')
 def disconnect():
     """ Page to disconnect user from Google account and logout """
     # Grab credentials from login session
@@ -198,12 +530,16 @@ def disconnect():
     # Execute an http request to revoke the current token
     # NOTE: Recall that we only saved the access_token in credentials
     access_token = credentials
-    url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
+    try:
+        status = revokeToken(access_token)
+    except GoogleUnavailable:
+        response = make_response(
+            json.dumps('Failed to reach Google to revoke token.'), 503)
+        response.headers['Content-Type'] = 'application/json'
+        return response
 
     # If successful, reset the login session
-    if result['status'] == '200':
+    if status == 200:
         # Reset the user's login session
         del login_session['credentials']
         del login_session['gplus_id']
@@ -213,7 +549,7 @@ def disconnect():
         del login_session['user_id']
         # Send success message
         flash("You have successfully been logged out.")
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
     else:
         # Oops! The token was invalid
         response = make_response(
@@ -233,20 +569,82 @@ def login_required(my_function):
     return decorated_function
 
 
+def apiLoginRequired(my_function):
+    """ Like login_required, for JSON endpoints: answers 401 instead of
+    redirecting to the login page
+    """
+    @wraps(my_function)
+    def decorated_function(*args, **kws):
+        if 'username' not in login_session:
+            response = make_response(json.dumps('Login required.'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+        return my_function(*args, **kws)
+    return decorated_function
+
+
+def maintenanceTokenRequired(my_function):
+    """ Decorator for the maintenance API endpoints, which need the
+    MAINTENANCE_TOKEN setting as a bearer token. Without the setting, they
+    are refused.
+    """
+    @wraps(my_function)
+    def decorated_function(*args, **kws):
+        token = settings.get('MAINTENANCE_TOKEN')
+        # Compared in constant time, so the token can't be guessed from
+        # how long a refusal takes
+        if not token or not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode('utf-8'),
+                ('Bearer ' + token).encode('utf-8')):
+            response = make_response(
+                json.dumps('Maintenance token required.'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+        return my_function(*args, **kws)
+    return decorated_function
+
+
 # Helper functions for finding plant items
 def getCategoryPlant(category_name, plant_name):
     """ Given a plant name and its category, this helper function
     returns the plant object if it already exists in the database or
-    None if it does not
+    None if it does not. The plant comes from the plant cache, with its
+    category and creator loaded.
     """
-    try:
-        category = db_session.query(PlantCategory).filter_by(
-            name=category_name).one()
-        plant = db_session.query(PlantItem).filter_by(name=plant_name,
-            category_id=category.id).one()
+    plant = cachedLookup(plant_cache, plant_name,
+        lambda session: session.query(PlantItem).options(
+            joinedload(PlantItem.category),
+            joinedload(PlantItem.user)).filter_by(name=plant_name).first())
+    if plant is not None and plant.category is not None and \
+            plant.category.name == category_name:
         return plant
-    except:
-        return None
+    return None
+
+def getCategories():
+    """ Return all the plant categories, from the cache when possible """
+    return cachedLookup(category_cache, 'all',
+        lambda session: session.query(PlantCategory).all())
+
+def getCategoryPage(category, after=None, before=None,
+        page_size=CATEGORY_PAGE_SIZE):
+    """ Return (plants, previous, more): one page of the category's plants
+    in id order, the plants following the id after or, given before, the
+    plants preceding that id, and whether there are plants on a previous
+    and on a following page. Each page is a keyset query on the category
+    and plant ids, which the category_id index answers directly, so a
+    page costs the same however many plants the category holds.
+    """
+    query = db_session.query(PlantItem).filter(
+        PlantItem.category_id == category.id)
+    if before is not None:
+        plants = query.filter(PlantItem.id < before).order_by(
+            PlantItem.id.desc()).limit(page_size + 1).all()
+        previous = len(plants) > page_size
+        return plants[:page_size][::-1], previous, True
+    if after is not None:
+        query = query.filter(PlantItem.id > after)
+    plants = query.order_by(PlantItem.id).limit(page_size + 1).all()
+    return plants[:page_size], after is not None, len(plants) > page_size
 
 def getPlantByName(plant_name):
     """ Given a plant name, this helper function returns the plant object
@@ -266,81 +664,366 @@ def nameConflict(old_plant, new_name):
     return db_plant and db_plant.id != old_plant.id
 
 
+# The columns of PlantItem.serialize, for reading plants as plain rows
+PLANT_ROW_FIELDS = ['name', 'id', 'botanical_name', 'description', 'image',
+    'category']
+PLANT_ROW_COLUMNS = [PlantItem.name, PlantItem.id, PlantItem.botanical_name,
+    PlantItem.description, PlantItem.image,
+    PlantCategory.name.label('category')]
+
+
+def plantRowDicts(rows):
+    """ Turn plant rows of PLANT_ROW_COLUMNS into the dictionaries that
+    PlantItem.serialize would return
+    """
+    return [dict(zip(PLANT_ROW_FIELDS, row)) for row in rows]
+
+
+def iterPlantRowBatches(after=0, batch_size=PLANTS_STREAM_BATCH):
+    """ Generator that walks the plant catalog in id order, yielding lists
+    of at most batch_size serialized plants. The plants are read as plain
+    column tuples, with no ORM objects built for them. Each batch is a
+    fresh keyset query (id > last id seen), so memory stays flat no matter
+    how large the catalog is.
+    """
+    while True:
+        rows = db_session.query(*PLANT_ROW_COLUMNS).outerjoin(
+            PlantItem.category).filter(PlantItem.id > after).order_by(
+            PlantItem.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield plantRowDicts(rows)
+        after = rows[-1].id
+
+
+def getCategoryPlantRows(category_name):
+    """ Return the serialized plants of the named category, in id order,
+    read as plain rows in one query. Returns None if there is no such
+    category.
+    """
+    rows = db_session.query(PlantCategory.id.label('category_id'),
+        *PLANT_ROW_COLUMNS).outerjoin(PlantCategory.plants).filter(
+        PlantCategory.name == category_name).order_by(PlantItem.id).all()
+    if not rows:
+        return None
+    return plantRowDicts(row[1:] for row in rows if row.id is not None)
+
+
+def getCategoryPlantRow(category_name, plant_name):
+    """ Return the serialized plant with the given name and category,
+    read as a plain row in one query, or None if there is no such plant
+    """
+    row = db_session.query(*PLANT_ROW_COLUMNS).join(
+        PlantItem.category).filter(PlantItem.name == plant_name,
+        PlantCategory.name == category_name).first()
+    if row is None:
+        return None
+    return plantRowDicts([row])[0]
+
+
+def getChanges(since, limit):
+    """ Return (changes, more): the latest change to each plant changed
+    after version since, taking at most limit changes in version order,
+    with the plants that still exist loaded, and whether there are more
+    changes after them.
+    """
+    changes = db_session.query(PlantChange).filter(
+        PlantChange.version > since).order_by(
+        PlantChange.version).limit(limit + 1).all()
+    more = len(changes) > limit
+    latest = {}
+    for change in changes[:limit]:
+        latest[change.plant_id] = change
+    changes = sorted(latest.values(), key=lambda change: change.version)
+    plant_ids = [change.plant_id for change in changes if not change.deleted]
+    plants = {}
+    if plant_ids:
+        for plant in db_session.query(PlantItem).options(
+                joinedload(PlantItem.category)).filter(
+                PlantItem.id.in_(plant_ids)):
+            plants[plant.id] = plant
+    return [(change, plants.get(change.plant_id)) for change in changes], more
+
+
+def hasSearchIndex():
+    """ Check whether the database has the plant_search full-text index """
+    return schema_cache.getOrLoad('plant_search',
+        lambda: 'plant_search' in inspect(getEngine()).get_table_names())
+
+def escapeLike(text):
+    """ Escape the LIKE wildcards in text, with backslash as the escape
+    character, so it only matches itself
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+
+def searchPlants(query_text, limit=SEARCH_RESULTS_SIZE, query=None):
+    """ Find plants whose name, botanical name or description contain
+    words starting with each word of the query. Results are ranked with
+    matches in the names weighted above matches in the description.
+    Returns the plants with their categories loaded, or the rows of the
+    given query of plants, such as one of PLANT_ROW_COLUMNS.
+    """
+    words = re.findall(r'\w+', query_text, re.UNICODE)
+    if not words:
+        return []
+    if query is None:
+        query = db_session.query(PlantItem).options(
+            joinedload(PlantItem.category))
+    if not hasSearchIndex():
+        # No full-text index, so fall back to a (slow) substring scan
+        for word in words:
+            pattern = '%' + escapeLike(word) + '%'
+            query = query.filter(or_(
+                PlantItem.name.like(pattern, escape='\\'),
+                PlantItem.botanical_name.like(pattern, escape='\\'),
+                PlantItem.description.like(pattern, escape='\\')))
+        return query.order_by(PlantItem.name).limit(limit).all()
+    match = ' '.join('"%s"*' % word for word in words)
+    ranked_ids = [row[0] for row in db_session.execute(text(
+        "SELECT rowid FROM plant_search WHERE plant_search MATCH :match "
+        "ORDER BY bm25(plant_search, 10.0, 5.0, 1.0) LIMIT :limit"),
+        {'match': match, 'limit': limit})]
+    if not ranked_ids:
+        return []
+    plants = query.filter(PlantItem.id.in_(ranked_ids)).all()
+    rank = dict((plant_id, i) for i, plant_id in enumerate(ranked_ids))
+    return sorted(plants, key=lambda plant: rank[plant.id])
+
+def getSearchArgs():
+    """ Read the search text and result limit from the request """
+    query_text = request.args.get('q', '')
+    limit = request.args.get('limit', SEARCH_RESULTS_SIZE, type=int)
+    return query_text, max(1, min(limit, SEARCH_RESULTS_MAX))
+
+
 # API Endpoint handlers
 # Show JSON for All plants
-@app.route('/catalog/JSON/')
+@catalog.route('/catalog/JSON/')
+@cachedResponse
+@readOnly
+@negotiated
 def allPlantsJSON():
-    """ This page returns a JSON API for all Plants in the catalog """
-    plants = db_session.query(PlantItem).all()
-    return jsonify(Plants = [i.serialize for i in plants])
+    """ This page returns a JSON API for all Plants in the catalog
+
+    Query parameters:
+        limit: return one page of at most limit plants, plus the cursor
+            for the next page ("next", null on the last page)
+        after: cursor (plant id) that the page starts after
+        format: "ndjson" streams one plant per line instead of a
+            single JSON document
+    Without limit or after, the whole catalog is streamed as one
+    {"Plants": [...]} document written incrementally; a client that asks
+    for MessagePack gets a stream of one MessagePack map per plant.
+    """
+    after = request.args.get('after', 0, type=int)
+    if request.args.get('format') == 'ndjson':
+        def generateLines():
+            for batch in iterPlantRowBatches(after):
+                yield ''.join(dumpJSON(plant) + '\n' for plant in batch)
+        return Response(stream_with_context(generateLines()),
+            mimetype=NDJSON_MIMETYPE)
+
+    if 'limit' in request.args or 'after' in request.args:
+        limit = request.args.get('limit', PLANTS_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, PLANTS_PAGE_MAX))
+        # Fetch one extra plant to find out if there is another page
+        plants = next(iterPlantRowBatches(after, limit + 1), [])
+        next_cursor = plants[limit - 1]['id'] if len(plants) > limit \
+            else None
+        return apiResponse({'Plants': plants[:limit], 'next': next_cursor})
+
+    if apiFormat() == 'msgpack':
+        def generateMaps():
+            for batch in iterPlantRowBatches(after):
+                yield b''.join(dumpMsgpack(plant) for plant in batch)
+        response = Response(stream_with_context(generateMaps()),
+            mimetype=MSGPACK_MIMETYPES[0])
+        response.vary.add('Accept')
+        return response
+
+    def generateDocument():
+        yield '{"Plants":['
+        separator = ''
+        for batch in iterPlantRowBatches(after):
+            yield separator + ','.join(dumpJSON(plant) for plant in batch)
+            separator = ','
+        yield ']}'
+    response = Response(stream_with_context(generateDocument()),
+        mimetype='application/json')
+    response.vary.add('Accept')
+    return response
+
+
+# Show JSON for the changes to the catalog
+@catalog.route('/catalog/changes/')
+@cachedResponse
+@readOnly
+@queryBudget(2)
+def changesJSON():
+    """ This page returns a JSON API for the plants created, edited or
+    deleted since a version of the catalog
 
+    Query parameters:
+        since: version the client is up to date with; without it only
+            the latest version is returned, with no changes
+        limit: most changes to return (more are returned as "more": true)
+    Returns {"version": v, "more": bool, "changes": [...]}, where each
+    change is either {"version", "id", "deleted": false, "plant": {...}}
+    with the plant as it is now, or a tombstone {"version", "id", "name",
+    "deleted": true} for a deleted plant. A plant changed several times
+    is returned once, at its latest version. Clients ask again with since
+    set to the returned version until "more" is false.
 
-# Show JSON for a category of plants
-@app.route('/catalog/<path:category_name>/JSON/')
+    A new client reads the version first, then the whole catalog from
+    /catalog/JSON/, then the changes since that version. Feed writes are
+    serialized on the catalog_state row, so a change never commits with
+    a version below one a client has already been given.
+    """
+    if 'since' not in request.args:
+        version = db_session.query(func.max(PlantChange.version)).scalar()
+        return jsonify(version = version or 0, more = False, changes = [])
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', CHANGES_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, CHANGES_PAGE_MAX))
+    changes, more = getChanges(since, limit)
+    entries = []
+    for change, plant in changes:
+        if plant is None:
+            # Deleted, possibly by a later change than this one
+            entries.append({'version': change.version,
+                'id': change.plant_id, 'name': change.name, 'deleted': True})
+        else:
+            entries.append({'version': change.version,
+                'id': change.plant_id, 'deleted': False,
+                'plant': plant.serialize})
+    version = changes[-1][0].version if changes else since
+    return jsonify(version = version, more = more, changes = entries)
+
+
+# Show JSON for a category of plants. The category name can't hold a slash
+# here, or the rule would also match every plant's JSON URL, and it is a
+# segment rather than a string so the plant page rule can't take it either.
+@catalog.route('/catalog/<segment:category_name>/JSON/')
+@cachedResponse
+@readOnly
+@queryBudget(1)
+@negotiated
 def categoryJSON(category_name):
     """ This page returns a JSON API for all plants in the given category """
-    try:
-        category = db_session.query(PlantCategory).filter_by(name=category_name).one()
-        plants = db_session.query(PlantItem).filter_by(category_id=category.id).all()
-        return jsonify(Plants = [i.serialize for i in plants])
-    except:
+    plants = getCategoryPlantRows(category_name)
+    if plants is None:
         flash("Category: %s is not in catalog" % category_name)
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
+    return apiResponse({'Plants': plants})
 
 
 # Show JSON for a particular plant item
-@app.route('/catalog/<path:category_name>/<path:plant_name>/JSON/')
+@catalog.route('/catalog/<path:category_name>/<path:plant_name>/JSON/')
+@cachedResponse
+@readOnly
+@queryBudget(1)
+@negotiated
 def plantJSON(category_name, plant_name):
     """ This page returns a JSON API for a particular plant item """
-    try:
-        plant = getCategoryPlant(category_name, plant_name)
-        return jsonify(Plant = plant.serialize)
-    except:
+    plant = getCategoryPlantRow(category_name, plant_name)
+    if plant is None:
         flash("Category: %s, Plant: %s is not in catalog" % (category_name, plant_name))
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
+    return apiResponse({'Plant': plant})
+
+
+# Show JSON for a plant search
+@catalog.route('/catalog/search/JSON/')
+@cachedResponse
+@readOnly
+@queryBudget(3)
+@negotiated
+def searchJSON():
+    """ This page returns a JSON API for the plants matching the search
+    text in the "q" query parameter, best matches first
+    """
+    query_text, limit = getSearchArgs()
+    plants = searchPlants(query_text, limit, db_session.query(
+        *PLANT_ROW_COLUMNS).outerjoin(PlantItem.category))
+    return apiResponse({'Plants': plantRowDicts(plants)})
 
 
 # Main catalog page handler - Shows All Categories & Recent Plants
-@app.route('/')
-@app.route('/catalog/')
+@catalog.route('/')
+@catalog.route('/catalog/')
+@cachedResponse
+@readOnly
+@queryBudget(2)
 def showCategories():
     """ This page shows all the plant categories along with the most
     recently added plant items
     """
-    categories = db_session.query(PlantCategory).all()
-    plants = db_session.query(PlantItem).order_by(PlantItem.id.desc()).limit(6)
-    return render_template('categories.html', categories=categories, plants=plants)
+    # Both are only called if their section of the page isn't cached
+    def latestPlants():
+        return db_session.query(PlantItem).options(
+            joinedload(PlantItem.category)).order_by(
+            PlantItem.id.desc()).limit(6).all()
+    return render_template('categories.html', categories=getCategories,
+        latest_plants=latestPlants)
 
 
 # Show Category page handler
-@app.route('/catalog/<path:category_name>/')
+@catalog.route('/catalog/<path:category_name>/')
+@cachedResponse
+@readOnly
+@queryBudget(2)
 def showCategory(category_name):
-    """ This page shows all the plant items for the given category """
-    try:
-        category = db_session.query(PlantCategory).filter_by(name=category_name).one()
-        plants = db_session.query(PlantItem).filter_by(category_id=category.id).all()
-        return render_template('category.html', category=category, plants=plants)
-    except:
+    """ This page shows the plant items for the given category, a page
+    at a time. The "after" and "before" query parameters hold the id of
+    the last plant on the page before, or the first on the page after.
+    """
+    category = db_session.query(PlantCategory).filter_by(
+        name=category_name).first()
+    if category is None:
         flash("Category: %s is not in catalog" % category_name)
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
+    plants, previous, more = getCategoryPage(category,
+        request.args.get('after', type=int),
+        request.args.get('before', type=int))
+    return render_template('category.html', category=category,
+        plants=plants, previous=previous, more=more)
 
 
 # Show a single plant item page handler
-@app.route('/catalog/<path:category_name>/<path:plant_name>/')
+@catalog.route('/catalog/<path:category_name>/<path:plant_name>/')
+@cachedResponse
+@readOnly
+@queryBudget(1)
 def showPlantItem(category_name, plant_name):
     """ This page shows all the details for the given plant item """
     try:
         plant = getCategoryPlant(category_name, plant_name)
-        creator = db_session.query(User).filter_by(id=plant.user_id).one()
+        creator = plant.user
         return render_template('plant.html', plant=plant, creator=creator)
     except:
         flash("Category: %s, Plant: %s is not in catalog" % (category_name, plant_name))
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
+
+
+# Search page handler
+@catalog.route('/catalog/search/')
+@cachedResponse
+@readOnly
+@queryBudget(3)
+def showSearch():
+    """ This page shows the plants matching the search text in the "q"
+    query parameter, best matches first
+    """
+    query_text, limit = getSearchArgs()
+    plants = searchPlants(query_text, limit)
+    return render_template('search.html', query=query_text, plants=plants)
 
 
 # Page handler for creating a new plant item
-@app.route('/catalog/newplant/', methods=['GET', 'POST'])
+@catalog.route('/catalog/newplant/', methods=['GET', 'POST'])
 @login_required
+@queryBudget(7)
 def newPlant():
     """ This page is for creating a new plant item """
     # Process request
@@ -348,16 +1031,24 @@ def newPlant():
         # Check for required data
         if not request.form['name']:
             flash("Create new plant failed! You must enter a plant name.")
-            return redirect(url_for('showCategories'))
+            return redirect(url_for('.showCategories'))
         # Check if we already have an entry by that plant_name
-        plant_name = bleach.clean(request.form['name'])
+        plant_name = sanitize(request.form['name'])
         if getPlantByName(plant_name):
             flash("Create new plant failed! Plant item %s already exists" % plant_name)
-            return redirect(url_for('showCategories'))
+            return redirect(url_for('.showCategories'))
         # We have unique plant name, so add new plant to database
-        botanical_name = bleach.clean(request.form['botanical_name'])
-        image = bleach.clean(request.form['image'])
-        description = bleach.clean(request.form['description'])
+        botanical_name = sanitize(request.form['botanical_name'])
+        image = sanitize(request.form['image'])
+        # An uploaded image takes the place of an image URL
+        upload = request.files.get('image_file')
+        if upload and upload.filename:
+            try:
+                image = storeUpload(upload.stream)
+            except ImageError as e:
+                flash("Create new plant failed! %s" % e)
+                return redirect(url_for('.showCategories'))
+        description = sanitize(request.form['description'])
         # NOTE: A category is assigned by default in the form, if not chosen
         category_name = request.form['category']
         category = db_session.query(PlantCategory).filter_by(
@@ -369,99 +1060,387 @@ def newPlant():
             user_id = user_id)
         db_session.add(newPlantItem)
         db_session.commit()
+        invalidatePlants(plant_name)
+        readPrimaryAfterWrite()
         # redirect to Plant page
         flash("New Plant %s successfully created" % newPlantItem.name)
-        return redirect(url_for('showPlantItem', category_name=category_name,
+        return redirect(url_for('.showPlantItem', category_name=category_name,
             plant_name=newPlantItem.name))
     else:
         # Display new plant page
-        categories = db_session.query(PlantCategory).all()
+        categories = getCategories()
         return render_template('newplant.html', categories=categories)
 
 
 # Edit a plant item page handler
-@app.route('/catalog/<path:plant_name>/edit/', methods=['GET', 'POST'])
+@catalog.route('/catalog/<path:plant_name>/edit/', methods=['GET', 'POST'])
 @login_required
+@queryBudget(8)
 def editPlant(plant_name):
     """ This page is for editing the given plant item """
     # Retrieve plant information
     try:
-        editedPlant = db_session.query(PlantItem).filter_by(
-            name=plant_name).one()
+        editedPlant = db_session.query(PlantItem).options(
+            joinedload(PlantItem.category)).filter_by(name=plant_name).one()
     except:
         flash("Edit failed! Plant: %s is not in catalog" % plant_name)
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
     # check for ownership
     if login_session['user_id'] != editedPlant.user_id:
         flash("Edit permission denied: User is not owner of %s" % plant_name)
-        return redirect(url_for('showPlantItem',
+        return redirect(url_for('.showPlantItem',
             category_name=editedPlant.category.name,
             plant_name=plant_name))
     # Process request
     if request.method == 'POST':
         # Get data from input form
         if request.form['name']:
-            new_name = bleach.clean(request.form['name'])
+            new_name = sanitize(request.form['name'])
             # Check new name for collisions in database, abort on collision
             if nameConflict(editedPlant, new_name):
                 flash("Edit permission denied: Plant item %s already exists" % new_name)
-                return redirect(url_for('showPlantItem',
+                return redirect(url_for('.showPlantItem',
                     category_name=editedPlant.category.name,
                     plant_name=plant_name))
             else:
                 editedPlant.name = new_name
         if request.form['botanical_name']:
-            editedPlant.botanical_name = bleach.clean(request.form['botanical_name'])
+            editedPlant.botanical_name = sanitize(request.form['botanical_name'])
         if request.form['image']:
-            editedPlant.image = bleach.clean(request.form['image'])
+            editedPlant.image = sanitize(request.form['image'])
+        upload = request.files.get('image_file')
+        if upload and upload.filename:
+            try:
+                editedPlant.image = storeUpload(upload.stream)
+            except ImageError as e:
+                flash("Edit failed! %s" % e)
+                return redirect(url_for('.showPlantItem',
+                    category_name=editedPlant.category.name,
+                    plant_name=plant_name))
         if request.form['description']:
-            editedPlant.description = bleach.clean(request.form['description'])
+            editedPlant.description = sanitize(request.form['description'])
         if request.form['category']:
             category_name = request.form['category']
-            category = db_session.query(PlantCategory).filter_by(
-                name=category_name).one()
+            # Flush the edit once, with the category move, at the commit
+            with db_session.no_autoflush:
+                category = db_session.query(PlantCategory).filter_by(
+                    name=category_name).one()
             editedPlant.category_id = category.id
         # update Plant database entry
         db_session.add(editedPlant)
         db_session.commit()
+        invalidatePlants(plant_name, editedPlant.name)
+        readPrimaryAfterWrite()
         # redirect to Plant page
         flash("Plant %s successfully edited" % editedPlant.name)
-        return redirect(url_for('showPlantItem', category_name=category_name,
+        return redirect(url_for('.showPlantItem', category_name=category_name,
             plant_name=editedPlant.name))
     else:
-        categories = db_session.query(PlantCategory).all()
+        categories = getCategories()
         return render_template('editplant.html', categories=categories,
             plant=editedPlant)
 
 
 # Delete a plant item page handler
-@app.route('/catalog/<path:plant_name>/delete/', methods=['GET', 'POST'])
+@catalog.route('/catalog/<path:plant_name>/delete/', methods=['GET', 'POST'])
 @login_required
+@queryBudget(5)
 def deletePlant(plant_name):
     """ This page is for deleting the given plant item """
     # Retrieve plant information
     try:
-        delPlant = db_session.query(PlantItem).filter_by(name=plant_name).one()
+        delPlant = db_session.query(PlantItem).options(
+            joinedload(PlantItem.category)).filter_by(name=plant_name).one()
     except:
         flash("Delete failed! Plant: %s is not in catalog" % plant_name)
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
     # check for ownership
     if login_session['user_id'] != delPlant.user_id:
         flash("Delete permission denied: User is not owner of %s" % plant_name)
-        return redirect(url_for('showPlantItem',
+        return redirect(url_for('.showPlantItem',
             category_name=delPlant.category.name,
             plant_name=plant_name))
     # Process request
     if request.method == 'POST':
         db_session.delete(delPlant)
         db_session.commit()
+        invalidatePlants(plant_name)
+        readPrimaryAfterWrite()
         flash("Plant %s successfully deleted" % plant_name)
-        return redirect(url_for('showCategories'))
+        return redirect(url_for('.showCategories'))
     else:
         return render_template('deleteplant.html', plant=delPlant)
 
 
+def validateBatchItem(item, category_ids):
+    """ Check and sanitize one plant of a batch write. Returns
+    (fields, error): the sanitized plant fields and category_id given
+    in the item, or an error message.
+    """
+    if not isinstance(item, dict):
+        return None, 'Each plant must be a JSON object'
+    fields = {}
+    for field, length in PLANT_FIELD_LENGTHS.items():
+        value = item.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, string_types):
+            return None, '%s must be a string' % field
+        value = sanitize(value)
+        if len(value) > length:
+            return None, '%s is longer than %d characters' % (field, length)
+        fields[field] = value
+    if 'category' in item:
+        if not isinstance(item['category'], string_types):
+            return None, 'category must be a string'
+        if item['category'] not in category_ids:
+            return None, 'Category %s is not in catalog' % item['category']
+        fields['category_id'] = category_ids[item['category']]
+    if item.get('id') is not None and (isinstance(item['id'], bool) or
+            not isinstance(item['id'], int)):
+        return None, 'id must be an integer'
+    if item.get('id') is None and 'name' not in fields:
+        return None, 'Each plant needs a name or an id'
+    if 'name' in fields and not fields['name']:
+        return None, 'name can not be empty'
+    return fields, None
+
+
+def writePlantBatch(items, user_id):
+    """ Create or update the plants described by items, a list of
+    dictionaries of plant fields, in one transaction. An item with an
+    "id" updates that plant; one without updates the plant with its name
+    if there is one, and otherwise creates it. Only the user's own plants
+    can be updated. Returns a result dictionary for each item; the items
+    with errors are left out of the transaction.
+    """
+    category_ids = dict((category.name, category.id)
+        for category in getCategories())
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        fields, error = validateBatchItem(item, category_ids)
+        results.append({'index': index, 'status': 'error', 'error': error}
+            if error else None)
+        if not error:
+            valid.append((index, item.get('id'), fields))
+
+    # Load every plant the batch names or updates, in one query
+    names = set(fields['name'] for index, plant_id, fields in valid
+        if 'name' in fields)
+    ids = set(plant_id for index, plant_id, fields in valid
+        if plant_id is not None)
+    existing = db_session.query(PlantItem).filter(or_(
+        PlantItem.name.in_(names), PlantItem.id.in_(ids))).all() \
+        if names or ids else []
+    by_name = dict((plant.name, plant) for plant in existing)
+    by_id = dict((plant.id, plant) for plant in existing)
+
+    # A name is taken by the plant that has it now, or by the first item
+    # of the batch to claim it
+    claimed = {}
+    changed_names = set()
+    batch_plants = set()
+    written = []
+    for index, plant_id, fields in valid:
+        if plant_id is not None:
+            plant = by_id.get(plant_id)
+            if plant is None:
+                results[index] = {'index': index, 'status': 'error',
+                    'error': 'Plant %d is not in catalog' % plant_id}
+                continue
+        else:
+            plant = by_name.get(fields['name'])
+        if plant in batch_plants:
+            results[index] = {'index': index, 'status': 'error',
+                'error': 'Plant %s is already in this batch' % plant.name}
+            continue
+        new_name = fields.get('name', plant.name if plant else None)
+        holder = by_name.get(new_name)
+        if (holder is not None and holder is not plant) or \
+                claimed.get(new_name, plant) is not plant:
+            results[index] = {'index': index, 'status': 'error',
+                'error': 'Plant item %s already exists' % new_name}
+            continue
+        if plant is not None and plant.user_id != user_id:
+            results[index] = {'index': index, 'status': 'error',
+                'error': 'User is not owner of %s' % plant.name}
+            continue
+        if plant is None and 'category_id' not in fields:
+            results[index] = {'index': index, 'status': 'error',
+                'error': 'A new plant needs a category'}
+            continue
+        if plant is None:
+            plant = PlantItem(user_id=user_id, **fields)
+            db_session.add(plant)
+            status = 'created'
+        else:
+            changed_names.add(plant.name)
+            for field, value in fields.items():
+                setattr(plant, field, value)
+            status = 'updated'
+        claimed[new_name] = plant
+        changed_names.add(new_name)
+        batch_plants.add(plant)
+        written.append((index, plant, status))
+
+    if not written:
+        return results
+    try:
+        db_session.flush()
+        # Read the new ids now, as committing expires every plant
+        saved = [(index, {'index': index, 'status': status, 'id': plant.id,
+            'name': plant.name}) for index, plant, status in written]
+        db_session.commit()
+    except IntegrityError:
+        # Another request took one of the names meanwhile
+        db_session.rollback()
+        for index, plant, status in written:
+            results[index] = {'index': index, 'status': 'error',
+                'error': 'Conflicting write, nothing was saved'}
+        return results
+    invalidatePlants(*changed_names)
+    readPrimaryAfterWrite()
+    for index, result in saved:
+        results[index] = result
+    return results
+
+
+# Batch create and update plant items
+@catalog.route('/catalog/JSON/batch/', methods=['POST'])
+@apiLoginRequired
+def batchPlantsJSON():
+    """ This endpoint creates or updates many plant items at once. The
+    request body is a JSON array (or {"Plants": [...]}) of at most
+    BATCH_MAX plants, each with any of the fields name, botanical_name,
+    description, image and category, plus the id of the plant to update
+    if it is being renamed. Returns {"results": [...]} with one entry per
+    plant, in order: its status ("created", "updated" or "error") and
+    either its id and name or the error.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('Plants')
+    if not isinstance(data, list):
+        response = make_response(json.dumps(
+            'Expected a JSON array of plants.'), 400)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+    if len(data) > BATCH_MAX:
+        response = make_response(json.dumps(
+            'At most %d plants per batch.' % BATCH_MAX), 413)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+    results = writePlantBatch(data, login_session['user_id'])
+    return jsonify(results = results)
+
+
+def runMaintenance(operation, *args):
+    """ Run one of the set-based operations of "maintenance.py" in the
+    request's transaction and commit it. Returns a JSON response with the
+    number of plants affected, or a 404 naming what wasn't found.
+    """
+    try:
+        count = operation(db_session.connection(), *args)
+    except MaintenanceError as e:
+        db_session.rollback()
+        response = make_response(json.dumps(str(e)), 404)
+        response.headers['Content-Type'] = 'application/json'
+        return response
+    db_session.commit()
+    invalidateCatalog()
+    return jsonify(plants = count)
+
+
+def maintenanceArgs():
+    """ Return the JSON object in the body of a maintenance request, or
+    an empty one
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+
+# Bulk maintenance API
+@catalog.route('/catalog/maintenance/delete-category/', methods=['POST'])
+@maintenanceTokenRequired
+@queryBudget(5)
+def deleteCategoryJSON():
+    """ This endpoint deletes the category named by "category" in the
+    JSON request body, with all its plants
+    """
+    return runMaintenance(deleteCategory,
+        maintenanceArgs().get('category'))
+
+
+@catalog.route('/catalog/maintenance/reassign/', methods=['POST'])
+@maintenanceTokenRequired
+@queryBudget(5)
+def reassignPlantsJSON():
+    """ This endpoint gives every plant of the user whose email is "from"
+    in the JSON request body to the user whose email is "to"
+    """
+    data = maintenanceArgs()
+    return runMaintenance(reassignPlants, data.get('from'), data.get('to'))
+
+
+@catalog.route('/catalog/maintenance/purge/', methods=['POST'])
+@maintenanceTokenRequired
+@queryBudget(5)
+def purgeCatalogJSON():
+    """ This endpoint deletes every plant, and every category and user
+    too when "categories" and "users" are true in the JSON request body
+    """
+    data = maintenanceArgs()
+    return runMaintenance(purgeCatalog, bool(data.get('categories')),
+        bool(data.get('users')))
+
+
+def create_app(config=None):
+    """ Create the plant catalog application, updating its Flask config
+    with the given dictionary. Templates are compiled and the database
+    mappings set up here, ahead of any request, since that work is safe
+    to share with forked workers; nothing connects to the database.
+    """
+    app = Flask(__name__)
+    app.secret_key = settings.get('SECRET_KEY')
+    if config:
+        app.config.update(config)
+    # Compiled templates are kept on disk, so a new process only compiles
+    # templates that changed
+    if settings.get('TEMPLATE_BYTECODE_CACHE'):
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            settings.get('TEMPLATE_CACHE_DIR'))
+    catalog_version.load = loadCatalogVersion
+    registerFragmentCache(app, fragmentVersion)
+    # Registered before any other after_request hook, so that responses
+    # are compressed once everything else is done with them
+    if settings.get('COMPRESSION'):
+        registerCompression(app, settings.get('COMPRESSION_MIN_SIZE'), {
+            'gzip': settings.get('COMPRESSION_GZIP_LEVEL'),
+            'br': settings.get('COMPRESSION_BR_LEVEL'),
+            'zstd': settings.get('COMPRESSION_ZSTD_LEVEL')})
+    app.session_interface = createSessionInterface(
+        settings.get('SESSION_STORE'), settings.get('SESSION_LOCATION'),
+        settings.get('SESSION_LIFETIME'))
+    registerAssets(app)
+    registerImages(app)
+    app.url_map.converters['segment'] = SegmentConverter
+    app.register_blueprint(catalog)
+    app.teardown_appcontext(removeSession)
+    app.after_request(checkQueryBudget)
+    # Optional per-request timings, metrics and profiling
+    if settings.get('INSTRUMENTATION'):
+        registerInstrumentation(app, cacheStats,
+            profile_token=settings.get('PROFILE_TOKEN'),
+            profile_interval=settings.get('PROFILE_INTERVAL'))
+    configure_mappers()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    return app
+
+
 if __name__ == '__main__':
-    app.secret_key = "klahhoihjbgksjhaiuwth190333485"
+    app = create_app()
+    app.secret_key = app.secret_key or "klahhoihjbgksjhaiuwth190333485"
     app.debug = True
     app.run(host='0.0.0.0', port=8000)
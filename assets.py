@@ -0,0 +1,69 @@
+""" Python code for serving the fingerprinted static assets built by
+"build_assets.py".
+
+Once registered with the application:
+    - url_for('static', filename=...) produces the fingerprinted URL of
+      any file listed in the asset manifest
+    - the "asset" template filter does the same for literal /static/ URLs,
+      such as the sample plant images stored in the database
+    - fingerprinted files are served with a cache-forever Cache-Control
+      header, picking a precompressed .br or .gz variant when the client
+      accepts it
+
+Without a manifest (build_assets.py hasn't been run) URLs are left as they
+are and Flask's normal static file handling applies.
+"""
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+
+from config import WatchedJSONFile
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Precompressed variants, in order of preference
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def registerAssets(app):
+    """ Hook the asset manifest into the given Flask application """
+    dist_dir = os.path.join(app.static_folder, 'dist')
+    manifest = WatchedJSONFile(os.path.join(dist_dir, 'manifest.json'))
+    prefix = app.static_url_path + '/'
+
+    @app.url_defaults
+    def hashedStaticUrl(endpoint, values):
+        """ Point url_for('static', ...) at the fingerprinted file """
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.load().get(values['filename'],
+                values['filename'])
+
+    @app.template_filter('asset')
+    def assetUrl(path):
+        """ Map a literal /static/ URL to its fingerprinted URL """
+        if path and path.startswith(prefix):
+            hashed = manifest.load().get(path[len(prefix):])
+            if hashed:
+                return prefix + hashed
+        return path
+
+    def serveAsset(filename):
+        """ Serve a fingerprinted file, precompressed when possible """
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        response = None
+        for encoding, extension in ENCODINGS:
+            if request.accept_encodings[encoding] > 0 and \
+                    os.path.isfile(os.path.join(dist_dir, filename + extension)):
+                response = send_from_directory(dist_dir, filename + extension,
+                    mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(dist_dir, filename,
+                mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.add_url_rule(prefix + 'dist/<path:filename>', 'asset', serveAsset)
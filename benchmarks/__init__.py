@@ -0,0 +1,12 @@
+""" Benchmarks for the plant catalog application.
+
+Run each benchmark as a module from the catalog directory, for example
+"python -m benchmarks.lookups":
+    synthetic - builds synthetic catalogs for the other benchmarks
+    lookups - times the hot lookup queries with and without indexes
+    micro - times the lookup helpers in application.py
+    export - times the JSON API's read path per exported plant
+    render - times template compilation and rendering of the home page
+    load - load tests every route, with login through "oauth_stub.py"
+    startup - times worker start-up under a preforking server
+"""
@@ -0,0 +1,103 @@
+""" Benchmark for exporting plants through the JSON API read path.
+
+Compares, per exported plant, the old path (PlantItem ORM objects with
+their categories joined in, serialized and encoded with the json module)
+with the lean one in application.py (plain column tuples encoded with
+the fast JSON encoder of "api_format.py", or MessagePack), walking a
+synthetic catalog (see "synthetic.py") in batches as /catalog/JSON/ does.
+Reports the time per plant, and in a second pass the peak memory
+allocated while reading and encoding one batch, as measured by
+tracemalloc (so Python 3 only).
+
+Usage: python -m benchmarks.export [catalog size]
+"""
+import json
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+from sqlalchemy.orm import joinedload
+
+from benchmarks.synthetic import getCatalog, loadApplication
+from database_setup import PlantItem, createEngine
+
+PLANTS = 100000
+BATCH_SIZE = 500
+
+
+def ormBatches(application, after=0):
+    """ The read path before plain rows: ORM objects, serialized """
+    db_session = application.db_session
+    while True:
+        batch = db_session.query(PlantItem).options(
+            joinedload(PlantItem.category)).filter(
+            PlantItem.id > after).order_by(PlantItem.id).limit(
+            BATCH_SIZE).all()
+        if not batch:
+            return
+        yield [plant.serialize for plant in batch]
+        after = batch[-1].id
+
+
+def rowBatches(application, after=0):
+    return application.iterPlantRowBatches(after, BATCH_SIZE)
+
+
+def timeExport(batches, encode):
+    """ Encode every plant, returning (plants, seconds) """
+    count = 0
+    start = default_timer()
+    for batch in batches:
+        for plant in batch:
+            encode(plant)
+        count += len(batch)
+    return count, default_timer() - start
+
+
+def peakBatchMemory(batches, encode):
+    """ Return the most memory allocated while reading and encoding any
+    one batch
+    """
+    batches = iter(batches)
+    peak = 0
+    while True:
+        tracemalloc.start()
+        batch = next(batches, None)
+        if batch is None:
+            tracemalloc.stop()
+            return peak
+        for plant in batch:
+            encode(plant)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else PLANTS
+    getCatalog(size)
+    directory = tempfile.mkdtemp()
+    try:
+        application = loadApplication(directory)
+        import api_format
+        engine = createEngine('sqlite:///' + getCatalog(size))
+        application.DBSession.configure(bind=engine)
+        paths = [('ORM + json', ormBatches, json.dumps),
+            ('rows + %s' % ('ujson' if api_format.ujson else 'json'),
+                rowBatches, api_format.dumpJSON)]
+        if api_format.msgpack is not None:
+            paths.append(('rows + msgpack', rowBatches,
+                api_format.dumpMsgpack))
+        print('%-16s %10s %14s %16s' % ('path', 'plants', 'us per plant',
+            'peak/batch (KB)'))
+        for name, batches, encode in paths:
+            count, seconds = timeExport(batches(application), encode)
+            application.db_session.remove()
+            peak = peakBatchMemory(batches(application), encode)
+            application.db_session.remove()
+            print('%-16s %10d %14.2f %16.1f' % (name, count,
+                seconds / count * 1000000, peak / 1024.0))
+        engine.dispose()
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,410 @@
+""" Load test for every route in the catalog application.
+
+Serves a copy of a synthetic catalog (see "synthetic.py") from a local
+threaded server, with login going through the stub OAuth server in
+"oauth_stub.py", and runs a number of simulated users against it at
+once. In each round a user:
+    - reads the home, category, plant and search pages and their JSON
+      endpoints while logged out (so the response cache can answer them)
+    - catches up with the change feed
+    - logs in and reads the same pages again
+    - creates, edits and deletes a plant of its own
+    - writes a batch of plants of its own (created in the first round,
+      updated in later ones)
+    - logs out
+Every route in application.py is covered; any that isn't hit is listed
+after the run, and fails it.
+
+Reports the p50 and p99 latency of each route, the overall throughput
+and the peak memory of the process, and compares them with a stored
+baseline. A route missing from the baseline fails the comparison, so a
+new route can't go unchecked; record the baseline again with --save
+after adding one. The baseline is only meaningful on the machine that
+recorded it, so record a fresh one with --save before comparing changes.
+
+Usage: python -m benchmarks.load [--plants N] [--users N] [--rounds N]
+           [--baseline FILE] [--save] [--tolerance FRACTION]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from timeit import default_timer
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+try:
+    import resource
+except ImportError:
+    resource = None
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.oauth_stub import startStub, useStub
+from benchmarks.synthetic import copyCatalog, loadApplication, WORDS
+from benchmarks.synthetic import plantCategory, plantName
+
+PLANTS = 1000
+USERS = 8
+ROUNDS = 10
+# Plants in each batch write
+WRITE_BATCH_SIZE = 10
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'load_baseline.json')
+# Fraction by which a latency, throughput or memory figure may be worse
+# than the baseline before it counts as a regression
+TOLERANCE = 0.25
+# Routes that aren't catalog pages, and the bulk maintenance API, which
+# would empty the catalog under test
+SKIPPED_ENDPOINTS = ['static', 'asset', 'metrics', 'deleteCategoryJSON',
+    'reassignPlantsJSON', 'purgeCatalogJSON']
+STATE_PATTERN = re.compile(r'gconnect\?state=(\w+)')
+
+
+def percentile(values, percent):
+    """ Return the given percentile of a sorted list (nearest rank) """
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * len(values) + 0.5))
+    return values[max(0, min(rank, len(values)) - 1)]
+
+
+def peakMemory():
+    """ Return the peak resident memory of this process in MB, or None
+    where that can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        peak /= 1024.0
+    return round(peak / 1024.0, 1)
+
+
+class Recorder(object):
+    """ Collects the latency of every request, by route label """
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, failed):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds * 1000)
+            if failed:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def fail(self, message):
+        with self._lock:
+            self.failures.append(message)
+
+    def endpoints(self):
+        """ Return the set of endpoints that were hit """
+        return set(label.split()[0] for label in self.latencies)
+
+
+class SimulatedUser(object):
+    """ One user of the catalog, with a Google account and a browser
+    session of its own
+    """
+    def __init__(self, number, base_url, plants, recorder):
+        self.number = number
+        self.account = 'loaduser%d' % number
+        self.base_url = base_url
+        self.plants = plants
+        self.recorder = recorder
+        self.rng = random.Random(number)
+        self.session = requests.Session()
+        self.created = 0
+        self.since = None
+
+    def request(self, label, method, path, **kwargs):
+        """ Make a request without following redirects and record how long
+        it took. Server errors and failed connections count as errors.
+        """
+        start = default_timer()
+        try:
+            response = self.session.request(method, self.base_url + path,
+                allow_redirects=False, **kwargs)
+            response.content
+            failed = response.status_code >= 500
+        except requests.RequestException:
+            response = None
+            failed = True
+        self.recorder.record(label, default_timer() - start, failed)
+        return response
+
+    def run(self, rounds):
+        for i in range(rounds):
+            try:
+                self.runRound()
+            except Exception as e:
+                self.recorder.fail('User %d, round %d: %r'
+                    % (self.number, i + 1, e))
+
+    def runRound(self):
+        self.readPages()
+        self.login()
+        self.readPages()
+        self.writePlant()
+        self.writeBatch()
+        self.logout()
+
+    def readPages(self):
+        number = self.rng.randint(1, self.plants)
+        category = quote(plantCategory(number))
+        plant = quote(plantName(number))
+        word = self.rng.choice(WORDS)
+        self.request('showCategories', 'GET', '/catalog/')
+        self.request('showCategory', 'GET', '/catalog/%s/' % category,
+            params={'after': self.rng.randint(0, self.plants)})
+        self.request('showPlantItem', 'GET', '/catalog/%s/%s/'
+            % (category, plant))
+        self.request('showSearch', 'GET', '/catalog/search/',
+            params={'q': word})
+        self.request('allPlantsJSON', 'GET', '/catalog/JSON/',
+            params={'limit': 100, 'after': self.rng.randint(0, self.plants)})
+        self.request('categoryJSON', 'GET', '/catalog/%s/JSON/' % category)
+        self.request('plantJSON', 'GET', '/catalog/%s/%s/JSON/'
+            % (category, plant))
+        self.request('searchJSON', 'GET', '/catalog/search/JSON/',
+            params={'q': word})
+        self.syncChanges()
+
+    def syncChanges(self):
+        """ Catch up with the change feed, as a sync client would """
+        params = {} if self.since is None else {'since': self.since}
+        response = self.request('changesJSON', 'GET', '/catalog/changes/',
+            params=params)
+        if response is not None and response.status_code == 200:
+            self.since = response.json()['version']
+
+    def login(self):
+        response = self.request('showLogin', 'GET', '/login')
+        state = STATE_PATTERN.search(response.text).group(1)
+        response = self.request('gconnect', 'POST', '/gconnect',
+            params={'state': state}, data=self.account)
+        if response.status_code != 200:
+            raise RuntimeError('Login failed with status %d'
+                % response.status_code)
+
+    def logout(self):
+        self.request('disconnect', 'GET', '/disconnect')
+
+    def writeBatch(self):
+        plants = [{'name': 'Batch plant %d-%d' % (self.number, i),
+            'botanical_name': 'Planta numerosa',
+            'description': 'Written by the load test in round %d'
+                % self.created,
+            'category': plantCategory(i)} for i in range(1, WRITE_BATCH_SIZE + 1)]
+        response = self.request('batchPlantsJSON', 'POST',
+            '/catalog/JSON/batch/', json=plants)
+        if response is not None and response.status_code == 200:
+            errors = [result['error'] for result in response.json()['results']
+                if result['status'] == 'error']
+            if errors:
+                raise RuntimeError('Batch write failed: %s' % errors[0])
+
+    def writePlant(self):
+        self.created += 1
+        name = 'Load plant %d-%d' % (self.number, self.created)
+        category = plantCategory(self.created)
+        path = quote(name)
+        self.request('newPlant', 'GET', '/catalog/newplant/')
+        self.request('newPlant POST', 'POST', '/catalog/newplant/', data={
+            'name': name, 'botanical_name': 'Planta onerosa', 'image': '',
+            'description': 'Created by the load test', 'category': category})
+        self.request('editPlant', 'GET', '/catalog/%s/edit/' % path)
+        self.request('editPlant POST', 'POST', '/catalog/%s/edit/' % path,
+            data={'name': '', 'botanical_name': '', 'image': '',
+                'description': 'Edited by the load test',
+                'category': category})
+        self.request('deletePlant', 'GET', '/catalog/%s/delete/' % path)
+        self.request('deletePlant POST', 'POST', '/catalog/%s/delete/' % path)
+
+
+def runUsers(base_url, plants, users, rounds, recorder, first_user=1):
+    """ Run the simulated users at once and return the seconds it took """
+    simulated = [SimulatedUser(number, base_url, plants, recorder)
+        for number in range(first_user, first_user + users)]
+    threads = [threading.Thread(target=user.run, args=(rounds,))
+        for user in simulated]
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return default_timer() - start
+
+
+def summarize(recorder, seconds, options):
+    """ Return the results of a run as a dictionary """
+    routes = {}
+    everything = []
+    for label, latencies in recorder.latencies.items():
+        latencies.sort()
+        everything.extend(latencies)
+        routes[label] = {'requests': len(latencies),
+            'errors': recorder.errors.get(label, 0),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p99_ms': round(percentile(latencies, 99), 2)}
+    everything.sort()
+    return {'plants': options.plants, 'users': options.users,
+        'rounds': options.rounds, 'requests': len(everything),
+        'seconds': round(seconds, 2),
+        'throughput': round(len(everything) / seconds, 1),
+        'p50_ms': round(percentile(everything, 50), 2),
+        'p99_ms': round(percentile(everything, 99), 2),
+        'peak_memory_mb': peakMemory(), 'routes': routes}
+
+
+def change(value, old):
+    """ Return the relative change from old to value """
+    if not old or value is None:
+        return 0.0
+    return (value - old) / float(old)
+
+
+def compare(results, baseline, tolerance):
+    """ Return a list of descriptions of the figures that got worse than
+    the baseline by more than tolerance, and of the routes the baseline
+    has no figures for
+    """
+    regressions = []
+    checks = [('throughput', results['throughput'],
+        baseline.get('throughput'), -1),
+        ('peak memory', results['peak_memory_mb'],
+        baseline.get('peak_memory_mb'), 1)]
+    for label, route in sorted(results['routes'].items()):
+        old = baseline.get('routes', {}).get(label)
+        if old is None:
+            regressions.append('%s: no baseline entry' % label)
+            continue
+        checks.append(('%s p50' % label, route['p50_ms'], old.get('p50_ms'),
+            1))
+        checks.append(('%s p99' % label, route['p99_ms'], old.get('p99_ms'),
+            1))
+    for name, value, old, worse in checks:
+        if change(value, old) * worse > tolerance:
+            regressions.append('%s: %s -> %s' % (name, old, value))
+    return regressions
+
+
+def report(results, baseline):
+    """ Print the results, next to the baseline's p99s when given """
+    print('%-18s %9s %7s %10s %10s %16s' % ('route', 'requests', 'errors',
+        'p50 (ms)', 'p99 (ms)', 'baseline p99'))
+    for label, route in sorted(results['routes'].items()):
+        old = (baseline or {}).get('routes', {}).get(label, {}).get('p99_ms')
+        compared = ''
+        if old:
+            compared = '%.2f (%+.0f%%)' % (old,
+                change(route['p99_ms'], old) * 100)
+        print('%-18s %9d %7d %10.2f %10.2f %16s' % (label, route['requests'],
+            route['errors'], route['p50_ms'], route['p99_ms'], compared))
+    print('%d requests in %.2f s: %.1f requests/s, p50 %.2f ms, '
+        'p99 %.2f ms' % (results['requests'], results['seconds'],
+        results['throughput'], results['p50_ms'], results['p99_ms']))
+    print('Peak memory: %s MB' % results['peak_memory_mb'])
+    if baseline:
+        print('Baseline: %.1f requests/s, p99 %.2f ms, peak memory %s MB'
+            % (baseline['throughput'], baseline['p99_ms'],
+            baseline['peak_memory_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test every route of the plant catalog.')
+    parser.add_argument('--plants', type=int, default=PLANTS,
+        help='synthetic catalog size (default %(default)s)')
+    parser.add_argument('--users', type=int, default=USERS,
+        help='simulated users at once (default %(default)s)')
+    parser.add_argument('--rounds', type=int, default=ROUNDS,
+        help='rounds per user (default %(default)s)')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+        help='baseline results to compare with (default %(default)s)')
+    parser.add_argument('--save', action='store_true',
+        help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+        help='allowed fraction worse than the baseline '
+            '(default %(default)s)')
+    options = parser.parse_args()
+    # The application runs from a temporary directory
+    options.baseline = os.path.abspath(options.baseline)
+
+    directory = tempfile.mkdtemp()
+    stub = startStub()
+    try:
+        copyCatalog(options.plants, directory)
+        useStub(stub, directory)
+        os.environ.setdefault('CATALOG_SECRET_KEY', 'load-test')
+        application = loadApplication(directory)
+        # Keep the server from logging every request
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        app = application.create_app()
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        try:
+            # Warm up the caches and templates with users of their own
+            runUsers(base_url, options.plants, options.users, 1, Recorder(),
+                first_user=options.users + 1)
+            recorder = Recorder()
+            seconds = runUsers(base_url, options.plants, options.users,
+                options.rounds, recorder)
+        finally:
+            server.shutdown()
+        # Compare endpoints without their blueprint names
+        endpoints = set(rule.endpoint.split('.')[-1]
+            for rule in app.url_map.iter_rules())
+        missed = endpoints - recorder.endpoints() - set(SKIPPED_ENDPOINTS)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(directory)
+
+    results = summarize(recorder, seconds, options)
+    baseline = None
+    if not options.save and os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    for failure in recorder.failures:
+        print('Failed: %s' % failure)
+    if missed:
+        print('Routes not covered: %s' % ', '.join(sorted(missed)))
+    if options.save:
+        if missed or recorder.failures:
+            print('Not saving a baseline from a run with failures or '
+                'routes not covered')
+            return 1
+        with open(options.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Saved baseline to %s' % options.baseline)
+        return 0
+    if baseline is None:
+        return 1 if recorder.failures or missed else 0
+    for setting in ('plants', 'users', 'rounds'):
+        if baseline.get(setting) != results[setting]:
+            print('Warning: baseline was run with %s=%s'
+                % (setting, baseline.get(setting)))
+    regressions = compare(results, baseline, options.tolerance)
+    for regression in regressions:
+        print('Regression: %s' % regression)
+    return 1 if regressions or recorder.failures or missed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+""" Benchmark for the hot lookup queries used by the catalog pages.
+
+Builds throwaway synthetic catalogs of increasing size, then times the
+lookups made by getUserID, getPlantByName, getCategoryPlant and
+showCategory first without any indexes (the old schema) and again after
+"migrate_db.py" has upgraded the database in place.
+
+Usage: python -m benchmarks.lookups [catalog size ...]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+from database_setup import Base, PlantCategory, PlantItem, User, createEngine
+from migrate_db import upgrade
+from benchmarks.synthetic import buildCatalog, CATEGORIES, NUM_USERS
+from benchmarks.synthetic import plantName, userEmail
+
+SIZES = [1000, 10000, 100000]
+LOOKUPS = 200
+
+
+def dropIndexes(engine):
+    """ Drop every index, turning the database back into the old schema """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in inspector.get_indexes(table.name):
+                connection.execute('DROP INDEX %s' % index['name'])
+
+
+def timeLookups(session, size):
+    """ Time each kind of lookup and return the mean latency in ms """
+    rng = random.Random(size)
+    lookups = [
+        ('user by email', lambda: session.query(User).filter_by(
+            email=userEmail(rng.randint(1, NUM_USERS))).one()),
+        ('category by name', lambda: session.query(PlantCategory).filter_by(
+            name=rng.choice(CATEGORIES)).one()),
+        ('plant by name', lambda: session.query(PlantItem).filter_by(
+            name=plantName(rng.randint(1, size))).one()),
+        ('plant by name and category', lambda: session.query(
+            PlantItem).filter_by(name=plantName(rng.randint(1, size)),
+            category_id=rng.randint(1, len(CATEGORIES))).first()),
+        ('plants by user', lambda: session.query(PlantItem).filter_by(
+            user_id=rng.randint(1, NUM_USERS)).limit(20).all()),
+    ]
+    results = []
+    for name, lookup in lookups:
+        start = default_timer()
+        for i in range(LOOKUPS):
+            lookup()
+        results.append((name, (default_timer() - start) * 1000 / LOOKUPS))
+        session.expunge_all()
+    return results
+
+
+def benchmark(size):
+    """ Return (lookup, ms before, ms after) rows for a catalog size """
+    directory = tempfile.mkdtemp()
+    try:
+        engine = createEngine('sqlite:///' +
+            os.path.join(directory, 'bench.db'))
+        buildCatalog(engine, size)
+        session = sessionmaker(bind=engine)()
+        dropIndexes(engine)
+        before = timeLookups(session, size)
+        upgrade(engine)
+        after = timeLookups(session, size)
+        session.close()
+        engine.dispose()
+        return [(name, old, new)
+            for (name, old), (_, new) in zip(before, after)]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    print('%-28s %10s %12s %12s %9s' % ('lookup', 'plants', 'before (ms)',
+        'after (ms)', 'speedup'))
+    for size in sizes:
+        for name, before, after in benchmark(size):
+            print('%-28s %10d %12.3f %12.3f %8.1fx' % (name, size, before,
+                after, before / after))
@@ -0,0 +1,98 @@
+""" Microbenchmarks for the lookup helpers in application.py and for
+PlantItem.serialize.
+
+Each helper is called against synthetic catalogs (see "synthetic.py") of
+the given sizes, with a fresh database session per call as in a real
+request, and the mean and p99 time per call are reported.
+getCategoryPlant is timed both with the plant cache cleared before every
+call (cold) and with the plant already cached (warm).
+
+Usage: python -m benchmarks.micro [catalog size ...]
+"""
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from sqlalchemy.orm import joinedload
+
+from benchmarks.synthetic import getCatalog, loadApplication
+from benchmarks.synthetic import plantCategory, plantName
+from benchmarks.load import percentile
+from database_setup import PlantItem, createEngine
+
+SIZES = [1000, 100000]
+CALLS = 1000
+
+
+def timeCalls(call, setup=None):
+    """ Time CALLS calls of call(i), running setup() untimed before each
+    one. Returns (mean, p99) in microseconds.
+    """
+    timings = []
+    for i in range(CALLS):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        call(i)
+        timings.append((default_timer() - start) * 1000000)
+    timings.sort()
+    return sum(timings) / len(timings), percentile(timings, 99)
+
+
+def benchmark(application, size):
+    """ Return (helper, mean, p99) rows for a catalog size """
+    engine = createEngine('sqlite:///' + getCatalog(size))
+    application.db_session.remove()
+    application.DBSession.configure(bind=engine)
+    application.plant_cache.clear()
+    db_session = application.db_session
+    rng = random.Random(size)
+    numbers = [rng.randint(1, size) for i in range(CALLS)]
+    plants = db_session.query(PlantItem).options(
+        joinedload(PlantItem.category)).filter(
+        PlantItem.id.in_(numbers[:500])).all()
+    old_plant = plants[0]
+
+    def lookupPlant(i):
+        number = numbers[i]
+        application.getCategoryPlant(plantCategory(number), plantName(number))
+
+    def lookupSamePlant(i):
+        application.getCategoryPlant(plantCategory(1), plantName(1))
+
+    results = [
+        ('getPlantByName',) + timeCalls(lambda i:
+            application.getPlantByName(plantName(numbers[i])),
+            db_session.remove),
+        ('getPlantByName (missing)',) + timeCalls(lambda i:
+            application.getPlantByName('No such plant'), db_session.remove),
+        ('nameConflict',) + timeCalls(lambda i:
+            application.nameConflict(old_plant, plantName(numbers[i])),
+            db_session.remove),
+        ('getCategoryPlant (cold)',) + timeCalls(lookupPlant,
+            application.plant_cache.clear),
+        ('getCategoryPlant (warm)',) + timeCalls(lookupSamePlant),
+        ('PlantItem.serialize',) + timeCalls(lambda i:
+            plants[i % len(plants)].serialize),
+    ]
+    db_session.remove()
+    engine.dispose()
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    for size in sizes:
+        getCatalog(size)
+    directory = tempfile.mkdtemp()
+    try:
+        application = loadApplication(directory)
+        print('%-26s %10s %12s %12s' % ('helper', 'plants', 'mean (us)',
+            'p99 (us)'))
+        for size in sizes:
+            for name, mean, p99 in benchmark(application, size):
+                print('%-26s %10d %12.1f %12.1f' % (name, size, mean, p99))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,135 @@
+""" A local stand-in for Google's OAuth endpoints, so the load driver can
+log in without talking to Google.
+
+The stub accepts any authorization code. The code names the user, so
+code "alice" logs in as alice@example.com and every load driver user can
+have a Google account of its own:
+    POST /token      exchanges a code for an access token and an
+                     (unsigned) id_token
+    GET  /tokeninfo  describes an access token
+    GET  /userinfo   returns the token user's profile
+    GET  /revoke     revokes an access token
+
+The application is pointed at the stub with the CATALOG_GOOGLE_*
+settings and a client secrets file whose token_uri is the stub's (see
+useStub).
+
+Usage: python -m benchmarks.oauth_stub [port]
+"""
+import base64
+import json
+import os
+import sys
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+CLIENT_ID = 'benchmark-client.apps.googleusercontent.com'
+CLIENT_SECRET = 'benchmark-secret'
+TOKEN_PREFIX = 'stub-token-'
+TOKEN_LIFETIME = 3600
+
+
+def encodeSegment(data):
+    """ Encode a dictionary as a JWT segment """
+    text = base64.urlsafe_b64encode(json.dumps(data).encode('utf-8'))
+    return text.decode('ascii').rstrip('=')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answers the OAuth requests made by "oauth_client.py" """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        if urlparse(self.path).path != '/token' or not form.get('code'):
+            return self.reply(400, {'error': 'invalid_request'})
+        user = form['code'][0]
+        id_token = '.'.join([encodeSegment({'alg': 'none'}),
+            encodeSegment({'sub': user, 'aud': CLIENT_ID,
+                'email': user + '@example.com'}), 'signature'])
+        self.reply(200, {'access_token': TOKEN_PREFIX + user,
+            'token_type': 'Bearer', 'expires_in': TOKEN_LIFETIME,
+            'id_token': id_token})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        token = (query.get('access_token') or query.get('token') or [''])[0]
+        if not token.startswith(TOKEN_PREFIX):
+            return self.reply(400, {'error': 'invalid_token'})
+        user = token[len(TOKEN_PREFIX):]
+        if url.path == '/tokeninfo':
+            self.reply(200, {'user_id': user, 'issued_to': CLIENT_ID,
+                'audience': CLIENT_ID, 'expires_in': TOKEN_LIFETIME})
+        elif url.path == '/userinfo':
+            self.reply(200, {'name': user,
+                'picture': '/static/images/blank_user.gif',
+                'email': user + '@example.com'})
+        elif url.path == '/revoke':
+            self.reply(200, {})
+        else:
+            self.reply(404, {'error': 'not_found'})
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def startStub(port=0):
+    """ Start the stub in a background thread and return its server.
+    Port 0 picks a free port.
+    """
+    server = StubServer(('127.0.0.1', port), StubHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def useStub(server, directory):
+    """ Point the application's settings at the stub server, writing its
+    client secrets into directory. Must be called before "config.py" is
+    imported.
+    """
+    base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    secrets_file = os.path.join(directory, 'client_secrets.json')
+    with open(secrets_file, 'w') as f:
+        json.dump({'web': {'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'auth_uri': base_url + '/auth',
+            'token_uri': base_url + '/token',
+            'redirect_uris': [], 'javascript_origins': []}}, f)
+    os.environ['CATALOG_CLIENT_SECRETS_FILE'] = secrets_file
+    os.environ['CATALOG_GOOGLE_TOKENINFO_URL'] = base_url + '/tokeninfo'
+    os.environ['CATALOG_GOOGLE_USERINFO_URL'] = base_url + '/userinfo'
+    os.environ['CATALOG_GOOGLE_REVOKE_URL'] = base_url + '/revoke'
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    server = StubServer(('127.0.0.1', port), StubHandler)
+    print('Stub OAuth server on http://127.0.0.1:%d' % port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
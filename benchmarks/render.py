@@ -0,0 +1,89 @@
+""" Benchmark for template compilation and page rendering.
+
+Times, against a synthetic catalog (see "synthetic.py"):
+    compile  - loading every template with nothing cached, as a fresh
+               process does, and loading them from a warm bytecode cache
+    render   - the home page for a logged-in visitor (who the response
+               cache doesn't serve), with the fragment cache cleared
+               before every request and with it warm
+and reports the mean and p99 time of each in milliseconds.
+
+Usage: python -m benchmarks.render [repeats]
+"""
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from jinja2 import FileSystemBytecodeCache
+
+from benchmarks.load import percentile
+from benchmarks.synthetic import copyCatalog, loadApplication
+
+PLANTS = 1000
+REPEATS = 200
+
+
+def timeRepeats(call, repeats, setup=None):
+    """ Return (mean, p99) milliseconds for repeats calls of call() """
+    timings = []
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        call()
+        timings.append((default_timer() - start) * 1000)
+    timings.sort()
+    return sum(timings) / len(timings), percentile(timings, 99)
+
+
+def loadTemplates(environment):
+    """ Load every page template through an environment that keeps no
+    templates in memory, so each one is compiled or read from the
+    bytecode cache
+    """
+    for name in environment.list_templates(extensions=['html']):
+        environment.get_template(name)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else REPEATS
+    directory = tempfile.mkdtemp()
+    try:
+        copyCatalog(PLANTS, directory)
+        application = loadApplication(directory)
+        app = application.create_app()
+        app.secret_key = app.secret_key or 'render-benchmark'
+
+        uncached = app.jinja_env.overlay(cache_size=0, bytecode_cache=None)
+        bytecode_cache = FileSystemBytecodeCache(
+            tempfile.mkdtemp(dir=directory))
+        cached = app.jinja_env.overlay(cache_size=0,
+            bytecode_cache=bytecode_cache)
+        loadTemplates(cached)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = 'Render Benchmark'
+
+        def getHome():
+            response = client.get('/catalog/')
+            if response.status_code != 200:
+                raise RuntimeError('The home page returned %d'
+                    % response.status_code)
+
+        getHome()
+        results = [
+            ('compile (no cache)',) + timeRepeats(
+                lambda: loadTemplates(uncached), repeats // 10 or 1),
+            ('compile (bytecode)',) + timeRepeats(
+                lambda: loadTemplates(cached), repeats // 10 or 1),
+            ('home page (cold)',) + timeRepeats(getHome, repeats,
+                application.fragment_cache.clear),
+            ('home page (warm)',) + timeRepeats(getHome, repeats),
+        ]
+        print('%-20s %10s %10s' % ('step', 'mean (ms)', 'p99 (ms)'))
+        for name, mean, p99 in results:
+            print('%-20s %10.2f %10.2f' % (name, mean, p99))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,89 @@
+""" Benchmark for worker start-up under a preforking server.
+
+Times two ways of starting a worker against a synthetic catalog (see
+"synthetic.py"):
+    cold     - a fresh interpreter imports application.py, creates the
+               application and serves its first request
+    preload  - the application is created once in this process, then
+               each worker is forked from it and serves its first request,
+               as with gunicorn --preload
+Workers are started one at a time, so the figures don't depend on the
+number of CPUs. Also checks that creating the application didn't connect
+to the database before the fork.
+
+Usage: python -m benchmarks.startup [workers]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+from benchmarks.synthetic import copyCatalog, loadApplication
+
+WORKERS = 8
+PLANTS = 1000
+FIRST_REQUEST = '/catalog/Annuals/'
+COLD_START = ('import application; '
+    'application.create_app().test_client().get(%r)' % FIRST_REQUEST)
+
+
+def timeColdStarts(workers, directory):
+    """ Return the seconds taken by each of the cold-started workers """
+    timings = []
+    for i in range(workers):
+        start = default_timer()
+        subprocess.check_call([sys.executable, '-c', COLD_START],
+            cwd=directory, env=dict(os.environ,
+                PYTHONPATH=os.pathsep.join(sys.path)))
+        timings.append(default_timer() - start)
+    return timings
+
+
+def timePreloadedStarts(app, workers):
+    """ Return the seconds taken by each of the forked workers, from the
+    fork to the end of its first request
+    """
+    timings = []
+    for i in range(workers):
+        start = default_timer()
+        pid = os.fork()
+        if pid == 0:
+            status = app.test_client().get(FIRST_REQUEST).status_code
+            os._exit(0 if status == 200 else 1)
+        os.waitpid(pid, 0)
+        timings.append(default_timer() - start)
+    return timings
+
+
+def describe(name, timings):
+    print('%-8s %10.1f %10.1f %10.1f' % (name,
+        min(timings) * 1000, sum(timings) / len(timings) * 1000,
+        max(timings) * 1000))
+
+
+if __name__ == '__main__':
+    if not hasattr(os, 'fork'):
+        sys.exit('This benchmark needs os.fork')
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS
+    os.environ.setdefault('CATALOG_SECRET_KEY', 'startup-benchmark')
+    directory = tempfile.mkdtemp()
+    try:
+        copyCatalog(PLANTS, directory)
+        application = loadApplication(directory)
+        cold = timeColdStarts(workers, directory)
+        start = default_timer()
+        app = application.create_app()
+        preload_time = default_timer() - start
+        connected = bool(application._engines)
+        preloaded = timePreloadedStarts(app, workers)
+        print('%-8s %10s %10s %10s' % ('start', 'min (ms)', 'mean (ms)',
+            'max (ms)'))
+        describe('cold', cold)
+        describe('preload', preloaded)
+        print('Creating the application took %.1f ms and %s the database'
+            % (preload_time * 1000,
+            'connected to' if connected else 'did not connect to'))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,142 @@
+""" Synthetic plant catalogs for the benchmarks.
+
+Builds catalogs of any size from the models in "database_setup.py", with
+the same shape as the real catalog: a handful of categories, many users,
+and plants whose descriptions are drawn from a fixed vocabulary so search
+has something to find. The same size always gives the same catalog.
+
+Catalogs are slow to build at the larger sizes, so getCatalog keeps each
+one in a cache directory and later runs copy it from there.
+
+Usage: python -m benchmarks.synthetic [catalog size ...]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+from timeit import default_timer
+
+from database_setup import Base, PlantCategory, PlantItem, User, \
+    createEngine, refreshPlantCounts
+
+SIZES = [1000, 100000, 1000000]
+BATCH_SIZE = 10000
+NUM_USERS = 100
+CATEGORIES = ['Annuals', 'Bulbs', 'Ground Covers', 'Perennials', 'Shrubs',
+    'Trees', 'Vines']
+IMAGES = ['/static/images/astilbe.JPG', '/static/images/coreopsis.JPG',
+    '/static/images/cosmos.JPG', '/static/images/daffodil.jpg',
+    '/static/images/daylily.JPG', '/static/images/fuchsia.JPG',
+    '/static/images/honeysuckle.JPG']
+WORDS = ['bloom', 'blue', 'border', 'bright', 'compact', 'drought',
+    'evergreen', 'fern', 'flower', 'foliage', 'fragrant', 'garden', 'hardy',
+    'leaf', 'low', 'native', 'orange', 'partial', 'perennial', 'pink',
+    'purple', 'red', 'scented', 'shade', 'soil', 'spring', 'summer', 'sun',
+    'tall', 'tolerant', 'tropical', 'water', 'white', 'wild', 'yellow']
+DESCRIPTION_WORDS = 30
+# Bump when the generated data or the tables change, so cached catalogs
+# are rebuilt
+GENERATOR_VERSION = 5
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'catalog-benchmarks')
+
+
+def userEmail(number):
+    """ Return the email of the given synthetic user (1 to NUM_USERS) """
+    return 'user%d@example.com' % number
+
+
+def plantName(number):
+    """ Return the name of the given synthetic plant (1 to size) """
+    return 'Plant %d' % number
+
+
+def plantCategory(number):
+    """ Return the category name of the given synthetic plant """
+    return CATEGORIES[number % len(CATEGORIES)]
+
+
+def iterPlants(size, rng):
+    """ Generator that yields the rows of size synthetic plants """
+    for i in range(1, size + 1):
+        yield {'name': plantName(i), 'botanical_name': 'Planta %d' % i,
+            'description': ' '.join(rng.choice(WORDS)
+                for j in range(DESCRIPTION_WORDS)),
+            'image': IMAGES[i % len(IMAGES)],
+            'category_id': i % len(CATEGORIES) + 1,
+            'user_id': i % NUM_USERS + 1}
+
+
+def buildCatalog(engine, size, batch_size=BATCH_SIZE):
+    """ Fill an empty database with size synthetic plants, inserting them
+    in batches within a single transaction
+    """
+    Base.metadata.create_all(engine)
+    rng = random.Random(size)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            {'name': 'User %d' % i, 'email': userEmail(i),
+                'picture': '/static/images/blank_user.gif'}
+            for i in range(1, NUM_USERS + 1)])
+        connection.execute(PlantCategory.__table__.insert(), [
+            {'id': i + 1, 'name': name} for i, name in enumerate(CATEGORIES)])
+        batch = []
+        for plant in iterPlants(size, rng):
+            batch.append(plant)
+            if len(batch) == batch_size:
+                connection.execute(PlantItem.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(PlantItem.__table__.insert(), batch)
+        refreshPlantCounts(connection)
+
+
+def getCatalog(size):
+    """ Return the file name of the cached catalog of the given size,
+    building it first if there isn't one. Copy the file before writing
+    to it.
+    """
+    path = os.path.join(CACHE_DIR, 'catalog-v%d-%d.db'
+        % (GENERATOR_VERSION, size))
+    if not os.path.exists(path):
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        # Build under a temporary name so an interrupted build isn't used
+        temporary = path + '.building'
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        engine = createEngine('sqlite:///' + temporary)
+        buildCatalog(engine, size)
+        engine.dispose()
+        os.rename(temporary, path)
+    return path
+
+
+def copyCatalog(size, directory):
+    """ Copy the catalog of the given size into directory as
+    "plantcatalog.db" and return the copy's file name
+    """
+    target = os.path.join(directory, 'plantcatalog.db')
+    shutil.copyfile(getCatalog(size), target)
+    return target
+
+
+def loadApplication(directory):
+    """ Import application.py with directory as the working directory, so
+    it serves the plantcatalog.db found there. Returns the module.
+    """
+    catalog_dir = os.path.abspath(os.getcwd())
+    if catalog_dir not in sys.path:
+        sys.path.insert(0, catalog_dir)
+    os.chdir(directory)
+    import application
+    return application
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    for size in sizes:
+        start = default_timer()
+        path = getCatalog(size)
+        print('%d plants: %s (%.1f s)' % (size, path,
+            default_timer() - start))
@@ -0,0 +1,160 @@
+""" Python code to build the fingerprinted static assets.
+
+Copies every file under static/ into static/dist/ with a hash of its
+contents in the file name (e.g. styles.css becomes styles.1f2e3d4c5b6a.css)
+and writes static/dist/manifest.json, which maps each original name to
+its fingerprinted one. Stylesheets are built last, with their url()
+references rewritten to the fingerprinted names, so the images they use
+are cached forever too. Text assets also get precompressed .gz variants
+(and .br variants when the brotli module is installed) so they never
+have to be compressed per request.
+
+Since a fingerprinted file's contents never change, the application
+serves them with a cache-forever Cache-Control header (see "assets.py").
+Run this again whenever a static file changes.
+
+Usage: python build_assets.py
+"""
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_FILE = os.path.join(DIST_DIR, 'manifest.json')
+# Directories under static/ that aren't part of the build
+SKIP_DIRS = ['dist', 'uploads']
+# File types worth precompressing
+TEXT_EXTENSIONS = ['.css', '.js', '.svg', '.html', '.json', '.txt']
+# File types whose url() references point at other assets
+STYLESHEET_EXTENSIONS = ['.css']
+HASH_LENGTH = 12
+STATIC_URL = '/static/'
+URL_PATTERN = re.compile(r'''url\(\s*(['"]?)([^'"()\s]+)\1\s*\)''')
+
+
+def fingerprint(path):
+    """ Return a short hash of the file's contents """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def rewriteUrls(name, data, manifest):
+    """ Return the stylesheet data with its url() references pointing at
+    the fingerprinted files in the manifest. References are /static/ URLs
+    or relative to the stylesheet's name; other sites, data: URLs and
+    files missing from the manifest are left as they are.
+    """
+    directory = posixpath.dirname(name)
+
+    def replaceUrl(match):
+        quote, url = match.groups()
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        if path.startswith(STATIC_URL):
+            path = path[len(STATIC_URL):]
+        elif ':' in path or path.startswith('/'):
+            return match.group(0)
+        else:
+            path = posixpath.normpath(posixpath.join(directory, path))
+        hashed = manifest.get(path)
+        if hashed is None:
+            return match.group(0)
+        return 'url(%s%s%s%s%s)' % (quote, STATIC_URL, hashed, suffix, quote)
+    return URL_PATTERN.sub(replaceUrl, data.decode('utf-8')).encode('utf-8')
+
+
+def findAssets():
+    """ Generator that yields the path of every source asset, relative to
+    the static directory and with '/' separators
+    """
+    for directory, subdirs, files in os.walk(STATIC_DIR):
+        relative = os.path.relpath(directory, STATIC_DIR)
+        if relative == '.':
+            subdirs[:] = [d for d in subdirs if d not in SKIP_DIRS]
+            relative = ''
+        for name in sorted(files):
+            yield os.path.join(relative, name).replace(os.sep, '/')
+
+
+def precompress(path):
+    """ Write .gz (and .br) variants of the file next to it, keeping only
+    the ones that come out smaller
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', lambda: gzipBytes(data))]
+    if brotli is not None:
+        variants.append(('.br', lambda: brotli.compress(data)))
+    for extension, compress in variants:
+        compressed = compress()
+        if len(compressed) < len(data):
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+
+
+def gzipBytes(data):
+    """ Gzip data at the highest compression level, with a fixed mtime so
+    rebuilds give identical files
+    """
+    buffer = BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+            mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def build():
+    """ Fingerprint all the assets and write the manifest. Returns the
+    manifest dictionary.
+    """
+    manifest = {}
+    # Stylesheets go last, so the files they refer to are in the manifest
+    names = sorted(findAssets(), key=lambda name:
+        os.path.splitext(name)[1].lower() in STYLESHEET_EXTENSIONS)
+    for name in names:
+        source = os.path.join(STATIC_DIR, name)
+        base, extension = os.path.splitext(name)
+        data = None
+        if extension.lower() in STYLESHEET_EXTENSIONS:
+            # The hash covers the rewritten references, so the stylesheet
+            # gets a new name whenever a file it uses changes
+            with open(source, 'rb') as f:
+                data = rewriteUrls(name, f.read(), manifest)
+            digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        else:
+            digest = fingerprint(source)
+        hashed = '%s.%s%s' % (base, digest, extension)
+        target = os.path.join(DIST_DIR, hashed)
+        if not os.path.exists(target):
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            if data is None:
+                shutil.copyfile(source, target)
+            else:
+                with open(target, 'wb') as f:
+                    f.write(data)
+            if extension.lower() in TEXT_EXTENSIONS:
+                precompress(target)
+        manifest[name] = 'dist/' + hashed
+    with open(MANIFEST_FILE, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = build()
+    print('Built %d assets into %s' % (len(manifest), DIST_DIR))
@@ -0,0 +1,113 @@
+""" Python code for the in-process caches used by the plant catalog.
+
+Each web server process keeps its own caches, so an entry can be stale in
+one process after another process changes the database. Entries expire
+after a time-to-live to bound how long that can last, and entries loaded
+for a version (such as the catalog version every process reads from the
+database) are only used while that version is current.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ A bounded, thread-safe, least-recently-used cache whose entries
+    also expire ttl seconds after they were stored
+
+    Attributes:
+        max_size (int): maximum number of entries kept
+        ttl (float): seconds an entry stays valid, or None to never expire
+        hits, misses, evictions (int): running cache statistics
+    """
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """ Return the cached value for key, or default if it is missing
+        or has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    # Move the entry to the most recently used end
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """ Store value under key, evicting the least recently used entry
+        if the cache is full
+        """
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def getOrLoad(self, key, loader, version=None):
+        """ Return the cached value for key, calling loader() to produce
+        and store it on a miss. A value stored for another version counts
+        as a miss. None is never stored, so a lookup that found nothing
+        is tried again next time.
+        """
+        entry = self.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        value = loader()
+        if value is not None:
+            self.set(key, (version, value))
+        return value
+
+    def invalidate(self, key):
+        """ Drop the entry for key, if there is one """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Drop every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def purge(self, predicate):
+        """ Drop every entry whose value predicate(value) is true for, as
+        well as any that have expired. Returns how many were dropped.
+        """
+        now = time.time()
+        with self._lock:
+            doomed = [key for key, (value, expires) in self._entries.items()
+                if (expires is not None and expires <= now) or
+                predicate(value)]
+            for key in doomed:
+                del self._entries[key]
+        return len(doomed)
+
+    def stats(self):
+        """ Return the cache statistics as a dictionary """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,388 @@
+""" Python code to bulk load plant items into the plant catalog database and
+to export them again.
+
+Plants are read and written as a stream of records with the fields name,
+botanical_name, description, image, category (category name) and owner
+(email address of the user who owns the entry). Supported formats are
+CSV, NDJSON (one JSON record per line) and JSON (either a list of records
+or the {"Plants": [...]} document served by /catalog/JSON/).
+
+Imports run in a single transaction and write the plants with batched
+executemany inserts. Categories and owners that aren't in the database yet
+are created. Plants whose name is already taken are skipped, and so are
+records that the plant forms would refuse: ones without a name or a
+category, with a field that isn't text, or with a field longer than its
+column. Imported plants are recorded in the change feed, like plants
+created any other way.
+
+Dependencies: "database_setup.py"
+
+Usage:
+    python catalog_io.py import plants.csv
+    python catalog_io.py export plants.ndjson
+    python catalog_io.py export - --format json > plants.json
+"""
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+from timeit import default_timer
+
+import bleach
+from sqlalchemy import select
+
+from database_setup import Base, PlantCategory, PlantItem, User, \
+    createEngine, recordMatchingPlantChanges, updatePlantCounts, \
+    PLANT_FIELD_LENGTHS
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+FIELDS = ['name', 'botanical_name', 'description', 'image', 'category',
+    'owner']
+TEXT_FIELDS = ['name', 'botanical_name', 'description', 'image']
+BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 65536
+# Characters that bleach.clean may rewrite. Text without any of them comes
+# back from bleach unchanged, so it can skip the (slow) HTML parse.
+UNSAFE_CHARS = re.compile(u'[<>&\x00-\x08\x0b-\x1f\x7f]')
+
+plant_table = PlantItem.__table__
+category_table = PlantCategory.__table__
+user_table = User.__table__
+# Longest value each field can hold
+FIELD_LENGTHS = dict(PLANT_FIELD_LENGTHS,
+    category=category_table.c.name.type.length,
+    owner=user_table.c.email.type.length)
+
+
+# Helpers for reading and writing text on both Python 2 and 3
+def toText(value):
+    """ Decode byte strings (as read by the Python 2 csv module) """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def toNative(value):
+    """ Encode text for the Python 2 csv module, which only takes bytes """
+    if str is bytes and value is not None:
+        return value.encode('utf-8')
+    return value
+
+
+def openStream(path, mode):
+    """ Open the named file for reading or writing text, with '-' meaning
+    standard input or output
+    """
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    if str is bytes:
+        # The Python 2 csv and json modules want byte streams
+        return open(path, mode + 'b')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def guessFormat(path):
+    """ Work out the file format from the file name extension """
+    for extension in ('ndjson', 'csv', 'json'):
+        if path.lower().endswith('.' + extension):
+            return extension
+    return 'ndjson'
+
+
+def sanitize(value):
+    """ Clean a text field the same way the plant forms do """
+    if value and UNSAFE_CHARS.search(value):
+        return bleach.clean(value)
+    return value or None
+
+
+# Record readers
+def readCSV(stream):
+    """ Generator that yields the records in a CSV file with a header row """
+    for row in csv.DictReader(stream):
+        yield dict((toText(key), toText(value)) for key, value in row.items())
+
+
+def readNDJSON(stream):
+    """ Generator that yields the records in an NDJSON file """
+    for line in stream:
+        line = toText(line).strip()
+        if line:
+            yield json.loads(line)
+
+
+def readJSON(stream):
+    """ Generator that yields the records in a JSON list, or in the list
+    held by a {"Plants": [...]} document, decoding one record at a time
+    so the whole file never has to be held in memory
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    at_end = False
+
+    def fill(buffer, position):
+        chunk = toText(stream.read(JSON_CHUNK_SIZE))
+        return buffer[position:] + chunk, 0, not chunk
+
+    # Skip ahead to the opening bracket of the list
+    while '[' not in buffer:
+        if at_end:
+            raise ValueError('No list of plants found')
+        buffer, position, at_end = fill(buffer, len(buffer))
+    position = buffer.index('[') + 1
+    while True:
+        # Skip whitespace and separators between records
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            if at_end:
+                raise ValueError('Unexpected end of JSON input')
+            buffer, position, at_end = fill(buffer, position)
+            continue
+        if buffer[position] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # The record runs past the end of the buffer
+            if at_end:
+                raise
+            buffer, position, at_end = fill(buffer, position)
+            continue
+        position = end
+        yield record
+
+
+READERS = {'csv': readCSV, 'ndjson': readNDJSON, 'json': readJSON}
+
+
+# Record writers
+def writeCSV(stream, records):
+    writer = csv.DictWriter(stream, FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(dict((key, toNative(value))
+            for key, value in record.items()))
+
+
+def writeNDJSON(stream, records):
+    for record in records:
+        stream.write(toText(json.dumps(record)) + u'\n')
+
+
+def writeJSON(stream, records):
+    stream.write(u'{"Plants": [')
+    separator = u''
+    for record in records:
+        stream.write(separator + toText(json.dumps(record)))
+        separator = u', '
+    stream.write(u']}\n')
+
+
+WRITERS = {'csv': writeCSV, 'ndjson': writeNDJSON, 'json': writeJSON}
+
+
+def iterBatches(records, batch_size):
+    """ Group the records into lists of at most batch_size """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def lookupIds(connection, table, column, values):
+    """ Map each of the given column values to its row id """
+    if not values:
+        return {}
+    rows = connection.execute(select([column, table.c.id]).where(
+        column.in_(values)))
+    return dict((value, row_id) for value, row_id in rows)
+
+
+def validateRecord(record, owner):
+    """ Check and sanitize one imported record. Returns (row, error): the
+    record's sanitized plant fields, category and owner, or an error
+    message.
+    """
+    if not isinstance(record, dict):
+        return None, 'Each plant must be a JSON object'
+    row = {}
+    for field in FIELDS:
+        value = record.get(field)
+        if value is not None and not isinstance(value, string_types):
+            return None, '%s must be a string' % field
+        if field in TEXT_FIELDS:
+            value = sanitize(value)
+        row[field] = value or None
+    for field, length in FIELD_LENGTHS.items():
+        if row[field] is not None and len(row[field]) > length:
+            return None, '%s is longer than %d characters' % (field, length)
+    if not row['name']:
+        return None, 'Each plant needs a name'
+    if not row['category']:
+        return None, 'A new plant needs a category'
+    row['owner'] = row['owner'] or owner
+    return row, None
+
+
+def importPlants(engine, records, owner=None, batch_size=BATCH_SIZE):
+    """ Insert the plant records into the database in a single transaction.
+    Records without an owner are assigned to the given owner email.
+    Returns a (number imported, number skipped, errors) tuple, where
+    errors lists the (record number, error message) of each record that
+    was refused; the records are numbered from 1.
+    """
+    imported = skipped = 0
+    errors = []
+    category_ids = {}
+    user_ids = {}
+    with engine.begin() as connection:
+        for batch_number, batch in enumerate(iterBatches(records,
+                batch_size)):
+            rows = []
+            for index, record in enumerate(batch):
+                row, error = validateRecord(record, owner)
+                if error:
+                    errors.append((batch_number * batch_size + index + 1,
+                        error))
+                    skipped += 1
+                else:
+                    rows.append(row)
+
+            # Drop plants whose names are already taken
+            taken = set(lookupIds(connection, plant_table, plant_table.c.name,
+                set(row['name'] for row in rows)))
+            new_rows = []
+            for row in rows:
+                if row['name'] in taken:
+                    skipped += 1
+                else:
+                    taken.add(row['name'])
+                    new_rows.append(row)
+
+            # Resolve category names and owner emails, creating new ones
+            addMissing(connection, category_table, category_table.c.name,
+                category_ids, [row['category'] for row in new_rows],
+                lambda name: {'name': name})
+            addMissing(connection, user_table, user_table.c.email, user_ids,
+                [row['owner'] for row in new_rows],
+                lambda email: {'name': email, 'email': email})
+
+            if new_rows:
+                connection.execute(plant_table.insert(), [{
+                    'name': row['name'],
+                    'botanical_name': row['botanical_name'],
+                    'description': row['description'],
+                    'image': row['image'],
+                    'category_id': category_ids.get(row['category']),
+                    'user_id': user_ids.get(row['owner'])
+                } for row in new_rows])
+                counts = {}
+                for row in new_rows:
+                    category_id = category_ids.get(row['category'])
+                    counts[category_id] = counts.get(category_id, 0) + 1
+                counts.pop(None, None)
+                updatePlantCounts(connection, counts)
+                recordMatchingPlantChanges(connection, plant_table.c.name.in_(
+                    [row['name'] for row in new_rows]))
+            imported += len(new_rows)
+    return imported, skipped, errors
+
+
+def addMissing(connection, table, column, known_ids, values, newRow):
+    """ Fill in known_ids with the ids of the given values, inserting rows
+    built by newRow for the values that aren't in the table yet
+    """
+    wanted = set(value for value in values
+        if value and value not in known_ids)
+    if not wanted:
+        return
+    known_ids.update(lookupIds(connection, table, column, wanted))
+    missing = [value for value in wanted if value not in known_ids]
+    if missing:
+        connection.execute(table.insert(), [newRow(value)
+            for value in missing])
+        known_ids.update(lookupIds(connection, table, column, missing))
+
+
+def exportPlants(engine, batch_size=BATCH_SIZE):
+    """ Generator that yields a record for every plant in the catalog, in
+    id order, reading batch_size plants at a time
+    """
+    query = select([plant_table.c.id, plant_table.c.name,
+        plant_table.c.botanical_name, plant_table.c.description,
+        plant_table.c.image, category_table.c.name.label('category'),
+        user_table.c.email.label('owner')]).select_from(
+        plant_table.outerjoin(category_table).outerjoin(user_table)).order_by(
+        plant_table.c.id).limit(batch_size)
+    after = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(
+                query.where(plant_table.c.id > after)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield dict((field, row[field]) for field in FIELDS)
+        after = rows[-1]['id']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Bulk import or export plant catalog items')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('file', help="file to read or write, '-' for "
+        "standard input or output")
+    parser.add_argument('--format', choices=sorted(READERS),
+        help='file format (default: guessed from the file name)')
+    parser.add_argument('--database',
+        help='database URL (default: the DATABASE_URL setting)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--owner', help='email of the owner for imported '
+        'plants that have none')
+    args = parser.parse_args(argv)
+
+    engine = createEngine(args.database)
+    file_format = args.format or guessFormat(args.file)
+    start = default_timer()
+    if args.command == 'import':
+        # Importing into a new database creates its tables first
+        Base.metadata.create_all(engine)
+        stream = openStream(args.file, 'r')
+        imported, skipped, errors = importPlants(engine,
+            READERS[file_format](stream), args.owner, args.batch_size)
+        for number, error in errors:
+            sys.stderr.write('Record %d: %s\n' % (number, error))
+        summary = 'Imported %d plants (%d skipped)' % (imported, skipped)
+        count = imported + skipped
+    else:
+        stream = openStream(args.file, 'w')
+        counter = {'rows': 0}
+
+        def counted(records):
+            for record in records:
+                counter['rows'] += 1
+                yield record
+        WRITERS[file_format](stream, counted(exportPlants(engine,
+            args.batch_size)))
+        stream.flush()
+        count = counter['rows']
+        summary = 'Exported %d plants' % count
+    elapsed = default_timer() - start
+    sys.stderr.write('%s in %.2f s (%d rows/s)\n' % (summary, elapsed,
+        count / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
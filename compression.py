@@ -0,0 +1,142 @@
+""" Python code for compressing the application's responses.
+
+HTML pages and API responses are compressed with the best encoding the
+client accepts, preferring zstd, then Brotli, then gzip (with equal
+quality values in Accept-Encoding). zstd needs the zstandard package and
+Brotli the brotli package; both are optional, and gzip is always there.
+
+    - bodies smaller than the COMPRESSION_MIN_SIZE setting are sent as
+      they are, since compressing them saves almost nothing
+    - streamed responses (such as the full catalog export) are compressed
+      chunk by chunk as they are sent
+    - for responses from the response cache (see "response_cache.py"),
+      each encoding of the body is stored with the cached entry, so an
+      identical payload is only compressed once per encoding
+    - compressed responses get a weak ETag, as the same entity tag can't
+      be strong for two different byte sequences
+
+Responses that already have a Content-Encoding (the precompressed static
+assets), file responses, and types that don't compress well are left
+alone.
+"""
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Types worth compressing
+COMPRESSIBLE_TYPES = ['text/html', 'text/plain', 'text/css', 'text/csv',
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'application/msgpack', 'image/svg+xml']
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+
+
+class BrotliCompressor(object):
+    """ Gives a Brotli compressor the compress/flush interface of zlib's """
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def gzipCompressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def zstdCompressor(level):
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def availableEncodings():
+    """ Return the encodings that can be produced, best first, with the
+    function making a compressor for each from a compression level
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append(('zstd', zstdCompressor))
+    if brotli is not None:
+        encodings.append(('br', BrotliCompressor))
+    encodings.append(('gzip', gzipCompressor))
+    return encodings
+
+
+def compressChunks(chunks, compressor):
+    """ Generator that compresses a streamed body as it is produced """
+    try:
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Let the original body clean up, even if the client went away
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def isCompressible(response):
+    """ Check whether a response is of a type and kind worth compressing """
+    return (response.status_code == 200 and
+        not response.direct_passthrough and
+        'Content-Encoding' not in response.headers and
+        'Content-Range' not in response.headers and
+        response.mimetype in COMPRESSIBLE_TYPES)
+
+
+def registerCompression(app, min_size=1024, levels=None):
+    """ Compress the given Flask application's responses. levels maps an
+    encoding to its compression level, overriding DEFAULT_LEVELS. Call
+    this before adding any other after_request hooks, so that it runs
+    after all of them.
+    """
+    levels = dict(DEFAULT_LEVELS, **(levels or {}))
+    encodings = availableEncodings()
+    compressors = dict(encodings)
+    names = [name for name, make in encodings]
+
+    @app.after_request
+    def compressResponse(response):
+        if request.method == 'HEAD' or not isCompressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(names)
+        if encoding is None:
+            return response
+        compressor = compressors[encoding](levels[encoding])
+
+        if response.is_streamed:
+            response.response = compressChunks(response.response, compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            # Set by the response cache on the responses it stores or serves
+            entry = getattr(response, 'cache_entry', None)
+            body = entry.encoded.get(encoding) if entry is not None \
+                else None
+            if body is None:
+                data = response.get_data()
+                if len(data) < min_size:
+                    return response
+                body = compressor.compress(data) + compressor.flush()
+                if entry is not None:
+                    entry.encoded[encoding] = body
+            response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
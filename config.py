@@ -0,0 +1,161 @@
+""" Python code for the plant catalog's settings and client secrets.
+
+A setting's value comes from the first of these that has it:
+    - an environment variable named CATALOG_<SETTING>
+    - the JSON settings file named by the CATALOG_SETTINGS environment
+      variable (default "catalog_settings.json")
+    - the defaults below
+
+The settings file and "client_secrets.json" are parsed once and parsed
+again only after they change on disk, so both can be updated without
+restarting the server. A missing file counts as empty, which lets the
+application be imported without client secrets (in tests, for example).
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULTS = {
+    'SECRET_KEY': None,
+    # The catalog database, which all writes go to
+    'DATABASE_URL': 'sqlite:///plantcatalog.db',
+    # Database that the read-only pages read from instead, such as a read
+    # replica; None to read through read-only connections to a SQLite
+    # DATABASE_URL (or through the same connections to any other)
+    'DATABASE_REPLICA_URL': None,
+    # Seconds a user's reads go to DATABASE_URL after they write, so they
+    # see their change while the replica catches up; longer than the
+    # replica's lag
+    'READ_PRIMARY_AFTER_WRITE': 10,
+    'CLIENT_SECRETS_FILE': 'client_secrets.json',
+    'GOOGLE_TOKENINFO_URL': 'https://www.googleapis.com/oauth2/v1/tokeninfo',
+    'GOOGLE_USERINFO_URL': 'https://www.googleapis.com/oauth2/v1/userinfo',
+    'GOOGLE_REVOKE_URL': 'https://accounts.google.com/o/oauth2/revoke',
+    # Seconds to wait on Google before giving up
+    'HTTP_TIMEOUT': 10,
+    # Keep-alive connections kept open per Google host
+    'HTTP_POOL_SIZE': 10,
+    # Seconds a verified access token stays cached
+    'TOKENINFO_CACHE_TTL': 300,
+    # Per-request timings and /metrics (see "instrumentation.py")
+    'INSTRUMENTATION': False,
+    # Secret that turns on profiling of a request sent with it in an
+    # X-Profile header, and /metrics for clients that send it as a bearer
+    # token; /metrics answers 404 without it
+    'PROFILE_TOKEN': None,
+    # Seconds between the profiler's stack samples
+    'PROFILE_INTERVAL': 0.005,
+    # Secret that bulk maintenance API requests (see "maintenance.py") must
+    # send as a bearer token; the API is off unless it is set
+    'MAINTENANCE_TOKEN': None,
+    # Compress responses for clients that accept it (see "compression.py")
+    'COMPRESSION': True,
+    # Smallest response body worth compressing, in bytes
+    'COMPRESSION_MIN_SIZE': 1024,
+    # Compression level of each encoding
+    'COMPRESSION_GZIP_LEVEL': 6,
+    'COMPRESSION_BR_LEVEL': 5,
+    'COMPRESSION_ZSTD_LEVEL': 3,
+    # Keep compiled templates on disk between runs
+    'TEMPLATE_BYTECODE_CACHE': True,
+    # Directory for the compiled templates; None for a per-user directory
+    # under the system's temporary directory
+    'TEMPLATE_CACHE_DIR': None,
+    # Where login sessions are kept: "cookie", "memory", "sqlite" or
+    # "filesystem" (see "session_store.py")
+    'SESSION_STORE': 'sqlite',
+    # The session store's maximum size, database URL or directory; None
+    # for the store's default
+    'SESSION_LOCATION': None,
+    # Seconds a login session lasts after it was last saved
+    'SESSION_LIFETIME': 604800,
+}
+# Seconds between checks of a file for changes
+CHECK_INTERVAL = 2
+
+
+class WatchedJSONFile(object):
+    """ A JSON file that is parsed on first use and parsed again only when
+    its modification time or size changes
+
+    Attributes:
+        path (str): file name
+        data (dict): parsed contents, empty if the file doesn't exist
+        version (int): goes up each time new contents are loaded
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.version = 0
+        self._signature = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Return the file's contents, reloading them if it has changed """
+        now = time.time()
+        if self._checked is not None and now - self._checked < CHECK_INTERVAL:
+            return self.data
+        with self._lock:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime, stat.st_size)
+            except OSError:
+                signature = None
+            if signature != self._signature:
+                try:
+                    data = self._parse() if signature else {}
+                except ValueError:
+                    # Probably caught the file half written, so keep the
+                    # old contents and try again on the next check
+                    return self.data
+                self.data = data
+                self._signature = signature
+                self.version += 1
+        return self.data
+
+    def _parse(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+
+def coerce(value, default):
+    """ Convert a setting from an environment variable to the type of its
+    default value
+    """
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+class Settings(object):
+    """ The application settings, looked up by name """
+    def __init__(self, defaults, settings_file):
+        self.defaults = defaults
+        self.file = settings_file
+
+    def get(self, name):
+        """ Return the current value of the named setting """
+        default = self.defaults.get(name)
+        value = os.environ.get('CATALOG_' + name)
+        if value is not None:
+            return coerce(value, default)
+        return self.file.load().get(name, default)
+
+
+settings = Settings(DEFAULTS, WatchedJSONFile(
+    os.environ.get('CATALOG_SETTINGS', 'catalog_settings.json')))
+client_secrets = WatchedJSONFile(settings.get('CLIENT_SECRETS_FILE'))
+
+
+def getClientId():
+    """ Return the Google client ID from the client secrets, or None if
+    there are no client secrets
+    """
+    return client_secrets.load().get('web', {}).get('client_id')
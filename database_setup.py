@@ -1,14 +1,31 @@
 """ Python code to define the User, PlantCategory, and PlantItem tables
 and setup the plant catalog database.
+
+Importing this file only defines the tables; run it as a script to create
+them in the database named by the DATABASE_URL setting (plantcatalog.db
+unless configured otherwise, see "config.py").
 """
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from sqlalchemy import bindparam, func, literal, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
-from sqlalchemy.orm import backref
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, backref, object_session
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import OperationalError
+
+from config import settings
 
 Base = declarative_base()
 
+# Connection pool settings shared by every engine
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_RECYCLE = 3600
+# Seconds a SQLite connection waits on a locked database before failing
+SQLITE_BUSY_TIMEOUT = 30
+
 
 class User(Base):
     """ User database object
@@ -16,14 +33,14 @@ class User(Base):
     Attributes:
         id (Integer, primary key): unique id assigned by database
         name (String, required): username
-        email (String, required): user's email address
+        email (String, required, unique): user's email address
         picture (String, optional): link to user's profile picture
     """
     __tablename__ = 'user'
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     picture = Column(String(250))
 
 
@@ -32,12 +49,16 @@ class PlantCategory(Base):
 
     Attributes:
         id (Integer, primary key): unique id assigned by database
-        name (String, required): category name
+        name (String, required, unique): category name
+        plant_count (Integer, required): number of plants in the category,
+            kept up to date as plants are added, moved and deleted
     """
     __tablename__ = 'category'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(250), nullable=False)
+    name = Column(String(250), nullable=False, unique=True, index=True)
+    plant_count = Column(Integer, nullable=False, default=0,
+        server_default='0')
 
     @property
     def serialize(self):
@@ -53,7 +74,7 @@ class PlantItem(Base):
 
     Attributes:
         id (Integer, primary key): unique id assigned by database
-        name (String, required): common plant name
+        name (String, required, unique): common plant name
         botanical_name (String, optional): botanical plant name
         description (String, optional): plant description
         image (String, optional): plant image URL
@@ -63,14 +84,18 @@ class PlantItem(Base):
     __tablename__ = 'plant_item'
 
     id = Column(Integer, primary_key = True)
-    name = Column(String(80), nullable = False)
+    name = Column(String(80), nullable = False, unique = True, index = True)
     botanical_name = Column(String(80))
     description = Column(String(250))
     image = Column(String(250))
-    category_id = Column(Integer, ForeignKey('category.id'))
+    category_id = Column(Integer,
+        ForeignKey('category.id', ondelete='CASCADE'), index = True)
+    # Deleting a category leaves its plants to the database's ON DELETE
+    # CASCADE, instead of loading and deleting them one at a time
     category = relationship(PlantCategory,
-        backref=backref('plant-item', cascade='all, delete'))
-    user_id = Column(Integer, ForeignKey('user.id'))
+        backref=backref('plants', cascade='all, delete',
+            passive_deletes=True, order_by=id))
+    user_id = Column(Integer, ForeignKey('user.id'), index = True)
     user = relationship(User)
 
     @property
@@ -86,6 +111,287 @@ class PlantItem(Base):
        }
 
 
-engine = create_engine('sqlite:///plantcatalog.db')
+# Longest value each text field of a plant can hold
+PLANT_FIELD_LENGTHS = dict((field, PlantItem.__table__.c[field].type.length)
+    for field in ('name', 'botanical_name', 'description', 'image'))
+
+
+class PlantChange(Base):
+    """ PlantChange database object - records every change to a plant
+    item, for the change feed
+
+    Changes are only written by a transaction that has already updated
+    the catalog_state row (see bumpCatalogVersion), and so holds its lock
+    until it commits. Their versions are therefore committed in order on
+    every database, and a feed client that has read up to a version never
+    sees a lower one turn up later.
+
+    Attributes:
+        version (Integer, primary key): catalog version of the change,
+            which goes up with each change and is never reused
+        plant_id (Integer, required): id of the plant that changed
+        name (String, required): plant name after the change, or before
+            it for a deletion
+        deleted (Boolean, required): whether the plant was deleted
+    """
+    __tablename__ = 'plant_change'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    version = Column(Integer, primary_key = True)
+    plant_id = Column(Integer, nullable = False, index = True)
+    name = Column(String(80), nullable = False)
+    deleted = Column(Boolean, nullable = False, default = False)
+
+
+class CatalogState(Base):
+    """ CatalogState database object - a single row holding the catalog
+    version, which every process serving the catalog reads to tell
+    whether its cached pages are still current
+
+    Attributes:
+        id (Integer, primary key): always 1
+        version (Integer, required): goes up with every transaction that
+            changes the plants, categories or users shown in the catalog
+    """
+    __tablename__ = 'catalog_state'
+
+    id = Column(Integer, primary_key = True)
+    version = Column(Integer, nullable = False, default = 0)
+
+
+@event.listens_for(CatalogState.__table__, 'after_create')
+def addCatalogState(target, connection, **kw):
+    """ Create the catalog version's row along with its table """
+    connection.execute(target.insert().values(id=1, version=0))
+
+
+def bumpCatalogVersion(connection):
+    """ Move the catalog on to a new version, in the caller's transaction.
+    The update locks the catalog_state row until the transaction ends, so
+    it must come before any plant_change row is written: that serializes
+    the feed writes, and change versions commit in the order they are
+    assigned.
+    """
+    table = CatalogState.__table__
+    connection.execute(table.update().values(version=table.c.version + 1))
+
+
+def recordPlantChange(plant, deleted=False):
+    """ Queue a plant's change for the plant_change table; the changes
+    queued during a flush are written together at the end of it, in the
+    same transaction
+    """
+    object_session(plant).info.setdefault('plant_changes', []).append(
+        {'plant_id': plant.id, 'name': plant.name, 'deleted': deleted})
+
+
+# Every plant item the ORM creates, updates or deletes is recorded
+@event.listens_for(PlantItem, 'after_insert')
+@event.listens_for(PlantItem, 'after_update')
+def recordPlantSaved(mapper, connection, target):
+    # Plants marked dirty without a change to any column are left out
+    if object_session(target).is_modified(target,
+            include_collections=False):
+        recordPlantChange(target)
+
+
+@event.listens_for(PlantItem, 'after_delete')
+def recordPlantDeleted(mapper, connection, target):
+    recordPlantChange(target, deleted=True)
+
+
+def recordMatchingPlantChanges(connection, where=None, deleted=False):
+    """ Record a change for every plant matching the where clause (every
+    plant, without one) in one INSERT ... SELECT, for plants changed or
+    deleted with set-based SQL instead of through the ORM, and move the
+    catalog on to a new version
+    """
+    plants = PlantItem.__table__
+    query = select([plants.c.id, plants.c.name, literal(deleted, Boolean)])
+    if where is not None:
+        query = query.where(where)
+    bumpCatalogVersion(connection)
+    connection.execute(PlantChange.__table__.insert().from_select(
+        ['plant_id', 'name', 'deleted'], query))
+
+
+@event.listens_for(PlantCategory, 'before_delete')
+def recordCategoryPlantsDeleted(mapper, connection, target):
+    """ Record the deletion of the plants that the database deletes
+    along with the category """
+    recordMatchingPlantChanges(connection,
+        PlantItem.__table__.c.category_id == target.id, deleted=True)
+
+
+def countPlant(plant, category_id, change):
+    """ Queue a change to the plant_count of the plant's category; like
+    the plant changes, the counts are written at the end of the flush
+    """
+    if category_id is not None:
+        counts = object_session(plant).info.setdefault('plant_counts', {})
+        counts[category_id] = counts.get(category_id, 0) + change
+
+
+@event.listens_for(PlantItem, 'after_insert')
+def countPlantInserted(mapper, connection, target):
+    countPlant(target, target.category_id, 1)
+
+
+@event.listens_for(PlantItem, 'after_update')
+def countPlantMoved(mapper, connection, target):
+    added, unchanged, deleted = get_history(target, 'category_id')
+    for category_id in deleted:
+        countPlant(target, category_id, -1)
+    for category_id in added:
+        countPlant(target, category_id, 1)
+
+
+@event.listens_for(PlantItem, 'after_delete')
+def countPlantDeleted(mapper, connection, target):
+    countPlant(target, target.category_id, -1)
+
+
+def updatePlantCounts(connection, counts):
+    """ Add to the plant_count of categories in one statement, given a
+    dictionary of category id to the change in its number of plants
+    """
+    table = PlantCategory.__table__
+    rows = [{'category_id': category_id, 'change': change}
+        for category_id, change in sorted(counts.items()) if change]
+    if rows:
+        connection.execute(table.update().where(
+            table.c.id == bindparam('category_id')).values(
+            plant_count=table.c.plant_count + bindparam('change')), rows)
+
+
+def refreshPlantCounts(connection):
+    """ Recount the plants of every category, for plant rows written
+    without keeping the counts up to date
+    """
+    table = PlantCategory.__table__
+    plants = PlantItem.__table__
+    connection.execute(table.update().values(plant_count=select(
+        [func.count()]).where(plants.c.category_id == table.c.id).as_scalar()))
+
+
+@event.listens_for(Session, 'after_flush')
+def writePlantChanges(session, flush_context):
+    """ Write the plant changes and category counts queued during the
+    flush, in one statement each, and move the catalog on to a new version
+    """
+    changes = session.info.pop('plant_changes', None)
+    counts = session.info.pop('plant_counts', None)
+    if changes or counts:
+        bumpCatalogVersion(session)
+    if changes:
+        session.execute(PlantChange.__table__.insert(), changes)
+    if counts:
+        updatePlantCounts(session, counts)
+
+
+# Full-text search index over plant names and descriptions (SQLite FTS5).
+# It is an external content table over plant_item, so it stores only the
+# index, and the triggers keep it in step with every insert, update and
+# delete, however the plant rows are written.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS plant_search USING fts5(
+        name, botanical_name, description,
+        content='plant_item', content_rowid='id', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS plant_search_insert
+        AFTER INSERT ON plant_item BEGIN
+        INSERT INTO plant_search(rowid, name, botanical_name, description)
+        VALUES (new.id, new.name, new.botanical_name, new.description);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS plant_search_delete
+        AFTER DELETE ON plant_item BEGIN
+        INSERT INTO plant_search(plant_search, rowid, name, botanical_name,
+            description)
+        VALUES ('delete', old.id, old.name, old.botanical_name,
+            old.description);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS plant_search_update
+        AFTER UPDATE OF name, botanical_name, description ON plant_item BEGIN
+        INSERT INTO plant_search(plant_search, rowid, name, botanical_name,
+            description)
+        VALUES ('delete', old.id, old.name, old.botanical_name,
+            old.description);
+        INSERT INTO plant_search(rowid, name, botanical_name, description)
+        VALUES (new.id, new.name, new.botanical_name, new.description);
+        END""",
+]
+
+
+def createSearchIndex(connection, rebuild=False):
+    """ Create the plant_search full-text index and its triggers, if the
+    database supports FTS5. With rebuild, the index is refilled from the
+    existing plant rows. Returns True if the index is available.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(statement)
+    except OperationalError:
+        # This SQLite build doesn't include FTS5
+        return False
+    if rebuild:
+        connection.execute(
+            "INSERT INTO plant_search(plant_search) VALUES ('rebuild')")
+    return True
+
+
+@event.listens_for(PlantItem.__table__, 'after_create')
+def addSearchIndex(target, connection, **kw):
+    """ Create the search index along with the plant_item table """
+    createSearchIndex(connection)
+
+
+def setSqlitePragmas(dbapi_connection, connection_record):
+    """ Tune each new SQLite connection for concurrent use: WAL mode lets
+    readers carry on while a writer commits, and the busy timeout makes a
+    writer wait for the lock instead of failing right away. Foreign keys
+    are enforced.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=%d' % (SQLITE_BUSY_TIMEOUT * 1000))
+    # SQLite only enforces foreign keys, and their ON DELETE actions, when
+    # asked to
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def setSqliteQueryOnly(dbapi_connection, connection_record):
+    """ Make a SQLite connection refuse to change the database """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def createEngine(url=None, read_only=False):
+    """ Create a database engine with a pooled set of connections that can
+    be shared by the threads of a web server process. url defaults to the
+    DATABASE_URL setting. A read_only SQLite engine's connections can't
+    write to the database.
+    """
+    if url is None:
+        url = settings.get('DATABASE_URL')
+    if url.startswith('sqlite'):
+        engine = create_engine(url, poolclass=QueuePool,
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+            connect_args={'check_same_thread': False,
+                'timeout': SQLITE_BUSY_TIMEOUT})
+        event.listen(engine, 'connect', setSqlitePragmas)
+        if read_only:
+            event.listen(engine, 'connect', setSqliteQueryOnly)
+    else:
+        engine = create_engine(url, pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True)
+    return engine
+
 
-Base.metadata.create_all(engine)
+if __name__ == '__main__':
+    Base.metadata.create_all(createEngine())
+    print('Created the plant catalog tables')
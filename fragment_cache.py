@@ -0,0 +1,85 @@
+""" Python code for caching rendered sections of the page templates.
+
+Parts of a page that are the same for every visitor and only change with
+the catalog, such as the category list and the latest plants, can be
+wrapped in a cache tag in a template:
+
+    {% cache 'latest-plants' %}
+        ...
+    {% endcache %}
+
+The first render stores the section's HTML with the catalog version it
+was rendered at, and later renders reuse it only while that version is
+current. The version is kept in the catalog_state table and read by
+every process (see "response_cache.py"), so a write made through any
+process retires the fragments of all of them within a version check
+interval. Further arguments to the tag become part of the key, for
+sections that vary:
+
+    {% cache 'category-plants', category.name %} ... {% endcache %}
+
+Unlike the response cache, fragments are shared with logged-in visitors,
+so a cached section must not depend on the session; a user who has just
+written gets the sections rendered afresh, from the primary database.
+Variables only used inside a cached section are best passed as functions
+and called there, so their queries only run when the section is
+rendered. Fragments also expire after FRAGMENT_CACHE_TTL seconds, to free
+the memory held by sections nobody renders.
+"""
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from cache import LRUCache
+
+FRAGMENT_CACHE_SIZE = 512
+FRAGMENT_CACHE_TTL = 60
+
+fragment_cache = LRUCache(max_size=FRAGMENT_CACHE_SIZE,
+    ttl=FRAGMENT_CACHE_TTL)
+
+
+class FragmentCacheExtension(Extension):
+    """ Jinja extension adding the {% cache key, ... %} tag. The
+    environment's fragment_version function returns the version that
+    cached fragments must match, or None to render them without the
+    cache.
+    """
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=fragment_cache,
+            fragment_version=lambda: 0)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_renderCached',
+            [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _renderCached(self, key, caller):
+        """ Return the section's cached HTML, rendering it if it isn't
+        cached for the current version
+        """
+        version = self.environment.fragment_version()
+        if version is None:
+            return caller()
+        key = tuple(key)
+        entry = self.environment.fragment_cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        html = caller()
+        self.environment.fragment_cache.set(key, (version, html))
+        return html
+
+
+def registerFragmentCache(app, version):
+    """ Add the cache tag to the given Flask application's templates.
+    version is called for the version that cached fragments must match,
+    and returns None when the cache mustn't be used.
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_version = version
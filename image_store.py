@@ -0,0 +1,290 @@
+""" Python code for storing uploaded plant images and their resized
+variants.
+
+Uploaded images are stored content-addressed under static/uploads/, named
+by the SHA-256 hash of their contents, so the same picture is only stored
+once and a stored file never changes. A background pool of worker threads
+then writes smaller copies of each image (in WebP and in a JPEG or PNG
+fallback) at each of the VARIANT_WIDTHS, named after the same hash:
+
+    static/uploads/3f/3fa9...e1.jpg          original upload
+    static/uploads/3f/3fa9...e1-w320.webp    320 pixel wide WebP copy
+    static/uploads/3f/3fa9...e1-w320.jpg     320 pixel wide JPEG copy
+
+Plant images that are plain /static/ files (like the sample images) get
+variants the same way once they are run through this module's command
+line, and images on other sites are left alone. The "srcset" and
+"thumbnail" template filters let pages pick the smallest variant that
+fits.
+
+Pages never hash or probe image files to find the variants: the variants
+made of an upload are listed in a file written after them
+(static/uploads/3f/3fa9...e1.json), and those of the plain /static/
+images in the VARIANT_MANIFEST written by the command line.
+
+Needs the Pillow package. Without it uploads are refused and pages fall
+back to the original images.
+
+Usage: python image_store.py static/images/*.JPG
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+from flask import request
+
+from assets import IMMUTABLE_CACHE_CONTROL
+from cache import LRUCache
+from config import WatchedJSONFile
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'static')
+UPLOAD_DIR = os.path.join(STATIC_DIR, 'uploads')
+STATIC_URL_PATH = '/static/'
+UPLOAD_URL_PATH = STATIC_URL_PATH + 'uploads/'
+MAX_UPLOAD_SIZE = 8 * 1024 * 1024
+VARIANT_WIDTHS = [160, 320, 640]
+IMAGE_WORKERS = 2
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+# Image formats accepted for upload, with the extension they're stored as
+UPLOAD_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+# Variants of the plain /static/ images, by image URL
+VARIANT_MANIFEST = os.path.join(UPLOAD_DIR, 'variants.json')
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Known variants of each image, by image URL. Entries expire so variants
+# written by a worker (possibly in another process) show up soon after.
+variant_cache = LRUCache(max_size=4096, ttl=30)
+static_variants = WatchedJSONFile(VARIANT_MANIFEST)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class ImageError(Exception):
+    """ Raised when an upload can't be stored as an image """
+
+
+def getPool():
+    """ Return the pool of image workers, starting it on first use (so
+    it's created after a preforking server has forked)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(IMAGE_WORKERS)
+        return _pool
+
+
+def storeUpload(stream):
+    """ Store an uploaded image and schedule its variants. Returns the URL
+    of the stored image. Raises ImageError if it isn't a supported image.
+    """
+    if Image is None:
+        raise ImageError('Image uploads are not available')
+    data = stream.read(MAX_UPLOAD_SIZE + 1)
+    if len(data) > MAX_UPLOAD_SIZE:
+        raise ImageError('Image is larger than %d MB'
+            % (MAX_UPLOAD_SIZE // (1024 * 1024)))
+    try:
+        image = Image.open(BytesIO(data))
+        image.verify()
+        extension = UPLOAD_FORMATS[image.format]
+    except Exception:
+        raise ImageError('File is not a JPEG, PNG, GIF or WebP image')
+
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(UPLOAD_DIR, digest[:2], '%s.%s' % (digest, extension))
+    if not os.path.exists(path):
+        writeFile(path, data)
+    getPool().apply_async(makeVariantsInBackground, (path, digest))
+    return UPLOAD_URL_PATH + os.path.relpath(path, UPLOAD_DIR).replace(
+        os.sep, '/')
+
+
+def writeFile(path, data):
+    """ Write a file through a temporary file and a rename, so readers
+    never see it half written. data is the file's contents, or a function
+    that writes them to the open file.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker made it first
+            pass
+    handle, temporary = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+        os.chmod(temporary, 0o644)
+        os.rename(temporary, path)
+    except Exception:
+        os.remove(temporary)
+        raise
+
+
+def variantUrl(digest, width, extension):
+    """ Return the URL of an image's variant """
+    return '%s%s/%s-w%d.%s' % (UPLOAD_URL_PATH, digest[:2], digest, width,
+        extension)
+
+
+def variantListPath(digest):
+    """ Return the file listing the variants made of an image """
+    return os.path.join(UPLOAD_DIR, digest[:2], digest + '.json')
+
+
+def makeVariants(path, digest):
+    """ Write the resized variants of the image file at path, naming them
+    after its content hash, and then the list of them. Returns the list
+    of (width, format, url) tuples.
+    """
+    image = Image.open(path)
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info
+            else 'RGB')
+    fallback = 'png' if image.mode == 'RGBA' else 'jpg'
+    base = os.path.join(UPLOAD_DIR, digest[:2], digest)
+    original_width, original_height = image.size
+    variants = []
+    for width in VARIANT_WIDTHS:
+        if width >= original_width:
+            break
+        height = max(1, original_height * width // original_width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        writeFile('%s-w%d.webp' % (base, width), lambda f: resized.save(f,
+            'WEBP', quality=WEBP_QUALITY))
+        if fallback == 'jpg':
+            writeFile('%s-w%d.jpg' % (base, width), lambda f: resized.save(f,
+                'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True))
+        else:
+            writeFile('%s-w%d.png' % (base, width), lambda f: resized.save(f,
+                'PNG', optimize=True))
+        variants.extend([(width, 'webp', variantUrl(digest, width, 'webp')),
+            (width, fallback, variantUrl(digest, width, fallback))])
+    writeFile(variantListPath(digest),
+        json.dumps(variants).encode('utf-8'))
+    return variants
+
+
+def makeVariantsInBackground(path, digest):
+    """ Worker task that makes an image's variants, logging any failure
+    since nothing is waiting on the result
+    """
+    try:
+        makeVariants(path, digest)
+    except Exception:
+        logging.getLogger(__name__).exception(
+            'Failed to make variants of %s', path)
+
+
+def contentHash(url, path):
+    """ Return the content hash an image's variants are named after """
+    if url.startswith(UPLOAD_URL_PATH):
+        return os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def findVariants(url):
+    """ Return a list of (width, format, url) tuples for the variants of
+    the image at url that have been made so far
+    """
+    if not url:
+        return []
+    if url.startswith(UPLOAD_URL_PATH):
+        digest = os.path.splitext(url.rsplit('/', 1)[-1])[0]
+        if not DIGEST_PATTERN.match(digest):
+            return []
+        try:
+            with open(variantListPath(digest), 'rb') as f:
+                variants = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            # Not made yet
+            return []
+    else:
+        variants = static_variants.load().get(url, [])
+    return [tuple(variant) for variant in variants]
+
+
+def getVariants(url):
+    """ Cached version of findVariants """
+    return variant_cache.getOrLoad(url, lambda: findVariants(url))
+
+
+def srcset(url, image_format=None):
+    """ Template filter giving the srcset attribute value for an image:
+    its WebP variants when image_format is 'webp', otherwise its JPEG or
+    PNG variants
+    """
+    variants = getVariants(url)
+    if image_format == 'webp':
+        entries = ['%s %dw' % (variant_url, width)
+            for width, extension, variant_url in variants
+            if extension == 'webp']
+    else:
+        entries = ['%s %dw' % (variant_url, width)
+            for width, extension, variant_url in variants
+            if extension != 'webp']
+    return ', '.join(entries)
+
+
+def thumbnail(url, width=VARIANT_WIDTHS[1]):
+    """ Template filter giving the smallest fallback variant of an image at
+    least width pixels wide, or the original image if there isn't one
+    """
+    for variant_width, extension, variant_url in getVariants(url):
+        if extension != 'webp' and variant_width >= width:
+            return variant_url
+    return url
+
+
+def registerImages(app):
+    """ Hook the image store into the given Flask application """
+    app.config.setdefault('MAX_CONTENT_LENGTH', MAX_UPLOAD_SIZE + 64 * 1024)
+    app.add_template_filter(srcset, 'srcset')
+    app.add_template_filter(thumbnail, 'thumbnail')
+
+    @app.after_request
+    def cacheUploadsForever(response):
+        """ Stored images never change, so browsers can keep them """
+        if request.path.startswith(UPLOAD_URL_PATH) and \
+                response.status_code == 200:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+if __name__ == '__main__':
+    if Image is None:
+        sys.exit('The Pillow package is needed to make image variants')
+    manifest = dict(static_variants.load())
+    for name in sys.argv[1:]:
+        path = os.path.abspath(name)
+        url = STATIC_URL_PATH + os.path.relpath(path, STATIC_DIR).replace(
+            os.sep, '/')
+        variants = makeVariants(path, contentHash(url, path))
+        if not url.startswith(UPLOAD_URL_PATH):
+            manifest[url] = variants
+        print('Made variants of %s' % url)
+    writeFile(VARIANT_MANIFEST, json.dumps(manifest, indent=2,
+        sort_keys=True).encode('utf-8'))
@@ -0,0 +1,326 @@
+""" Python code for the optional per-request instrumentation.
+
+Turned on with the INSTRUMENTATION setting (see "config.py"). When on,
+each request is timed phase by phase:
+    sql     - SQL statements, with a count of the statements issued
+    render  - Jinja template rendering
+    bleach  - cleaning user input with bleach
+    google  - calls to Google's OAuth endpoints
+    total   - the whole request, up to the start of the response body
+Phases can overlap (a lazy load while rendering a template counts as
+both render and sql time).
+
+The timings are sent back in a Server-Timing header, which browser
+developer tools show next to each request, and added up per endpoint for
+the Prometheus-style metrics served at /metrics, along with the read
+cache statistics. Metrics are kept per process.
+
+A single request can also be profiled by sending the PROFILE_TOKEN
+setting in an X-Profile header. A sampling thread then records the
+request thread's stack every PROFILE_INTERVAL seconds, and the response
+is replaced by the samples in "folded stack" format (one stack per line,
+outermost frame first, followed by its sample count), ready for
+flamegraph.pl or speedscope. Profiling and /metrics are off unless
+PROFILE_TOKEN is set (/metrics answers 404), and /metrics needs the token
+too, as a bearer token.
+
+With INSTRUMENTATION off none of the hooks are installed, and the phase
+timers used by the rest of the application return immediately.
+"""
+import bisect
+import hmac
+import os
+import sys
+import threading
+from timeit import default_timer
+
+from flask import Response, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PHASES = ['sql', 'render', 'bleach', 'google']
+# Upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+_enabled = False
+
+
+def isToken(value, token):
+    """ Check a header value against a secret token in constant time, so
+    the token can't be guessed from how long a refusal takes
+    """
+    return value is not None and hmac.compare_digest(value.encode('utf-8'),
+        token.encode('utf-8'))
+
+
+def timedPhase(name):
+    """ Return a context manager that adds the time spent in its block
+    to the named phase of the current request
+
+        with timedPhase('bleach'):
+            text = bleach.clean(text)
+    """
+    return PhaseTimer(name)
+
+
+class PhaseTimer(object):
+    """ Times a block of code as part of a request phase """
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled and has_app_context():
+            self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            addPhaseTime(self.name, default_timer() - self.start)
+        return False
+
+
+def addPhaseTime(name, seconds):
+    """ Add seconds to the named phase of the current request """
+    phase_times = g.get('phase_times')
+    if phase_times is not None:
+        phase_times[name] = phase_times.get(name, 0.0) + seconds
+
+
+class Histogram(object):
+    """ Counts observations into buckets by upper bound, as Prometheus
+    histograms do
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """ Return (upper bound, count) pairs, ending with '+Inf' """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+def formatLabels(labels):
+    """ Format a list of (name, value) pairs as Prometheus labels """
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\',
+        '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+
+class Metrics(object):
+    """ Running totals of the request timings, by endpoint """
+    def __init__(self):
+        self.requests = {}
+        self.durations = {}
+        self.phase_seconds = {}
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, seconds, phase_times,
+            query_count):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if endpoint not in self.durations:
+                self.durations[endpoint] = Histogram(DURATION_BUCKETS)
+            self.durations[endpoint].observe(seconds)
+            for phase, phase_seconds in phase_times.items():
+                key = (endpoint, phase)
+                self.phase_seconds[key] = self.phase_seconds.get(key,
+                    0.0) + phase_seconds
+            self.queries[endpoint] = self.queries.get(endpoint,
+                0) + query_count
+
+    def render(self, cache_stats):
+        """ Return the metrics in the Prometheus text format """
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                lines.append('%s%s%s %s' % (name, suffix,
+                    formatLabels(labels) if labels else '', value))
+
+        with self._lock:
+            metric('catalog_requests_total', 'counter',
+                'Requests handled.',
+                [('', [('endpoint', endpoint), ('method', method),
+                    ('status', status)], count) for (endpoint, method,
+                    status), count in sorted(self.requests.items())])
+            samples = []
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in histogram.cumulative():
+                    samples.append(('_bucket', [('endpoint', endpoint),
+                        ('le', bound)], count))
+                samples.append(('_sum', [('endpoint', endpoint)],
+                    '%.6f' % histogram.sum))
+                samples.append(('_count', [('endpoint', endpoint)],
+                    histogram.count))
+            metric('catalog_request_duration_seconds', 'histogram',
+                'Time to handle a request.', samples)
+            metric('catalog_phase_seconds_total', 'counter',
+                'Time spent in each phase of handling requests.',
+                [('', [('endpoint', endpoint), ('phase', phase)],
+                    '%.6f' % seconds) for (endpoint, phase), seconds
+                    in sorted(self.phase_seconds.items())])
+            metric('catalog_sql_queries_total', 'counter',
+                'SQL statements issued.',
+                [('', [('endpoint', endpoint)], count)
+                    for endpoint, count in sorted(self.queries.items())])
+
+        stats = sorted(cache_stats().items())
+        for name, kind, description in [
+                ('hits', 'counter', 'Read cache hits.'),
+                ('misses', 'counter', 'Read cache misses.'),
+                ('evictions', 'counter', 'Read cache evictions.'),
+                ('size', 'gauge', 'Entries in each read cache.')]:
+            suffix = '_total' if kind == 'counter' else ''
+            metric('catalog_cache_%s%s' % (name, suffix), kind, description,
+                [('', [('cache', cache)], values[name])
+                    for cache, values in stats])
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler(object):
+    """ Samples the stack of one thread from a background thread """
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (os.path.basename(code.co_filename),
+                    code.co_name))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def folded(self):
+        """ Return the samples in folded stack format """
+        return ''.join('%s %d\n' % (stack, count)
+            for stack, count in sorted(self.samples.items()))
+
+
+def serverTiming(phase_times, query_count, total):
+    """ Return the Server-Timing header value for a request """
+    entries = []
+    for phase in PHASES:
+        if phase in phase_times:
+            description = ''
+            if phase == 'sql':
+                description = ';desc="%d queries"' % query_count
+            entries.append('%s;dur=%.2f%s' % (phase,
+                phase_times[phase] * 1000, description))
+    entries.append('total;dur=%.2f' % (total * 1000))
+    return ', '.join(entries)
+
+
+def startQueryTimer(conn, cursor, statement, parameters, context,
+        executemany):
+    context._query_start = default_timer()
+
+
+def stopQueryTimer(conn, cursor, statement, parameters, context,
+        executemany):
+    """ Add a statement's time to the sql phase of the current request """
+    if has_app_context() and g.get('phase_times') is not None:
+        addPhaseTime('sql', default_timer() - context._query_start)
+        g.sql_count += 1
+
+
+def registerInstrumentation(app, cache_stats, profile_token=None,
+        profile_interval=0.005):
+    """ Instrument the given Flask application and the SQL it issues.
+    cache_stats is called for the read cache statistics reported in the
+    metrics, as a dictionary of LRUCache.stats() dictionaries by name.
+    """
+    global _enabled
+    if not _enabled:
+        # Every engine is timed, since the application creates its engine
+        # lazily; statements outside a request are ignored
+        event.listen(Engine, 'before_cursor_execute', startQueryTimer)
+        event.listen(Engine, 'after_cursor_execute', stopQueryTimer)
+        _enabled = True
+    metrics = Metrics()
+
+    class TimedTemplate(app.jinja_env.template_class):
+        def render(self, *args, **kwargs):
+            with timedPhase('render'):
+                return super(TimedTemplate, self).render(*args, **kwargs)
+
+    app.jinja_env.template_class = TimedTemplate
+
+    @app.before_request
+    def startRequestTimer():
+        g.request_start = default_timer()
+        g.phase_times = {}
+        g.sql_count = 0
+        if profile_token and isToken(request.headers.get('X-Profile'),
+                profile_token):
+            g.profiler = SamplingProfiler(threading.current_thread().ident,
+                profile_interval)
+            g.profiler.start()
+
+    @app.after_request
+    def recordTimings(response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        total = default_timer() - start
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            response = Response(profiler.folded(), mimetype='text/plain')
+            response.headers['Cache-Control'] = 'no-store'
+        response.headers['Server-Timing'] = serverTiming(g.phase_times,
+            g.sql_count, total)
+        metrics.record(request.endpoint or 'none', request.method,
+            response.status_code, total, g.phase_times, g.sql_count)
+        return response
+
+    @app.teardown_request
+    def stopProfiler(exception=None):
+        """ Stop a profiler left running by a request that failed """
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+    def showMetrics():
+        """ Serve the metrics in the Prometheus text format """
+        if not profile_token:
+            return Response('Not Found\n', 404, mimetype='text/plain')
+        if not isToken(request.headers.get('Authorization'),
+                'Bearer ' + profile_token):
+            return Response('Unauthorized\n', 401, mimetype='text/plain')
+        return Response(metrics.render(cache_stats),
+            mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', showMetrics)
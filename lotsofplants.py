@@ -1,40 +1,25 @@
 """ Python code to load PlantCatagory table as well as adding
 some preliminary Plant items to the plant catalog.
 
-Dependencies: "database_setup.py"
+Dependencies: "database_setup.py", "catalog_io.py", "maintenance.py"
 You must run "database_setup.py" first to define the database tables
 """
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from database_setup import PlantCategory, User, createEngine
+from catalog_io import importPlants
+from maintenance import purgeCatalog
 
-from database_setup import Base, PlantCategory, PlantItem, User
+engine = createEngine()
 
-engine = create_engine('sqlite:///plantcatalog.db')
-Base.metadata.bind = engine
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
-
-# Clear any existing data
-users = session.query(User).all()
-for user in users:
-    session.delete(user)
-    session.commit()
-categories = session.query(PlantCategory).all()
-for category in categories:
-     session.delete(category)
-     session.commit()
-items = session.query(PlantItem).all()
-for item in items:
-    session.delete(item)
-    session.commit()
+# Clear any existing data, one statement per table
+with engine.begin() as connection:
+    purgeCatalog(connection, categories=True, users=True)
 
 
 # Create dummy user
-User1 = User(name="Flora Bunda", email="florasflowers@gmail.com",
-             picture="/static/images/blank_user.gif")
-session.add(User1)
-session.commit()
+with engine.begin() as connection:
+    connection.execute(User.__table__.insert(), name="Flora Bunda",
+        email="florasflowers@gmail.com",
+        picture="/static/images/blank_user.gif")
 
 
 # Category data
@@ -59,10 +44,9 @@ plantGroups = {
 }
 
 # Load categories
-for category in plantGroups['categories']:
-    newCategory = PlantCategory(name=category['name'])
-    session.add(newCategory)
-    session.commit()
+with engine.begin() as connection:
+    connection.execute(PlantCategory.__table__.insert(),
+        plantGroups['categories'])
 
 
 # Plant data
@@ -187,18 +171,10 @@ plants = {
 }
 
 # Load first 15 plant items
-for i in range(15):
-    plant = plants['plants'][i]
-    # look up category
-    plantGroup = session.query(PlantCategory).filter_by(name=plant['category']).one()
-    # Create Plant Item object
-    newPlant = PlantItem(name=plant['name'],
-        botanical_name=plant['botanical_name'],
-        description=plant['description'],
-        image=plant['picture'],
-        category=plantGroup,
-        user_id=1)
-    session.add(newPlant)
-    session.commit()
-
-print "added menu items!"
+importPlants(engine, ({'name': plant['name'],
+    'botanical_name': plant['botanical_name'],
+    'description': plant['description'],
+    'image': plant['picture'],
+    'category': plant['category']} for plant in plants['plants'][:15]),
+    owner="florasflowers@gmail.com")
+print("added menu items!")
@@ -0,0 +1,148 @@
+""" Python code for bulk maintenance of the plant catalog database.
+
+Each operation is a few set-based SQL statements, one per table it
+touches, so it takes the same number of statements however many plants
+it affects:
+
+    - deleting a category and all its plants
+    - reassigning every plant of one user to another
+    - purging every plant from the catalog, optionally with the
+      categories and users
+
+Plants deleted or reassigned are recorded in the plant_change table with
+a single INSERT ... SELECT, so sync clients of the change feed see the
+deletions as tombstones. The operations work on a connection and leave
+the transaction to the caller; the maintenance API in "application.py"
+runs them in the request's transaction.
+
+Dependencies: "database_setup.py"
+
+Usage:
+    python maintenance.py delete-category Trees
+    python maintenance.py reassign old@example.com new@example.com
+    python maintenance.py purge [--categories] [--users]
+"""
+import argparse
+import sys
+from timeit import default_timer
+
+from sqlalchemy import select
+
+from database_setup import PlantCategory, PlantItem, User, createEngine, \
+    recordMatchingPlantChanges
+
+plant_table = PlantItem.__table__
+category_table = PlantCategory.__table__
+user_table = User.__table__
+
+
+class MaintenanceError(Exception):
+    """ Raised when a maintenance operation names a category or user that
+    doesn't exist
+    """
+
+
+def lookupId(connection, table, column, value):
+    """ Return the id of the row with the given column value, raising
+    MaintenanceError if there is none
+    """
+    row_id = connection.execute(select([table.c.id]).where(
+        column == value)).scalar()
+    if row_id is None:
+        raise MaintenanceError('No %s with %s %s' % (table.name, column.name,
+            value))
+    return row_id
+
+
+def deleteCategory(connection, category_name):
+    """ Delete the named category and all of its plants. Returns the number
+    of plants deleted.
+    """
+    category_id = lookupId(connection, category_table, category_table.c.name,
+        category_name)
+    in_category = plant_table.c.category_id == category_id
+    recordMatchingPlantChanges(connection, in_category, deleted=True)
+    # The plants would also go with the category (ON DELETE CASCADE), but
+    # deleting them first works on databases created before the cascade
+    # and on connections that don't enforce foreign keys
+    deleted = connection.execute(plant_table.delete().where(
+        in_category)).rowcount
+    connection.execute(category_table.delete().where(
+        category_table.c.id == category_id))
+    return deleted
+
+
+def reassignPlants(connection, from_email, to_email):
+    """ Make the user with to_email the owner of every plant owned by the
+    user with from_email. Returns the number of plants reassigned.
+    """
+    from_id = lookupId(connection, user_table, user_table.c.email,
+        from_email)
+    to_id = lookupId(connection, user_table, user_table.c.email, to_email)
+    if from_id == to_id:
+        return 0
+    owned = plant_table.c.user_id == from_id
+    recordMatchingPlantChanges(connection, owned)
+    return connection.execute(plant_table.update().where(owned).values(
+        user_id=to_id)).rowcount
+
+
+def purgeCatalog(connection, categories=False, users=False):
+    """ Delete every plant, and with categories every category and with
+    users every user too. Returns the number of plants deleted.
+    """
+    recordMatchingPlantChanges(connection, deleted=True)
+    deleted = connection.execute(plant_table.delete()).rowcount
+    if categories:
+        connection.execute(category_table.delete())
+    else:
+        connection.execute(category_table.update().values(plant_count=0))
+    if users:
+        connection.execute(user_table.delete())
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Bulk maintenance of the plant catalog')
+    parser.add_argument('--database',
+        help='database URL (default: the DATABASE_URL setting)')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    delete = commands.add_parser('delete-category',
+        help='delete a category and all its plants')
+    delete.add_argument('category')
+    reassign = commands.add_parser('reassign',
+        help="give one user's plants to another")
+    reassign.add_argument('from_email')
+    reassign.add_argument('to_email')
+    purge = commands.add_parser('purge', help='delete every plant')
+    purge.add_argument('--categories', action='store_true',
+        help='delete the categories too')
+    purge.add_argument('--users', action='store_true',
+        help='delete the users too')
+    args = parser.parse_args(argv)
+
+    engine = createEngine(args.database)
+    start = default_timer()
+    try:
+        with engine.begin() as connection:
+            if args.command == 'delete-category':
+                summary = 'Deleted category %s and its %d plants' % (
+                    args.category, deleteCategory(connection, args.category))
+            elif args.command == 'reassign':
+                summary = 'Reassigned %d plants' % reassignPlants(connection,
+                    args.from_email, args.to_email)
+            else:
+                summary = 'Purged %d plants' % purgeCatalog(connection,
+                    args.categories, args.users)
+    except MaintenanceError as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+    sys.stderr.write('%s in %.2f s\n' % (summary,
+        default_timer() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
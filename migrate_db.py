@@ -0,0 +1,90 @@
+""" Python code to upgrade an existing plant catalog database in place.
+
+Creates any tables, columns and indexes defined in "database_setup.py"
+that are missing from the database, so a plantcatalog.db built by an older
+version of the application picks up the lookup indexes, unique
+constraints, full-text search index and category plant counts without
+being rebuilt. Added columns are filled in from the existing rows. It is
+safe to run more than once.
+
+Usage: python migrate_db.py [database URL, default the DATABASE_URL setting]
+"""
+import sys
+
+from sqlalchemy import func, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+from database_setup import Base, createEngine, createSearchIndex, \
+    refreshPlantCounts
+
+# Columns added to existing tables, as (table, column, function that fills
+# the column in for the existing rows)
+ADDED_COLUMNS = [('category', 'plant_count', refreshPlantCounts)]
+
+
+def findDuplicates(connection, table, columns):
+    """ Return the rows of values that appear more than once in the given
+    columns of the table, which would block a unique index on them
+    """
+    query = select(columns).group_by(*columns).having(func.count() > 1)
+    return connection.execute(query).fetchall()
+
+
+def addColumn(connection, column, fill):
+    """ Add the column to its existing table and fill it in, in one
+    transaction
+    """
+    with connection.begin():
+        connection.execute('ALTER TABLE %s ADD COLUMN %s' % (
+            column.table.name,
+            CreateColumn(column).compile(dialect=connection.dialect)))
+        fill(connection)
+
+
+def upgrade(engine):
+    """ Bring the database up to date with the current table definitions.
+    Returns the names of the tables, columns and indexes that were
+    created.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(engine)
+    created = [table.name for table in Base.metadata.sorted_tables
+        if table.name not in existing_tables]
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        for table_name, column_name, fill in ADDED_COLUMNS:
+            existing = set(column['name']
+                for column in inspector.get_columns(table_name))
+            if column_name not in existing:
+                addColumn(connection,
+                    Base.metadata.tables[table_name].c[column_name], fill)
+                created.append('%s.%s' % (table_name, column_name))
+        for table in Base.metadata.sorted_tables:
+            existing = set(index['name']
+                for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    duplicates = findDuplicates(connection, table,
+                        list(index.columns))
+                    if duplicates:
+                        print('Skipped unique index %s: duplicate values %s'
+                            % (index.name, ', '.join(repr(tuple(row))
+                                for row in duplicates)))
+                        continue
+                index.create(connection)
+                created.append(index.name)
+        if 'plant_search' not in inspector.get_table_names():
+            if createSearchIndex(connection, rebuild=True):
+                created.append('plant_search')
+    return created
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else None
+    created = upgrade(createEngine(url))
+    if created:
+        print('Created: %s' % ', '.join(created))
+    else:
+        print('Database is already up to date')
@@ -0,0 +1,133 @@
+""" Python code for the outbound calls to Google made while logging users
+in and out.
+
+All calls share pooled keep-alive connections and give up after
+HTTP_TIMEOUT seconds, so a slow Google endpoint can't hold a web server
+thread indefinitely. The code exchange made by oauth2client needs an
+httplib2.Http object, which isn't thread-safe, so each thread keeps its
+own. Token verifications are cached, so repeat checks of the same access
+token skip the round trip to Google. The OAuth flow is built once from
+the parsed client secrets and rebuilt only when they change.
+
+The endpoint URLs are settings (see "config.py"), so tests can point them
+at a local stub OAuth server.
+"""
+import socket
+import threading
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from oauth2client.client import OAuth2WebServerFlow, FlowExchangeError
+
+from cache import LRUCache
+from config import settings, client_secrets
+from instrumentation import timedPhase
+
+
+class GoogleUnavailable(Exception):
+    """ Raised when a call to Google fails or times out """
+
+
+def createHttpSession():
+    """ Create a requests session with a pool of keep-alive connections """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4,
+        pool_maxsize=settings.get('HTTP_POOL_SIZE'))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = createHttpSession()
+# Tokens that expire sooner than the cache TTL are not cached
+tokeninfo_cache = LRUCache(max_size=1024,
+    ttl=settings.get('TOKENINFO_CACHE_TTL'))
+flow_cache = LRUCache(max_size=1, ttl=None)
+_local = threading.local()
+
+
+def getHttp():
+    """ Return this thread's httplib2.Http object for oauth2client calls.
+    Reusing it keeps the connection to Google's token endpoint alive
+    between logins.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = httplib2.Http(
+            timeout=settings.get('HTTP_TIMEOUT'))
+    return http
+
+
+def getOAuthFlow():
+    """ Return the OAuth flow for the current client secrets """
+    secrets = client_secrets.load().get('web')
+    if not secrets:
+        raise FlowExchangeError('No client secrets configured')
+    return flow_cache.getOrLoad(client_secrets.version,
+        lambda: OAuth2WebServerFlow(secrets['client_id'],
+            secrets['client_secret'], scope='',
+            redirect_uri='postmessage', auth_uri=secrets['auth_uri'],
+            token_uri=secrets['token_uri'],
+            revoke_uri=secrets.get('revoke_uri')))
+
+
+def exchangeCode(code):
+    """ Exchange a one-time authorization code for a credentials object.
+    Raises FlowExchangeError if Google refuses the code.
+    """
+    oauth_flow = getOAuthFlow()
+    try:
+        with timedPhase('google'):
+            return oauth_flow.step2_exchange(code, http=getHttp())
+    except (httplib2.HttpLib2Error, socket.error) as e:
+        # Drop the thread's connection, it may be broken
+        _local.http = None
+        raise GoogleUnavailable('Token exchange failed: %s' % e)
+
+
+def getJSON(url, params):
+    """ Make a GET request to Google and return the decoded JSON reply """
+    try:
+        with timedPhase('google'):
+            answer = http_session.get(url, params=params,
+                timeout=settings.get('HTTP_TIMEOUT'))
+            return answer.json()
+    except (requests.RequestException, ValueError) as e:
+        raise GoogleUnavailable('Request to %s failed: %s' % (url, e))
+
+
+def getTokenInfo(access_token):
+    """ Return Google's description of an access token: which user and
+    client it was issued to, or an "error" entry if it isn't valid
+    """
+    info = tokeninfo_cache.get(access_token)
+    if info is None:
+        info = getJSON(settings.get('GOOGLE_TOKENINFO_URL'),
+            {'access_token': access_token})
+        try:
+            expires_in = int(info.get('expires_in', 0))
+        except ValueError:
+            expires_in = 0
+        if info.get('error') is None and expires_in > tokeninfo_cache.ttl:
+            tokeninfo_cache.set(access_token, info)
+    return info
+
+
+def getGoogleProfile(access_token):
+    """ Return the name, picture and email of the token's Google user """
+    return getJSON(settings.get('GOOGLE_USERINFO_URL'),
+        {'access_token': access_token, 'alt': 'json'})
+
+
+def revokeToken(access_token):
+    """ Ask Google to revoke an access token. Returns the HTTP status. """
+    tokeninfo_cache.invalidate(access_token)
+    try:
+        with timedPhase('google'):
+            answer = http_session.get(settings.get('GOOGLE_REVOKE_URL'),
+                params={'token': access_token},
+                timeout=settings.get('HTTP_TIMEOUT'))
+        return answer.status_code
+    except requests.RequestException as e:
+        raise GoogleUnavailable('Token revocation failed: %s' % e)
@@ -0,0 +1,173 @@
+""" Python code for caching whole catalog responses for anonymous visitors.
+
+The public catalog pages and JSON endpoints look the same for every
+visitor who isn't logged in, until the catalog changes. The catalog
+version, kept in the catalog_state table (see "database_setup.py"), goes
+up with every transaction that changes it, whichever process makes the
+change. Cached responses are only served for the version they were built
+for and carry an ETag derived from it, so a repeat client gets a 304 Not
+Modified without any template work, from any process.
+
+Each process reads the version from the database at most every
+VERSION_CHECK_INTERVAL seconds, and again right after a change of its
+own, so a write in another process retires its cached responses within
+that interval. A 304 is only sent once the page has been served at the
+current version, from the cache or by running the handler, so a page that
+has gone since the client saw it gets its 404 or redirect instead.
+Streamed responses, such as the full catalog export, aren't stored, but
+the cache remembers that they were served at the version: repeat clients
+get their 304 without the handler running, and the stream of a response
+that is answered with a 304 is closed before it reads anything.
+Cached responses also expire after RESPONSE_CACHE_TTL seconds, to free
+the memory held by pages nobody asks for.
+
+A handler whose output also depends on a request header (such as the API
+format negotiated from Accept) sets a cache_variant attribute: a function
+returning the variant of the current request, which goes into the cache
+key and the ETag.
+"""
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask import session as login_session
+
+from cache import LRUCache
+
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 60
+# Seconds between reads of the catalog version from the database
+VERSION_CHECK_INTERVAL = 1
+
+
+class CatalogVersion(object):
+    """ The catalog version, read with load() and cached for
+    check_interval seconds. Without load, as in a single process with no
+    database to share, the version is a counter kept by bump().
+
+    Attributes:
+        load (function): returns the version stored in the database
+        check_interval (float): seconds a version read stays current
+    """
+    def __init__(self, load=None, check_interval=VERSION_CHECK_INTERVAL):
+        self.load = load
+        self.check_interval = check_interval
+        self._value = 0
+        self._checked = None
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        """ The current catalog version """
+        with self._lock:
+            if self.load is not None:
+                now = time.time()
+                if self._checked is None or \
+                        now - self._checked >= self.check_interval:
+                    self._value = self.load()
+                    self._checked = now
+            return self._value
+
+    def bump(self):
+        """ Record a change made by this process, so the version is read
+        again on next use
+        """
+        with self._lock:
+            if self.load is None:
+                self._value += 1
+            self._checked = None
+
+
+class CachedResponse(object):
+    """ A response body and headers stored in the response cache, and
+    the body's compressed encodings (see "compression.py") by name. A
+    streamed response only records that it was served, with no body.
+    """
+    def __init__(self, version, response):
+        self.version = version
+        self.status = response.status_code
+        self.headers = list(response.headers)
+        self.streamed = response.is_streamed
+        self.body = None if self.streamed else response.get_data()
+        self.encoded = {}
+
+    def toResponse(self):
+        """ Build a fresh response object from the stored entry """
+        return current_app.response_class(self.body, status=self.status,
+            headers=self.headers)
+
+
+catalog_version = CatalogVersion()
+response_cache = LRUCache(max_size=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL)
+
+
+def isCacheable():
+    """ Only anonymous GET requests with no flash messages waiting share
+    cached responses
+    """
+    return (request.method in ('GET', 'HEAD') and
+        'username' not in login_session and
+        '_flashes' not in login_session)
+
+
+def isNotModified(etag):
+    """ Check the request's If-None-Match header against the ETag of the
+    current catalog version
+    """
+    # Compressed responses carry a weak version of the ETag
+    return bool(request.if_none_match) and \
+        request.if_none_match.contains_weak(etag)
+
+
+def setValidators(response, etag):
+    """ Add the ETag header for the catalog version """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def cachedResponse(my_function):
+    """ Decorator for page handlers whose output only depends on the URL
+    (and the handler's cache_variant, if it has one) and the catalog
+    version. Caches successful responses for other anonymous visitors and
+    serves 304s to clients holding the current version.
+    """
+    @wraps(my_function)
+    def decorated_function(*args, **kws):
+        if not isCacheable():
+            return my_function(*args, **kws)
+        version = catalog_version.value
+        etag = 'v%d' % version
+        key = request.full_path
+        cache_variant = getattr(my_function, 'cache_variant', None)
+        if cache_variant is not None:
+            variant = cache_variant()
+            etag = '%s-%s' % (etag, variant)
+            key = '%s %s' % (key, variant)
+
+        entry = response_cache.get(key)
+        response = None
+        if entry is None or entry.version != version:
+            response = current_app.make_response(my_function(*args, **kws))
+            if response.status_code != 200:
+                return response
+            entry = CachedResponse(version, response)
+            response_cache.set(key, entry)
+        if isNotModified(etag):
+            if response is not None:
+                # Don't leave a stream that will never be read open
+                response.close()
+            return setValidators(current_app.response_class(status=304),
+                etag)
+        if entry.streamed:
+            if response is None:
+                response = current_app.make_response(
+                    my_function(*args, **kws))
+            return setValidators(response, etag)
+        response = entry.toResponse()
+        response.cache_entry = entry
+        return setValidators(response, etag)
+    return decorated_function
@@ -0,0 +1,341 @@
+""" Python code for keeping login sessions on the server.
+
+Flask's default session is a signed cookie holding the whole session
+(credentials, Google ID, user name, picture, email, user ID and the state
+token), which every request sends and the server re-signs whenever it
+changes. With a server-side session the cookie holds only a random
+session ID, and the data stays in a session store:
+    MemoryStore      - an in-process LRU cache; fastest, but each server
+                       process has its own sessions
+    SQLiteStore      - a table in a SQLite database shared by every
+                       process on the machine
+    FilesystemStore  - one file per session in a directory, which a
+                       shared or network store can stand in for
+Any object with the SessionStore methods can be used as a store.
+
+Sessions expire SESSION_LIFETIME seconds after they were last saved.
+A session that is only read is saved again once half its lifetime has
+passed, so active users stay logged in without a write on every request.
+Expired sessions are deleted in bulk every PURGE_INTERVAL seconds.
+
+Requests for static files skip the session entirely, and a visitor gets
+a session cookie only once something is stored in their session.
+"""
+import base64
+import os
+import re
+import tempfile
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SessionInterface
+from flask.sessions import SecureCookieSessionInterface
+from flask.sessions import session_json_serializer
+from sqlalchemy import Column, Float, MetaData, String, Table, Text
+from sqlalchemy import select
+
+from cache import LRUCache
+from database_setup import createEngine
+
+# Seconds between bulk deletions of expired sessions
+PURGE_INTERVAL = 300
+SESSION_ID_BYTES = 32
+# Session IDs are URL-safe base64, which also makes them safe file names
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{43}$')
+DEFAULT_LOCATIONS = {
+    'memory': 10000,
+    'sqlite': 'sqlite:///sessions.db',
+    'filesystem': 'sessions',
+}
+
+metadata = MetaData()
+session_table = Table('session', metadata,
+    Column('id', String(43), primary_key=True),
+    Column('data', Text, nullable=False),
+    Column('expires', Float, nullable=False, index=True))
+
+
+def newSessionId():
+    """ Return a new random session ID """
+    return base64.urlsafe_b64encode(os.urandom(SESSION_ID_BYTES)).decode(
+        'ascii').rstrip('=')
+
+
+class SessionStore(object):
+    """ Interface of the session stores. Session data is a dictionary,
+    and expires is a time.time() value after which the session is gone.
+    """
+    def load(self, sid):
+        """ Return (data, expires) for the session, or None if it doesn't
+        exist or has expired
+        """
+        raise NotImplementedError
+
+    def save(self, sid, data, expires):
+        """ Store the session's data, replacing any stored before """
+        raise NotImplementedError
+
+    def delete(self, sid):
+        """ Delete the session, if it exists """
+        raise NotImplementedError
+
+    def purgeExpired(self):
+        """ Delete every expired session. Returns how many were deleted. """
+        raise NotImplementedError
+
+
+class MemoryStore(SessionStore):
+    """ Keeps sessions in an LRU cache in this process. When it is full the
+    least recently used session is dropped.
+    """
+    def __init__(self, max_size=DEFAULT_LOCATIONS['memory']):
+        self.sessions = LRUCache(max_size=int(max_size), ttl=None)
+
+    def load(self, sid):
+        entry = self.sessions.get(sid)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry
+
+    def save(self, sid, data, expires):
+        self.sessions.set(sid, (data, expires))
+
+    def delete(self, sid):
+        self.sessions.invalidate(sid)
+
+    def purgeExpired(self):
+        now = time.time()
+        return self.sessions.purge(lambda entry: entry[1] <= now)
+
+
+class SQLiteStore(SessionStore):
+    """ Keeps sessions in the session table of a SQLite database, which
+    is created if needed. Each process connects on first use.
+    """
+    def __init__(self, url=DEFAULT_LOCATIONS['sqlite']):
+        self.url = url
+        self._engine = None
+        self._engine_pid = None
+        self._lock = threading.Lock()
+
+    def getEngine(self):
+        """ Return this process's engine, creating the table the first
+        time it is used. Its statements don't count towards the pages'
+        query budgets.
+        """
+        if self._engine_pid != os.getpid():
+            with self._lock:
+                if self._engine_pid != os.getpid():
+                    engine = createEngine(self.url).execution_options(
+                        in_query_budget=False)
+                    metadata.create_all(engine)
+                    self._engine = engine
+                    self._engine_pid = os.getpid()
+        return self._engine
+
+    def load(self, sid):
+        with self.getEngine().connect() as connection:
+            row = connection.execute(select([session_table.c.data,
+                session_table.c.expires]).where(
+                session_table.c.id == sid)).first()
+        if row is None or row.expires <= time.time():
+            return None
+        return session_json_serializer.loads(row.data), row.expires
+
+    def save(self, sid, data, expires):
+        with self.getEngine().begin() as connection:
+            connection.execute(session_table.insert().prefix_with(
+                'OR REPLACE'), id=sid, expires=expires,
+                data=session_json_serializer.dumps(data))
+
+    def delete(self, sid):
+        with self.getEngine().begin() as connection:
+            connection.execute(session_table.delete().where(
+                session_table.c.id == sid))
+
+    def purgeExpired(self):
+        with self.getEngine().begin() as connection:
+            return connection.execute(session_table.delete().where(
+                session_table.c.expires <= time.time())).rowcount
+
+
+class FilesystemStore(SessionStore):
+    """ Keeps each session in a file named by its ID. A file's
+    modification time is set to the session's expiry time, so expired
+    sessions can be found without reading them.
+    """
+    def __init__(self, directory=DEFAULT_LOCATIONS['filesystem']):
+        self.directory = directory
+
+    def path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        try:
+            with open(self.path(sid), 'r') as f:
+                expires = os.fstat(f.fileno()).st_mtime
+                if expires <= time.time():
+                    return None
+                return session_json_serializer.loads(f.read()), expires
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, sid, data, expires):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Another process made it first
+                pass
+        # Write through a temporary file and a rename, so readers never
+        # see a session half written
+        handle, temporary = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(session_json_serializer.dumps(data))
+            os.utime(temporary, (expires, expires))
+            os.rename(temporary, self.path(sid))
+        except Exception:
+            os.remove(temporary)
+            raise
+
+    def delete(self, sid):
+        try:
+            os.remove(self.path(sid))
+        except OSError:
+            pass
+
+    def purgeExpired(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        now = time.time()
+        purged = 0
+        for name in os.listdir(self.directory):
+            if not SESSION_ID_PATTERN.match(name):
+                continue
+            try:
+                if os.stat(self.path(name)).st_mtime <= now:
+                    os.remove(self.path(name))
+                    purged += 1
+            except OSError:
+                # Deleted or replaced by another process meanwhile
+                pass
+        return purged
+
+
+STORES = {
+    'memory': MemoryStore,
+    'sqlite': SQLiteStore,
+    'filesystem': FilesystemStore,
+}
+
+
+class ServerSideSession(SecureCookieSession):
+    """ A session whose data is kept in a session store
+
+    Attributes:
+        sid (str): session ID, or None until the session is first saved
+        expires (float): when the stored copy expires, None if not stored
+        old_sid (str): ID the session had before regenerate() was called
+    """
+    def __init__(self, data=None, sid=None, expires=None):
+        super(ServerSideSession, self).__init__(data or {})
+        self.sid = sid
+        self.expires = expires
+        self.old_sid = None
+
+    def regenerate(self):
+        """ Move the session to a new ID when it is saved, so that an ID
+        known to someone else before a login is no use after it
+        """
+        if self.sid is not None and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """ Flask session interface that keeps sessions in a session store
+    and only the session ID in the cookie
+    """
+    session_class = ServerSideSession
+
+    def __init__(self, store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+        self._next_purge = time.time() + PURGE_INTERVAL
+        self._purge_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        if request.path.startswith(app.static_url_path + '/'):
+            return self.make_null_session(app)
+        self.purgeIfDue()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_PATTERN.match(sid):
+            entry = self.store.load(sid)
+            if entry is not None:
+                data, expires = entry
+                return self.session_class(data, sid=sid, expires=expires)
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        if self.is_null_session(session):
+            return
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.old_sid is not None:
+            self.store.delete(session.old_sid)
+        if not session:
+            if session.sid is not None or session.old_sid is not None:
+                if session.sid is not None:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        new_sid = session.sid is None
+        half_spent = session.expires is not None and \
+            session.expires - now < self.lifetime / 2.0
+        if not (new_sid or session.modified or half_spent):
+            return
+        if new_sid:
+            session.sid = newSessionId()
+        session.expires = now + self.lifetime
+        self.store.save(session.sid, dict(session), session.expires)
+        if new_sid or session.permanent:
+            response.set_cookie(name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain,
+                path=path, secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+
+    def purgeIfDue(self):
+        """ Delete the expired sessions if it's time to, in at most one
+        thread at a time
+        """
+        if time.time() < self._next_purge or \
+                not self._purge_lock.acquire(False):
+            return
+        try:
+            self._next_purge = time.time() + PURGE_INTERVAL
+            self.store.purgeExpired()
+        finally:
+            self._purge_lock.release()
+
+
+def createSessionInterface(store_name, location=None, lifetime=604800):
+    """ Return the session interface for the named store ('cookie' for
+    Flask's signed cookie sessions). location is the store's maximum size,
+    database URL or directory, and defaults to DEFAULT_LOCATIONS.
+    """
+    if store_name == 'cookie':
+        return SecureCookieSessionInterface()
+    if store_name not in STORES:
+        raise ValueError('Unknown session store %r, expected one of %s'
+            % (store_name, ', '.join(['cookie'] + sorted(STORES))))
+    if location is None:
+        location = DEFAULT_LOCATIONS[store_name]
+    return ServerSideSessionInterface(STORES[store_name](location), lifetime)
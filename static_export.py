@@ -0,0 +1,423 @@
+""" Python code to pre-render the public plant catalog into static files.
+
+Renders the pages an anonymous visitor sees, with the application's own
+views and templates, into a directory tree that a CDN or a plain file
+server can serve without Python:
+
+    index.html, catalog/index.html           home page
+    catalog/<category>/index.html            first page of a category
+    catalog/<category>/after/<id>/index.html category page after plant id
+    catalog/<category>/before/<id>/index.html  ... and before plant id
+    catalog/<category>/<plant>/index.html    plant page
+    catalog/JSON/index.json                  the whole catalog as JSON
+    catalog/<category>/JSON/index.json       a category's plants as JSON
+    static/...                               a copy of the static files
+
+The Previous and Next links of the category pages are rewritten from
+query strings (?after=<id>) to the after/ and before/ directories, since
+file servers ignore query strings. The file server should look for
+index.json as well as index.html in a directory, e.g. for nginx:
+
+    index index.html index.json;
+    types { application/json json; }
+
+Pages are rendered by a pool of worker processes. The export keeps the
+catalog version it was made at (see the change feed in "database_setup.py")
+in a state file in the output directory, and a later run into the same
+directory only re-renders the plants changed since then, the categories
+they were or are in, the home page and the catalog JSON, and removes the
+pages of deleted, renamed and moved plants. Changes to the templates or
+the static asset manifest make the next run render everything again, as
+does --full. Changes that aren't recorded in the change feed, such as a
+user's new name or picture, need --full too.
+
+Dependencies: "application.py", "database_setup.py", "image_store.py"
+
+Usage: python static_export.py output_dir [--full] [--processes N]
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+from timeit import default_timer
+
+from flask import url_for
+from sqlalchemy import func, select
+from werkzeug.exceptions import HTTPException
+
+from application import CATEGORY_PAGE_SIZE, create_app
+from database_setup import PlantCategory, PlantChange, PlantItem, \
+    createEngine
+from image_store import writeFile
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+plant_table = PlantItem.__table__
+category_table = PlantCategory.__table__
+change_table = PlantChange.__table__
+
+STATE_FILE = '.static-export.json'
+# Bump when the layout of the exported tree changes, so the next run
+# renders everything again
+STATE_FORMAT = 1
+# Pages handed to a worker at a time
+CHUNK_SIZE = 32
+# Most values bound in one IN (...) query
+ID_BATCH_SIZE = 500
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'templates')
+# Category page links with a keyset cursor in the query string
+PAGE_LINK_PATTERN = re.compile(
+    br'(href\s*=\s*"[^"?]*/)\?(after|before)=(\d+)"')
+
+# Each worker process's test client
+_worker = {}
+
+
+def templateFingerprint(app):
+    """ Return a hash of everything besides the catalog that the pages
+    depend on: the templates, the static asset manifest and the page size
+    """
+    digest = hashlib.sha1(str(CATEGORY_PAGE_SIZE).encode('utf-8'))
+    paths = [os.path.join(app.static_folder, 'dist', 'manifest.json')]
+    for directory, names, files in os.walk(TEMPLATE_DIR):
+        paths.extend(os.path.join(directory, name) for name in files)
+    for path in sorted(paths):
+        if os.path.isfile(path):
+            digest.update(path.encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def outputPath(root, url_path, name):
+    """ Return the file name under root for the page at url_path, or None
+    if the path would point outside root (such as a plant named '..')
+    """
+    parts = unquote(url_path).strip('/').split('/')
+    if any(part in ('.', '..') or '\0' in part for part in parts):
+        return None
+    return os.path.join(root, *[part for part in parts if part] + [name])
+
+
+def removeFile(root, path):
+    """ Remove a page file, and any directories left empty up to root """
+    if path is None or not os.path.isfile(path):
+        return
+    os.remove(path)
+    directory = os.path.dirname(path)
+    while directory != root and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+def categoryPageFiles(category_dir):
+    """ Return the after/ and before/ page files of a category that are
+    on disk
+    """
+    files = []
+    for cursor in ('after', 'before'):
+        directory = os.path.join(category_dir, cursor)
+        if os.path.isdir(directory):
+            files.extend(os.path.join(directory, name, 'index.html')
+                for name in os.listdir(directory) if name.isdigit())
+    return files
+
+
+def initWorker():
+    """ Set up a worker process with its own application """
+    _worker['client'] = create_app().test_client(use_cookies=False)
+
+
+def renderPage(task):
+    """ Render the page at a URL and write it to each of the given paths.
+    Returns (url, paths, status, bytes written).
+    """
+    url, paths = task
+    response = _worker['client'].get(url,
+        headers={'Accept-Encoding': 'identity'})
+    if response.status_code != 200:
+        return url, paths, response.status_code, 0
+    body = response.get_data()
+    if response.mimetype == 'text/html':
+        body = PAGE_LINK_PATTERN.sub(br'\1\2/\3/"', body)
+    for path in paths:
+        writeFile(path, body)
+    return url, paths, 200, len(body) * len(paths)
+
+
+def copyStatic(source, target):
+    """ Copy the static files that are new or changed. Returns the number
+    of files copied.
+    """
+    copied = 0
+    for directory, names, files in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(directory, source))
+        for name in files:
+            source_path = os.path.join(directory, name)
+            target_path = os.path.join(target_dir, name)
+            stat = os.stat(source_path)
+            if os.path.isfile(target_path):
+                target_stat = os.stat(target_path)
+                if target_stat.st_size == stat.st_size and \
+                        target_stat.st_mtime >= stat.st_mtime:
+                    continue
+            if not os.path.isdir(target_dir):
+                os.makedirs(target_dir)
+            shutil.copy2(source_path, target_path)
+            copied += 1
+    return copied
+
+
+def loadState(root):
+    """ Return the state of the last export into root, or None """
+    try:
+        with open(os.path.join(root, STATE_FILE)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def saveState(root, state):
+    writeFile(os.path.join(root, STATE_FILE),
+        json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+
+def iterBatches(values, size=ID_BATCH_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def readPlants(connection, plant_ids=None):
+    """ Return {plant id: (category name, plant name)} for the given
+    plants, or for every plant without plant_ids. Plants without a
+    category have no pages, so they are left out.
+    """
+    query = select([plant_table.c.id, category_table.c.name,
+        plant_table.c.name]).select_from(plant_table.join(category_table))
+    if plant_ids is None:
+        rows = connection.execute(query)
+        return dict((row[0], (row[1], row[2])) for row in rows)
+    plants = {}
+    for batch in iterBatches(plant_ids):
+        rows = connection.execute(query.where(plant_table.c.id.in_(batch)))
+        plants.update((row[0], (row[1], row[2])) for row in rows)
+    return plants
+
+
+def categoryPages(connection, category_id):
+    """ Return the plant ids of a category split into its pages """
+    ids = [row[0] for row in connection.execute(select([plant_table.c.id])
+        .where(plant_table.c.category_id == category_id)
+        .order_by(plant_table.c.id))]
+    return [ids[i:i + CATEGORY_PAGE_SIZE]
+        for i in range(0, len(ids), CATEGORY_PAGE_SIZE)] or [[]]
+
+
+def categoryTasks(root, url, pages):
+    """ Return the render tasks for every page of a category. The page
+    reached with before=<first id of the next page> is the same page as
+    the one reached with after=<last id of the page before>, so each page
+    is rendered once and written to both places.
+    """
+    tasks = []
+    for number, page in enumerate(pages):
+        if number == 0:
+            page_url = url
+            paths = [outputPath(root, url, 'index.html')]
+        else:
+            after = pages[number - 1][-1]
+            page_url = '%s?after=%d' % (url, after)
+            paths = [outputPath(root, '%safter/%d/' % (url, after),
+                'index.html')]
+        if number + 1 < len(pages):
+            paths.append(outputPath(root, '%sbefore/%d/' % (url,
+                pages[number + 1][0]), 'index.html'))
+        tasks.append((page_url, paths))
+    return tasks
+
+
+def matchEndpoint(adapter, url):
+    """ Return the endpoint that a URL reaches, or None """
+    try:
+        return adapter.match(unquote(url))[0]
+    except HTTPException:
+        return None
+
+
+def planExport(app, connection, root, state, full):
+    """ Work out what to render and remove. Returns (tasks, removals,
+    new state): the (url, paths) pages to render, the files to remove once
+    they are rendered, and the state to save after that.
+    """
+    version = connection.execute(
+        select([func.max(change_table.c.version)])).scalar() or 0
+    fingerprint = templateFingerprint(app)
+    if state is None or state.get('format') != STATE_FORMAT:
+        state = {'plants': {}, 'categories': []}
+        full = True
+    elif state.get('fingerprint') != fingerprint:
+        full = True
+    # The pages of the last export, which are removed if they are gone
+    old_plants = dict((int(plant_id), tuple(value))
+        for plant_id, value in state['plants'].items())
+    old_categories = set(state['categories'])
+
+    categories = dict(connection.execute(
+        select([category_table.c.name, category_table.c.id])).fetchall())
+    if full:
+        plants = readPlants(connection)
+        changed = set(plants).union(old_plants)
+        changed_categories = set(categories)
+    else:
+        changed = set(row[0] for row in connection.execute(
+            select([change_table.c.plant_id]).distinct().where(
+            change_table.c.version > state['version'])))
+        plants = readPlants(connection, changed)
+        changed_categories = set(old_plants[plant_id][0]
+            for plant_id in changed if plant_id in old_plants)
+        changed_categories.update(plant[0] for plant in plants.values())
+        changed_categories.update(old_categories.symmetric_difference(
+            categories))
+
+    with app.test_request_context():
+        def plantUrl(category_name, plant_name, endpoint='showPlantItem'):
+            return url_for('catalog.' + endpoint, category_name=category_name,
+                plant_name=plant_name)
+        removals = []
+        for plant_id in changed:
+            old = old_plants.get(plant_id)
+            if old is not None and old != plants.get(plant_id):
+                removals.append(outputPath(root, plantUrl(*old),
+                    'index.html'))
+                removals.append(outputPath(root,
+                    plantUrl(*old, endpoint='plantJSON'), 'index.json'))
+        for category_name in old_categories - set(categories):
+            url = url_for('catalog.showCategory', category_name=category_name)
+            removals.extend(categoryPageFiles(outputPath(root, url, '')))
+            removals.append(outputPath(root, url, 'index.html'))
+            removals.append(outputPath(root, url_for('catalog.categoryJSON',
+                category_name=category_name), 'index.json'))
+
+        tasks = []
+        if changed or changed_categories:
+            tasks.append(('/catalog/', [outputPath(root, '/', 'index.html'),
+                outputPath(root, '/catalog/', 'index.html')]))
+            tasks.append((url_for('catalog.allPlantsJSON'), [outputPath(root,
+                url_for('catalog.allPlantsJSON'), 'index.json')]))
+        for category_name in sorted(changed_categories):
+            if category_name not in categories:
+                continue
+            url = url_for('catalog.showCategory', category_name=category_name)
+            page_tasks = categoryTasks(root, url,
+                categoryPages(connection, categories[category_name]))
+            tasks.extend(page_tasks)
+            # Pages at cursors that are no longer page boundaries
+            rendered = set(path for page_url, paths in page_tasks
+                for path in paths)
+            removals.extend(path for path in categoryPageFiles(
+                outputPath(root, url, '')) if path not in rendered)
+            json_url = url_for('catalog.categoryJSON',
+                category_name=category_name)
+            tasks.append((json_url, [outputPath(root, json_url,
+                'index.json')]))
+        # Plant JSON URLs are only exported if they reach plantJSON
+        adapter = app.url_map.bind('localhost')
+        for plant_id in sorted(plants):
+            url = plantUrl(*plants[plant_id])
+            tasks.append((url, [outputPath(root, url, 'index.html')]))
+            json_url = plantUrl(*plants[plant_id], endpoint='plantJSON')
+            if matchEndpoint(adapter, json_url) == 'catalog.plantJSON':
+                tasks.append((json_url, [outputPath(root, json_url,
+                    'index.json')]))
+
+    # Pages whose URL doesn't map to a file under root aren't exported
+    tasks = [(url, paths) for url, paths in tasks if None not in paths]
+    for plant_id in changed:
+        old_plants.pop(plant_id, None)
+    old_plants.update(plants)
+    new_state = {'format': STATE_FORMAT, 'fingerprint': fingerprint,
+        'version': version, 'categories': sorted(categories),
+        'plants': old_plants}
+    return tasks, removals, new_state
+
+
+def export(root, full=False, processes=None):
+    """ Export the catalog into the directory root. Returns (pages
+    rendered, bytes written, URLs that failed).
+    """
+    root = os.path.abspath(root)
+    app = create_app()
+    engine = createEngine()
+    with engine.connect() as connection:
+        tasks, removals, state = planExport(app, connection, root,
+            loadState(root), full)
+    # The workers open their own connections
+    engine.dispose()
+
+    copyStatic(app.static_folder, os.path.join(root, 'static'))
+    rendered = written = 0
+    failed = []
+    if processes == 1:
+        initWorker()
+        results = (renderPage(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initWorker)
+        results = pool.imap_unordered(renderPage, tasks, CHUNK_SIZE)
+    try:
+        for url, paths, status, size in results:
+            if status == 200:
+                rendered += 1
+                written += size
+            elif status in (301, 302, 404):
+                # Gone since the export was planned
+                removals.extend(paths)
+            else:
+                failed.append('%s (%d)' % (url, status))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    # Old pages go once their replacements are in place
+    for path in removals:
+        removeFile(root, path)
+    # Without a state, the next run renders everything again
+    if not failed:
+        saveState(root, state)
+    return rendered, written, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Pre-render the public plant catalog into static files')
+    parser.add_argument('output', help='directory to write the files to')
+    parser.add_argument('--full', action='store_true',
+        help='render every page, not just the changed ones')
+    parser.add_argument('--processes', type=int, default=None,
+        help='number of rendering processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    start = default_timer()
+    rendered, written, failed = export(args.output, args.full,
+        args.processes)
+    elapsed = default_timer() - start
+    sys.stderr.write('Rendered %d pages (%.1f MB) in %.2f s (%d pages/s)\n'
+        % (rendered, written / 1048576.0, elapsed,
+            rendered / elapsed if elapsed else 0))
+    if failed:
+        sys.stderr.write('Failed: %s\n' % ', '.join(failed[:20]))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+""" Shared fixtures for the plant catalog tests.
+
+Each test gets a fresh SQLite catalog in a temporary directory and an
+application created with create_app({'TESTING': True}), so every page is
+held to its query budget. The Google OAuth endpoints are pointed at the
+stub server in "benchmarks/oauth_stub.py", which has to happen before
+"config.py" is imported.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+CATALOG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if CATALOG_DIR not in sys.path:
+    sys.path.insert(0, CATALOG_DIR)
+
+from benchmarks.oauth_stub import startStub, useStub
+
+settings_dir = tempfile.mkdtemp()
+oauth_stub = startStub()
+useStub(oauth_stub, settings_dir)
+# Keep any local settings file out of the tests
+os.environ['CATALOG_SETTINGS'] = os.path.join(settings_dir,
+    'catalog_settings.json')
+os.environ['CATALOG_SECRET_KEY'] = 'test'
+os.environ['CATALOG_SESSION_STORE'] = 'memory'
+os.environ['CATALOG_TEMPLATE_BYTECODE_CACHE'] = 'false'
+
+import application
+from database_setup import Base, PlantCategory, PlantItem, User, \
+    createEngine
+from fragment_cache import fragment_cache
+from oauth_client import tokeninfo_cache
+from response_cache import catalog_version, response_cache
+
+MAINTENANCE_TOKEN = 'test-maintenance-token'
+
+
+def pytest_unconfigure(config):
+    oauth_stub.shutdown()
+    shutil.rmtree(settings_dir, ignore_errors=True)
+
+
+def fillCatalog(engine):
+    """ Create the tables and a small catalog: two users, two categories
+    and three plants
+    """
+    Base.metadata.create_all(engine)
+    connection = engine.connect()
+    session = application.DBSession(bind=connection)
+    alice = User(name='alice', email='alice@example.com',
+        picture='/static/images/blank_user.gif')
+    bob = User(name='bob', email='bob@example.com',
+        picture='/static/images/blank_user.gif')
+    annuals = PlantCategory(name='Annuals')
+    trees = PlantCategory(name='Trees')
+    session.add_all([
+        PlantItem(name='Cosmos', botanical_name='Cosmos bipinnatus',
+            description='Tall pink flowers', image='', category=annuals,
+            user=alice),
+        PlantItem(name='Marigold', botanical_name='Tagetes erecta',
+            description='Bright orange flowers', image='', category=annuals,
+            user=alice),
+        PlantItem(name='Oak', botanical_name='Quercus robur',
+            description='A shady tree', image='', category=trees, user=bob)])
+    session.commit()
+    session.close()
+    connection.close()
+
+
+def resetApplication():
+    """ Drop the engines and every cache, so nothing carries over from
+    another test's database
+    """
+    for engine in set(application._engines.values()):
+        engine.dispose()
+    application._engines = {}
+    application._engines_pid = None
+    application.db_session.remove()
+    for cache in (application.category_cache, application.plant_cache,
+            application.user_cache, application.schema_cache,
+            response_cache, fragment_cache, tokeninfo_cache):
+        cache.clear()
+    # Read the catalog version from the new database on next use
+    catalog_version.bump()
+
+
+@pytest.fixture
+def database_url(tmp_path, monkeypatch):
+    """ URL of a fresh catalog database, which the application uses """
+    url = 'sqlite:///%s' % tmp_path.joinpath('catalog.db')
+    engine = createEngine(url)
+    fillCatalog(engine)
+    engine.dispose()
+    monkeypatch.setenv('CATALOG_DATABASE_URL', url)
+    monkeypatch.setenv('CATALOG_MAINTENANCE_TOKEN', MAINTENANCE_TOKEN)
+    return url
+
+
+@pytest.fixture
+def app(database_url):
+    resetApplication()
+    yield application.create_app({'TESTING': True})
+    resetApplication()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, email):
+    """ Log the test client in as the user with the given email, as
+    gconnect would
+    """
+    user = application.db_session.query(User).filter_by(email=email).one()
+    with client.session_transaction() as session:
+        session['username'] = user.name
+        session['email'] = user.email
+        session['picture'] = user.picture
+        session['user_id'] = user.id
+    application.db_session.remove()
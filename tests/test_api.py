@@ -0,0 +1,98 @@
+""" Tests of the JSON API endpoints, which read plants as plain rows """
+import json
+
+import pytest
+
+import application
+from database_setup import PlantItem
+
+COSMOS = {'name': 'Cosmos', 'id': 1, 'botanical_name': 'Cosmos bipinnatus',
+    'description': 'Tall pink flowers', 'image': '', 'category': 'Annuals'}
+MARIGOLD = {'name': 'Marigold', 'id': 2, 'botanical_name': 'Tagetes erecta',
+    'description': 'Bright orange flowers', 'image': '',
+    'category': 'Annuals'}
+OAK = {'name': 'Oak', 'id': 3, 'botanical_name': 'Quercus robur',
+    'description': 'A shady tree', 'image': '', 'category': 'Trees'}
+MSGPACK_HEADERS = {'Accept': 'application/msgpack'}
+
+
+def test_catalog_streams_one_document(client):
+    response = client.get('/catalog/JSON/')
+    assert response.is_streamed
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == {'Plants': [COSMOS, MARIGOLD, OAK]}
+
+
+def test_catalog_stream_spans_batches(client):
+    count = application.PLANTS_STREAM_BATCH + 10
+    application.getEngine().execute(PlantItem.__table__.insert(), [
+        {'name': 'Plant %d' % i, 'botanical_name': '', 'description': '',
+            'image': '', 'category_id': 2, 'user_id': 2}
+        for i in range(count)])
+    plants = client.get('/catalog/JSON/').get_json()['Plants']
+    ids = [plant['id'] for plant in plants]
+    assert ids == list(range(1, count + 4))
+    lines = client.get('/catalog/JSON/?format=ndjson').get_data(
+        as_text=True).splitlines()
+    assert len(lines) == count + 3
+
+
+def test_catalog_pages_follow_the_cursor(client):
+    page = client.get('/catalog/JSON/?limit=2').get_json()
+    assert page == {'Plants': [COSMOS, MARIGOLD], 'next': 2}
+    page = client.get('/catalog/JSON/?limit=2&after=2').get_json()
+    assert page == {'Plants': [OAK], 'next': None}
+    page = client.get('/catalog/JSON/?after=3').get_json()
+    assert page == {'Plants': [], 'next': None}
+
+
+def test_catalog_page_limit_is_clamped(client):
+    page = client.get('/catalog/JSON/?limit=0').get_json()
+    assert page == {'Plants': [COSMOS], 'next': 1}
+
+
+def test_catalog_ndjson(client):
+    response = client.get('/catalog/JSON/?format=ndjson&after=1')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [MARIGOLD, OAK]
+
+
+def test_catalog_msgpack(client):
+    msgpack = pytest.importorskip('msgpack')
+    response = client.get('/catalog/JSON/', headers=MSGPACK_HEADERS)
+    assert response.mimetype == 'application/msgpack'
+    assert 'Accept' in response.headers['Vary']
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(response.data)
+    assert list(unpacker) == [COSMOS, MARIGOLD, OAK]
+    response = client.get('/catalog/JSON/?limit=1&after=1',
+        headers=MSGPACK_HEADERS)
+    assert msgpack.unpackb(response.data, raw=False) == {
+        'Plants': [MARIGOLD], 'next': 2}
+    # The JSON copy of the same page is cached separately
+    page = client.get('/catalog/JSON/?limit=1&after=1').get_json()
+    assert page == {'Plants': [MARIGOLD], 'next': 2}
+
+
+def test_plant_json(client):
+    response = client.get('/catalog/Annuals/Cosmos/JSON/')
+    assert response.get_json() == {'Plant': COSMOS}
+    assert response.headers['X-Query-Count'] == '1'
+
+
+def test_plant_json_in_other_category_redirects(client):
+    response = client.get('/catalog/Trees/Cosmos/JSON/')
+    assert response.status_code == 302
+    assert client.get('/catalog/Annuals/Oak/JSON/').status_code == 302
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_search_json(client, monkeypatch, indexed):
+    if not indexed:
+        monkeypatch.setattr(application, 'hasSearchIndex', lambda: False)
+    plants = client.get('/catalog/search/JSON/?q=tall+flow').get_json()
+    assert plants == {'Plants': [COSMOS]}
+    plants = client.get('/catalog/search/JSON/?q=flowers').get_json()
+    assert sorted(plant['name'] for plant in plants['Plants']) == \
+        ['Cosmos', 'Marigold']
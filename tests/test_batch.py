@@ -0,0 +1,25 @@
+""" Tests of the batch plant write endpoint """
+from conftest import login
+
+
+def test_batch_refuses_bad_items(client):
+    login(client, 'alice@example.com')
+    response = client.post('/catalog/JSON/batch/', json=[
+        {'name': 'Zinnia', 'category': ['Annuals']},
+        {'name': 'Aster', 'category': {'name': 'Annuals'}},
+        {'name': 'Daisy', 'category': 'Shrubs'},
+        {'name': 7},
+        'Poppy',
+        {'name': 'Sunflower', 'category': 'Annuals'}])
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result.get('error') for result in results] == [
+        'category must be a string',
+        'category must be a string',
+        'Category Shrubs is not in catalog',
+        'name must be a string',
+        'Each plant must be a JSON object',
+        None]
+    assert results[-1]['status'] == 'created'
+    assert client.get('/catalog/Annuals/Sunflower/').status_code == 200
+    assert client.get('/catalog/Annuals/Zinnia/').status_code == 302
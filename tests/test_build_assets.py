@@ -0,0 +1,58 @@
+""" Tests of the fingerprinted asset build """
+import os
+import re
+import shutil
+
+import pytest
+
+import build_assets
+
+
+@pytest.fixture
+def static_dir(tmp_path, monkeypatch):
+    """ A copy of the static files, built into its own dist directory """
+    static = tmp_path.joinpath('static')
+    shutil.copytree(build_assets.STATIC_DIR, str(static),
+        ignore=shutil.ignore_patterns('dist', 'uploads'))
+    monkeypatch.setattr(build_assets, 'STATIC_DIR', str(static))
+    monkeypatch.setattr(build_assets, 'DIST_DIR', str(static.joinpath('dist')))
+    monkeypatch.setattr(build_assets, 'MANIFEST_FILE',
+        str(static.joinpath('dist', 'manifest.json')))
+    return static
+
+
+def test_built_css_only_references_hashed_urls(static_dir):
+    manifest = build_assets.build()
+    with open(str(static_dir.joinpath(manifest['styles.css']))) as f:
+        css = f.read()
+    urls = [match.group(2) for match in build_assets.URL_PATTERN.finditer(css)]
+    assert '/static/' + manifest['images/garden-banner2.JPG'] in urls
+    for url in urls:
+        assert re.match(r'/static/dist/.+\.[0-9a-f]{12}\.\w+$', url)
+        assert os.path.isfile(str(static_dir.joinpath(url[len('/static/'):])))
+
+
+def test_css_hash_follows_the_images_it_uses(static_dir):
+    first = build_assets.build()['styles.css']
+    with open(str(static_dir.joinpath('images', 'garden-banner2.JPG')),
+            'ab') as f:
+        f.write(b'changed')
+    assert build_assets.build()['styles.css'] != first
+
+
+def test_rewrite_urls():
+    manifest = {'images/a.png': 'dist/images/a.123.png',
+        'css/b.png': 'dist/css/b.456.png'}
+    css = (b'a { background: url(/static/images/a.png); }\n'
+        b'b { background: url("b.png?v=1"); }\n'
+        b"c { background: url('../images/a.png#top'); }\n"
+        b'd { background: url(data:image/png;base64,AAAA); }\n'
+        b'e { background: url(https://example.com/a.png); }\n'
+        b'f { background: url(missing.png); }\n')
+    assert build_assets.rewriteUrls('css/site.css', css, manifest) == (
+        b'a { background: url(/static/dist/images/a.123.png); }\n'
+        b'b { background: url("/static/dist/css/b.456.png?v=1"); }\n'
+        b"c { background: url('/static/dist/images/a.123.png#top'); }\n"
+        b'd { background: url(data:image/png;base64,AAAA); }\n'
+        b'e { background: url(https://example.com/a.png); }\n'
+        b'f { background: url(missing.png); }\n')
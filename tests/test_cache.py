@@ -0,0 +1,46 @@
+""" Tests for the in-process read caches """
+from sqlalchemy.orm import Session
+
+import application
+from cache import LRUCache
+from database_setup import PlantCategory, PlantItem, User, createEngine
+from response_cache import catalog_version
+
+
+def test_lookup_that_found_nothing_is_not_cached():
+    cache = LRUCache()
+    loads = []
+    def load():
+        loads.append(1)
+        return None
+    assert cache.getOrLoad('missing', load) is None
+    assert cache.getOrLoad('missing', load) is None
+    assert len(loads) == 2
+    assert len(cache) == 0
+
+
+def test_entry_for_another_version_is_reloaded():
+    cache = LRUCache()
+    assert cache.getOrLoad('key', lambda: 'old', 1) == 'old'
+    assert cache.getOrLoad('key', lambda: 'new', 1) == 'old'
+    assert cache.getOrLoad('key', lambda: 'new', 2) == 'new'
+
+
+def test_plant_created_by_another_process_is_found(app, database_url,
+        monkeypatch):
+    monkeypatch.setattr(catalog_version, 'check_interval', 0)
+    with app.test_request_context():
+        assert application.getCategoryPlant('Annuals', 'Zinnia') is None
+    engine = createEngine(database_url)
+    session = Session(bind=engine)
+    session.add(PlantItem(name='Zinnia', botanical_name='', description='',
+        image='', category=session.query(PlantCategory).filter_by(
+            name='Annuals').one(),
+        user=session.query(User).filter_by(name='alice').one()))
+    session.commit()
+    session.close()
+    engine.dispose()
+    with app.test_request_context():
+        plant = application.getCategoryPlant('Annuals', 'Zinnia')
+        assert plant is not None
+        assert plant.category.name == 'Annuals'
@@ -0,0 +1,55 @@
+""" Tests for the bulk import in "catalog_io.py" """
+import pytest
+
+from catalog_io import importPlants
+from database_setup import createEngine
+
+
+@pytest.fixture
+def engine(database_url):
+    engine = createEngine(database_url)
+    yield engine
+    engine.dispose()
+
+
+def test_import_refuses_bad_records(engine, client):
+    records = [
+        {'name': 'Zinnia', 'category': 'Annuals'},
+        {'name': 'No category'},
+        {'name': 'Empty category', 'category': ''},
+        {'name': 'Listed category', 'category': ['Annuals']},
+        {'name': 42, 'category': 'Annuals'},
+        {'name': 'Nested', 'description': {'text': 'no'},
+            'category': 'Annuals'},
+        {'name': 'x' * 81, 'category': 'Annuals'},
+        ['not', 'a', 'record'],
+        {'name': 'Fern', 'category': 'Ferns'},
+    ]
+    imported, skipped, errors = importPlants(engine, records,
+        owner='alice@example.com', batch_size=4)
+    assert (imported, skipped) == (2, 7)
+    assert errors == [
+        (2, 'A new plant needs a category'),
+        (3, 'A new plant needs a category'),
+        (4, 'category must be a string'),
+        (5, 'name must be a string'),
+        (6, 'description must be a string'),
+        (7, 'name is longer than 80 characters'),
+        (8, 'Each plant must be a JSON object'),
+    ]
+    # Every imported plant has a category, so the feed and search can
+    # serialize them
+    response = client.get('/catalog/changes/?since=0')
+    assert response.status_code == 200
+    names = [change['plant']['name'] for change in response.json['changes']]
+    assert 'Zinnia' in names and 'Fern' in names
+    assert client.get('/catalog/search/JSON/?q=Fern').status_code == 200
+    assert client.get('/catalog/Ferns/JSON/').json['Plants'][0]['name'] == \
+        'Fern'
+
+
+def test_import_skips_taken_names(engine):
+    imported, skipped, errors = importPlants(engine,
+        [{'name': 'Cosmos', 'category': 'Annuals'}],
+        owner='alice@example.com')
+    assert (imported, skipped, errors) == (0, 1, [])
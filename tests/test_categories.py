@@ -0,0 +1,109 @@
+""" Tests of the category pages and the plant counts kept with each
+category
+"""
+import re
+
+from sqlalchemy import select
+
+import application
+from conftest import login
+from database_setup import PlantCategory, PlantItem, refreshPlantCounts
+
+category_table = PlantCategory.__table__
+EDIT = {'name': '', 'botanical_name': '', 'image': '', 'description': '',
+    'category': ''}
+
+
+def plantCounts():
+    """ Return the plant_count of each category by name, as stored """
+    with application.getEngine().connect() as connection:
+        return dict(connection.execute(select([category_table.c.name,
+            category_table.c.plant_count])).fetchall())
+
+
+def addPlants(count, category_id=1):
+    """ Add count plants named Plant 0, Plant 1, ... to the category """
+    engine = application.getEngine()
+    engine.execute(PlantItem.__table__.insert(), [{'name': 'Plant %d' % i,
+        'botanical_name': '', 'description': '', 'image': '',
+        'category_id': category_id, 'user_id': 1} for i in range(count)])
+    with engine.begin() as connection:
+        refreshPlantCounts(connection)
+
+
+def pagePlants(response):
+    return re.findall(r'class="plant-name"> ([^<]+?) </h4>',
+        response.get_data(as_text=True))
+
+
+def test_edit_moving_plant_moves_its_count(client):
+    assert plantCounts() == {'Annuals': 2, 'Trees': 1}
+    login(client, 'alice@example.com')
+    response = client.post('/catalog/Cosmos/edit/',
+        data=dict(EDIT, category='Trees'))
+    assert response.status_code == 302
+    assert plantCounts() == {'Annuals': 1, 'Trees': 2}
+    # An edit that keeps the category leaves the counts alone
+    client.post('/catalog/Cosmos/edit/', data=dict(EDIT, category='Trees',
+        description='Moved'))
+    assert plantCounts() == {'Annuals': 1, 'Trees': 2}
+    assert b'2 plants' in client.get('/catalog/Trees/').data
+    assert b'1 plant<' in client.get('/catalog/Annuals/').data
+
+
+def test_counts_follow_new_deleted_and_batch_plants(client):
+    login(client, 'alice@example.com')
+    client.post('/catalog/newplant/', data={'name': 'Zinnia',
+        'botanical_name': '', 'image': '', 'description': '',
+        'category': 'Annuals'})
+    assert plantCounts() == {'Annuals': 3, 'Trees': 1}
+    client.post('/catalog/Marigold/delete/')
+    assert plantCounts() == {'Annuals': 2, 'Trees': 1}
+    response = client.post('/catalog/JSON/batch/', json=[
+        {'name': 'Zinnia', 'category': 'Trees'},
+        {'name': 'Birch', 'category': 'Trees'}])
+    assert [result['status'] for result in response.get_json()['results']] \
+        == ['updated', 'created']
+    assert plantCounts() == {'Annuals': 1, 'Trees': 3}
+
+
+def test_category_pages_follow_the_keyset(client):
+    addPlants(application.CATEGORY_PAGE_SIZE + 5)
+    first = client.get('/catalog/Annuals/')
+    names = pagePlants(first)
+    assert len(names) == application.CATEGORY_PAGE_SIZE
+    assert names[:3] == ['Cosmos', 'Marigold', 'Plant 0']
+    assert b'class="previous"' not in first.data
+    next_url = re.search(r'class="next"><a href = "([^"]+)"',
+        first.get_data(as_text=True)).group(1).replace('&amp;', '&')
+    second = client.get(next_url)
+    assert pagePlants(second) == ['Plant %d' % i for i in range(22, 29)]
+    assert b'class="next"' not in second.data
+    previous_url = re.search(r'class="previous"><a href = "([^"]+)"',
+        second.get_data(as_text=True)).group(1).replace('&amp;', '&')
+    assert pagePlants(client.get(previous_url)) == names
+    assert b'31 plants' in first.data
+
+
+def test_category_page_query(app):
+    addPlants(5)
+    with app.test_request_context():
+        annuals = application.db_session.query(PlantCategory).filter_by(
+            name='Annuals').one()
+        plants, previous, more = application.getCategoryPage(annuals,
+            page_size=3)
+        assert [plant.id for plant in plants] == [1, 2, 4]
+        assert (previous, more) == (False, True)
+        plants, previous, more = application.getCategoryPage(annuals,
+            after=4, page_size=3)
+        assert [plant.id for plant in plants] == [5, 6, 7]
+        assert (previous, more) == (True, True)
+        plants, previous, more = application.getCategoryPage(annuals,
+            after=7, page_size=3)
+        assert [plant.id for plant in plants] == [8]
+        assert (previous, more) == (True, False)
+        plants, previous, more = application.getCategoryPage(annuals,
+            before=5, page_size=3)
+        assert [plant.id for plant in plants] == [1, 2, 4]
+        assert (previous, more) == (False, True)
+        application.db_session.remove()
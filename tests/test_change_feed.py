@@ -0,0 +1,63 @@
+""" Tests of the change feed's writes, which must take the catalog_state
+row lock before any plant_change row gets its version
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from conftest import MAINTENANCE_TOKEN, login
+
+NEW_PLANT = {'name': 'Zinnia', 'botanical_name': 'Zinnia elegans',
+    'image': '', 'description': 'Bright flowers', 'category': 'Annuals'}
+
+
+@pytest.fixture
+def statements():
+    """ The SQL statements executed, in order """
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(' '.join(statement.split()).upper())
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(Engine, 'before_cursor_execute', record)
+
+
+def assertVersionLockedFirst(statements):
+    """ Check that the catalog version was updated before any change was
+    recorded
+    """
+    bumps = [index for index, statement in enumerate(statements)
+        if statement.startswith('UPDATE CATALOG_STATE')]
+    changes = [index for index, statement in enumerate(statements)
+        if statement.startswith('INSERT INTO PLANT_CHANGE')]
+    assert bumps and changes
+    assert bumps[0] < changes[0]
+
+
+def test_plant_writes_lock_version_first(client, statements):
+    login(client, 'alice@example.com')
+    client.post('/catalog/newplant/', data=NEW_PLANT)
+    assertVersionLockedFirst(statements)
+    del statements[:]
+    client.post('/catalog/Cosmos/delete/')
+    assertVersionLockedFirst(statements)
+
+
+def test_maintenance_locks_version_first(client, statements):
+    response = client.post('/catalog/maintenance/delete-category/',
+        json={'category': 'Annuals'},
+        headers={'Authorization': 'Bearer ' + MAINTENANCE_TOKEN})
+    assert response.status_code == 200
+    assertVersionLockedFirst(statements)
+
+
+def test_feed_returns_changes_in_version_order(client):
+    login(client, 'alice@example.com')
+    client.post('/catalog/newplant/', data=NEW_PLANT)
+    client.post('/catalog/Cosmos/delete/')
+    changes = client.get('/catalog/changes/?since=0').get_json()['changes']
+    versions = [change['version'] for change in changes]
+    assert versions == sorted(versions)
+    assert [(change['id'], change['deleted']) for change in changes][-2:] \
+        == [(4, False), (1, True)]
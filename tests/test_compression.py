@@ -0,0 +1,88 @@
+""" Tests of the response compression negotiated from Accept-Encoding """
+import gzip
+import json
+
+import pytest
+
+from response_cache import response_cache
+
+# Modules that the optional encodings need
+OPTIONAL_MODULES = {'br': 'brotli', 'zstd': 'zstandard'}
+
+
+def decompress(response):
+    """ Decode the body of a response in its Content-Encoding """
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(response.data)
+    if encoding == 'br':
+        return pytest.importorskip('brotli').decompress(response.data)
+    if encoding == 'zstd':
+        zstandard = pytest.importorskip('zstandard')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(
+            response.data)
+    assert encoding is None
+    return response.data
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'br', 'zstd'])
+def test_streamed_catalog_is_compressed(client, encoding):
+    if encoding in OPTIONAL_MODULES:
+        pytest.importorskip(OPTIONAL_MODULES[encoding])
+    response = client.get('/catalog/JSON/',
+        headers={'Accept-Encoding': encoding})
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Content-Length' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].startswith('W/')
+    plants = json.loads(decompress(response).decode('utf-8'))['Plants']
+    assert [plant['name'] for plant in plants] == ['Cosmos', 'Marigold',
+        'Oak']
+
+
+def test_streamed_ndjson_is_compressed(client):
+    response = client.get('/catalog/JSON/?format=ndjson',
+        headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(decompress(response).splitlines()) == 3
+
+
+def test_best_accepted_encoding_is_chosen(client):
+    pytest.importorskip('zstandard')
+    pytest.importorskip('brotli')
+    headers = {'Accept-Encoding': 'gzip, br, zstd'}
+    response = client.get('/catalog/JSON/', headers=headers)
+    assert response.headers['Content-Encoding'] == 'zstd'
+    headers = {'Accept-Encoding': 'gzip, br;q=0.5, zstd;q=0'}
+    response = client.get('/catalog/JSON/', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+
+def test_uncompressed_without_accepted_encoding(client):
+    for headers in ({}, {'Accept-Encoding': 'identity'},
+            {'Accept-Encoding': 'gzip;q=0'}):
+        response = client.get('/catalog/JSON/', headers=headers)
+        assert 'Content-Encoding' not in response.headers
+        assert json.loads(response.get_data(as_text=True))['Plants']
+
+
+def test_cached_page_is_compressed_once_per_encoding(client):
+    response = client.get('/catalog/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert b'Annuals' in decompress(response)
+    entry = response_cache.get('/catalog/?')
+    assert list(entry.encoded) == ['gzip']
+    # The cached entry keeps the uncompressed body for other clients
+    response = client.get('/catalog/')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == entry.body
+
+
+def test_small_responses_and_head_are_not_compressed(client):
+    headers = {'Accept-Encoding': 'gzip'}
+    response = client.get('/catalog/Annuals/Cosmos/JSON/', headers=headers)
+    assert len(response.data) < 1024
+    assert 'Content-Encoding' not in response.headers
+    response = client.head('/catalog/', headers=headers)
+    assert 'Content-Encoding' not in response.headers
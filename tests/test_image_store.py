@@ -0,0 +1,79 @@
+""" Tests for the image store's variants """
+import json
+from io import BytesIO
+
+import pytest
+
+import image_store
+from config import WatchedJSONFile
+
+Image = pytest.importorskip('PIL.Image')
+
+
+class InlinePool(object):
+    """ Stands in for the worker pool, running each task right away """
+    def apply_async(self, function, args):
+        function(*args)
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, 'UPLOAD_DIR', str(tmp_path))
+    monkeypatch.setattr(image_store, 'getPool', InlinePool)
+    image_store.variant_cache.clear()
+    return tmp_path
+
+
+def imageFile(width, height, image_format):
+    data = BytesIO()
+    Image.new('RGB', (width, height), (200, 80, 120)).save(data,
+        image_format)
+    data.seek(0)
+    return data
+
+
+def test_upload_variants_are_listed_without_hashing(upload_dir,
+        monkeypatch):
+    url = image_store.storeUpload(imageFile(500, 250, 'JPEG'))
+    def noHashing(url, path):
+        raise AssertionError('Hashed %s while rendering' % url)
+    monkeypatch.setattr(image_store, 'contentHash', noHashing)
+    digest = url.rsplit('/', 1)[-1].split('.')[0]
+    assert image_store.getVariants(url) == [
+        (160, 'webp', image_store.variantUrl(digest, 160, 'webp')),
+        (160, 'jpg', image_store.variantUrl(digest, 160, 'jpg')),
+        (320, 'webp', image_store.variantUrl(digest, 320, 'webp')),
+        (320, 'jpg', image_store.variantUrl(digest, 320, 'jpg'))]
+    for width, extension, variant_url in image_store.getVariants(url):
+        path = upload_dir.joinpath(
+            variant_url[len(image_store.UPLOAD_URL_PATH):])
+        assert Image.open(str(path)).size[0] == width
+    assert image_store.thumbnail(url, 200) == \
+        image_store.variantUrl(digest, 320, 'jpg')
+    assert image_store.thumbnail(url, 400) == url
+
+
+def test_upload_without_variants_yet(upload_dir):
+    url = image_store.UPLOAD_URL_PATH + 'ab/' + 'ab' * 32 + '.jpg'
+    assert image_store.findVariants(url) == []
+
+
+def test_upload_url_must_name_a_digest(upload_dir):
+    assert image_store.findVariants(
+        image_store.UPLOAD_URL_PATH + '../../config.py') == []
+
+
+def test_static_image_variants_come_from_manifest(tmp_path, monkeypatch):
+    manifest = tmp_path.joinpath('variants.json')
+    manifest.write_text(json.dumps({'/static/images/fern.jpg': [
+        [160, 'webp', '/static/uploads/aa/aa-w160.webp'],
+        [160, 'jpg', '/static/uploads/aa/aa-w160.jpg']]}))
+    monkeypatch.setattr(image_store, 'static_variants',
+        WatchedJSONFile(str(manifest)))
+    assert image_store.findVariants('/static/images/fern.jpg') == [
+        (160, 'webp', '/static/uploads/aa/aa-w160.webp'),
+        (160, 'jpg', '/static/uploads/aa/aa-w160.jpg')]
+    assert image_store.srcset('/static/images/fern.jpg', 'webp') == \
+        '/static/uploads/aa/aa-w160.webp 160w'
+    assert image_store.findVariants('/static/images/other.jpg') == []
+    assert image_store.findVariants('https://example.com/fern.jpg') == []
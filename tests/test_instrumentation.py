@@ -0,0 +1,48 @@
+""" Tests of the /metrics endpoint served by "instrumentation.py" """
+import pytest
+
+from application import create_app
+
+
+@pytest.fixture
+def instrumented(database_url, monkeypatch):
+    monkeypatch.setenv('CATALOG_INSTRUMENTATION', 'true')
+
+    def createClient(profile_token=None):
+        if profile_token is None:
+            monkeypatch.delenv('CATALOG_PROFILE_TOKEN', raising=False)
+        else:
+            monkeypatch.setenv('CATALOG_PROFILE_TOKEN', profile_token)
+        return create_app({'TESTING': True}).test_client()
+    return createClient
+
+
+def test_metrics_not_served_without_profile_token(instrumented):
+    client = instrumented()
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={
+        'Authorization': 'Bearer None'}).status_code == 404
+
+
+def test_metrics_need_profile_token(instrumented):
+    client = instrumented('secret')
+    client.get('/catalog/')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={
+        'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={
+        'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert b'showCategories' in response.data
+
+
+def test_profiling_needs_profile_token(instrumented):
+    client = instrumented('secret')
+    response = client.get('/catalog/', headers={'X-Profile': 'wrong'})
+    assert response.mimetype == 'text/html'
+    response = client.get('/catalog/', headers={'X-Profile': 'secret'})
+    assert response.mimetype == 'text/plain'
+    assert response.headers['Cache-Control'] == 'no-store'
+    response = client.get('/metrics', headers={
+        'Authorization': u'Bearer secr\xe9t'})
+    assert response.status_code == 401
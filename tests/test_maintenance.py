@@ -0,0 +1,109 @@
+""" Tests of the bulk maintenance operations and their API """
+import pytest
+from sqlalchemy import select
+
+import application
+import maintenance
+from conftest import MAINTENANCE_TOKEN
+from database_setup import PlantCategory, PlantChange, PlantItem, User
+
+HEADERS = {'Authorization': 'Bearer ' + MAINTENANCE_TOKEN}
+
+
+def rows(*columns):
+    """ Return the rows of the given columns, in order """
+    with application.getEngine().connect() as connection:
+        return [tuple(row) for row in connection.execute(
+            select(list(columns)).order_by(*columns))]
+
+
+def feed(client):
+    return [(change['id'], change['deleted']) for change in
+        client.get('/catalog/changes/?since=0').get_json()['changes']]
+
+
+def test_delete_category(client):
+    assert b'Cosmos' in client.get('/catalog/Annuals/JSON/').data
+    response = client.post('/catalog/maintenance/delete-category/',
+        json={'category': 'Annuals'}, headers=HEADERS)
+    assert response.get_json() == {'plants': 2}
+    assert rows(PlantCategory.name) == [('Trees',)]
+    assert rows(PlantItem.name) == [('Oak',)]
+    assert feed(client)[-2:] == [(1, True), (2, True)]
+    # The cached pages and lookups are retired
+    assert client.get('/catalog/Annuals/JSON/').status_code == 302
+    assert client.get('/catalog/Annuals/Cosmos/').status_code == 302
+
+
+def test_reassign_plants(client):
+    response = client.post('/catalog/maintenance/reassign/',
+        json={'from': 'alice@example.com', 'to': 'bob@example.com'},
+        headers=HEADERS)
+    assert response.get_json() == {'plants': 2}
+    assert rows(PlantItem.name, PlantItem.user_id) == [('Cosmos', 2),
+        ('Marigold', 2), ('Oak', 2)]
+    assert feed(client)[-2:] == [(1, False), (2, False)]
+    response = client.post('/catalog/maintenance/reassign/',
+        json={'from': 'bob@example.com', 'to': 'bob@example.com'},
+        headers=HEADERS)
+    assert response.get_json() == {'plants': 0}
+
+
+def test_purge_keeps_categories_and_users(client):
+    response = client.post('/catalog/maintenance/purge/', json={},
+        headers=HEADERS)
+    assert response.get_json() == {'plants': 3}
+    assert rows(PlantItem.name) == []
+    assert rows(PlantCategory.name, PlantCategory.plant_count) == [
+        ('Annuals', 0), ('Trees', 0)]
+    assert len(rows(User.id)) == 2
+    assert sorted(feed(client)) == [(1, True), (2, True), (3, True)]
+
+
+def test_purge_everything(client):
+    response = client.post('/catalog/maintenance/purge/',
+        json={'categories': True, 'users': True}, headers=HEADERS)
+    assert response.get_json() == {'plants': 3}
+    assert rows(PlantCategory.name) == []
+    assert rows(User.id) == []
+
+
+@pytest.mark.parametrize('url, data, message', [
+    ('/catalog/maintenance/delete-category/', {'category': 'Shrubs'},
+        'No category with name Shrubs'),
+    ('/catalog/maintenance/reassign/', {'from': 'alice@example.com',
+        'to': 'nobody@example.com'}, 'No user with email nobody@example.com'),
+])
+def test_missing_names_are_404(client, url, data, message):
+    response = client.post(url, json=data, headers=HEADERS)
+    assert response.status_code == 404
+    assert response.get_json() == message
+    # Nothing was changed or recorded
+    assert len(rows(PlantItem.id)) == 3
+    assert rows(PlantChange.version) == [(1,), (2,), (3,)]
+
+
+@pytest.mark.parametrize('headers', [{}, {'Authorization': 'Bearer wrong'},
+    {'Authorization': MAINTENANCE_TOKEN},
+    {'Authorization': u'Bearer \xe9' + MAINTENANCE_TOKEN}])
+def test_maintenance_needs_token(client, headers):
+    response = client.post('/catalog/maintenance/purge/', json={},
+        headers=headers)
+    assert response.status_code == 401
+    assert len(rows(PlantItem.id)) == 3
+
+
+def test_maintenance_off_without_token_setting(client, monkeypatch):
+    monkeypatch.delenv('CATALOG_MAINTENANCE_TOKEN')
+    response = client.post('/catalog/maintenance/purge/', json={},
+        headers={'Authorization': 'Bearer None'})
+    assert response.status_code == 401
+
+
+def test_command_line(database_url, capsys):
+    assert maintenance.main(['--database', database_url, 'reassign',
+        'alice@example.com', 'bob@example.com']) == 0
+    assert 'Reassigned 2 plants' in capsys.readouterr().err
+    assert maintenance.main(['--database', database_url, 'delete-category',
+        'Shrubs']) == 1
+    assert 'No category with name Shrubs' in capsys.readouterr().err
@@ -0,0 +1,155 @@
+""" Tests for logging in and out through Google, with the stub OAuth
+server of "benchmarks/oauth_stub.py" standing in for Google
+"""
+import socket
+
+import pytest
+
+import application
+from conftest import oauth_stub
+from database_setup import User
+from oauth_client import tokeninfo_cache
+
+STUB_URL = 'http://127.0.0.1:%d' % oauth_stub.server_address[1]
+
+
+@pytest.fixture
+def closed_url():
+    """ URL of a local port that nothing listens on """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:%d/' % listener.getsockname()[1]
+    listener.close()
+    return url
+
+
+def connect(client, code):
+    """ Log in through the login page with the given authorization code,
+    which names the stub's user
+    """
+    client.get('/login')
+    with client.session_transaction() as session:
+        state = session['state']
+    return client.post('/gconnect?state=%s' % state, data=code)
+
+
+def sessionData(client):
+    with client.session_transaction() as session:
+        return dict(session)
+
+
+def test_connect_creates_user(client):
+    response = connect(client, b'carol')
+    assert response.status_code == 200
+    assert b'Welcome, carol!' in response.data
+    session = sessionData(client)
+    assert session['credentials'] == 'stub-token-carol'
+    assert session['gplus_id'] == 'carol'
+    assert session['email'] == 'carol@example.com'
+    user = application.db_session.query(User).filter_by(
+        email='carol@example.com').one()
+    assert session['user_id'] == user.id
+    application.db_session.remove()
+
+
+def test_connect_existing_user(client):
+    response = connect(client, b'alice')
+    assert response.status_code == 200
+    assert sessionData(client)['user_id'] == 1
+
+
+def test_connect_again_uses_cached_token_check(client):
+    connect(client, b'alice')
+    hits = tokeninfo_cache.hits
+    response = connect(client, b'alice')
+    assert response.status_code == 200
+    assert response.json == 'Current user is already connected.'
+    assert tokeninfo_cache.hits == hits + 1
+
+
+def test_connect_with_invalid_state(client):
+    client.get('/login')
+    response = client.post('/gconnect?state=forged', data=b'alice')
+    assert response.status_code == 401
+    assert 'credentials' not in sessionData(client)
+
+
+def test_connect_with_refused_code(client):
+    # The stub refuses an empty code
+    response = connect(client, b'')
+    assert response.status_code == 401
+    assert response.json == 'Failed to upgrade the authorization code.'
+
+
+def test_connect_with_invalid_token(client, monkeypatch):
+    monkeypatch.setenv('CATALOG_GOOGLE_TOKENINFO_URL',
+        STUB_URL + '/no-such-endpoint')
+    response = connect(client, b'alice')
+    assert response.status_code == 500
+    assert 'credentials' not in sessionData(client)
+
+
+def test_connect_with_token_of_another_user(client, monkeypatch):
+    getTokenInfo = application.getTokenInfo
+    monkeypatch.setattr(application, 'getTokenInfo', lambda token: dict(
+        getTokenInfo(token), user_id='mallory'))
+    response = connect(client, b'alice')
+    assert response.status_code == 401
+    assert response.json == "Token user ID doesn't match given user ID"
+
+
+def test_connect_with_token_of_another_client(client, monkeypatch):
+    monkeypatch.setattr(application, 'getClientId', lambda: 'other-client')
+    response = connect(client, b'alice')
+    assert response.status_code == 401
+    assert response.json == "Token client ID doesn't match the app's."
+
+
+def test_connect_when_token_check_unavailable(client, monkeypatch,
+        closed_url):
+    monkeypatch.setenv('CATALOG_GOOGLE_TOKENINFO_URL', closed_url)
+    response = connect(client, b'alice')
+    assert response.status_code == 503
+    assert 'credentials' not in sessionData(client)
+
+
+def test_connect_when_profile_unavailable(client, monkeypatch, closed_url):
+    monkeypatch.setenv('CATALOG_GOOGLE_USERINFO_URL', closed_url)
+    response = connect(client, b'alice')
+    assert response.status_code == 503
+    session = sessionData(client)
+    assert 'credentials' not in session
+    assert 'user_id' not in session
+
+
+def test_disconnect(client):
+    connect(client, b'alice')
+    response = client.get('/disconnect')
+    assert response.status_code == 302
+    session = sessionData(client)
+    for key in ('credentials', 'gplus_id', 'username', 'email', 'user_id'):
+        assert key not in session
+
+
+def test_disconnect_when_not_connected(client):
+    response = client.get('/disconnect')
+    assert response.status_code == 401
+    assert response.json == 'Current user is not connected.'
+
+
+def test_disconnect_when_revoke_refused(client, monkeypatch):
+    connect(client, b'alice')
+    monkeypatch.setenv('CATALOG_GOOGLE_REVOKE_URL',
+        STUB_URL + '/no-such-endpoint')
+    response = client.get('/disconnect')
+    assert response.status_code == 400
+    assert sessionData(client)['user_id'] == 1
+
+
+def test_disconnect_when_revoke_unavailable(client, monkeypatch,
+        closed_url):
+    connect(client, b'alice')
+    monkeypatch.setenv('CATALOG_GOOGLE_REVOKE_URL', closed_url)
+    response = client.get('/disconnect')
+    assert response.status_code == 503
+    assert sessionData(client)['user_id'] == 1
@@ -0,0 +1,107 @@
+""" Tests that every page with a @queryBudget stays within it """
+import pytest
+
+import application
+from conftest import MAINTENANCE_TOKEN, login
+
+MAINTENANCE_HEADERS = {'Authorization': 'Bearer ' + MAINTENANCE_TOKEN}
+NEW_PLANT = {'name': 'Zinnia', 'botanical_name': 'Zinnia elegans',
+    'image': '', 'description': 'Bright flowers', 'category': 'Annuals'}
+EDITED_PLANT = {'name': 'Cosmos Sensation', 'botanical_name': '',
+    'image': '', 'description': 'Taller', 'category': 'Trees'}
+
+# (endpoint, method, URL, keyword arguments for the request, user to log
+# in as, where a successful request redirects to)
+BUDGET_REQUESTS = [
+    ('changesJSON', 'GET', '/catalog/changes/', {}, None, None),
+    ('changesJSON', 'GET', '/catalog/changes/?since=0', {}, None, None),
+    ('categoryJSON', 'GET', '/catalog/Annuals/JSON/', {}, None, None),
+    ('plantJSON', 'GET', '/catalog/Annuals/Cosmos/JSON/', {}, None, None),
+    ('searchJSON', 'GET', '/catalog/search/JSON/?q=flowers', {}, None, None),
+    ('showCategories', 'GET', '/catalog/', {}, None, None),
+    ('showCategory', 'GET', '/catalog/Annuals/', {}, None, None),
+    ('showCategory', 'GET', '/catalog/Annuals/?after=1', {}, None, None),
+    ('showCategory', 'GET', '/catalog/Annuals/?before=2', {}, None, None),
+    ('showPlantItem', 'GET', '/catalog/Annuals/Cosmos/', {}, None, None),
+    ('showSearch', 'GET', '/catalog/search/?q=flow', {}, None, None),
+    ('newPlant', 'GET', '/catalog/newplant/', {}, 'alice@example.com',
+        None),
+    ('newPlant', 'POST', '/catalog/newplant/', {'data': NEW_PLANT},
+        'alice@example.com', '/catalog/Annuals/Zinnia/'),
+    ('editPlant', 'GET', '/catalog/Cosmos/edit/', {}, 'alice@example.com',
+        None),
+    ('editPlant', 'POST', '/catalog/Cosmos/edit/', {'data': EDITED_PLANT},
+        'alice@example.com', '/catalog/Trees/Cosmos%20Sensation/'),
+    ('deletePlant', 'GET', '/catalog/Cosmos/delete/', {},
+        'alice@example.com', None),
+    ('deletePlant', 'POST', '/catalog/Cosmos/delete/', {},
+        'alice@example.com', '/catalog/'),
+    ('deleteCategoryJSON', 'POST', '/catalog/maintenance/delete-category/',
+        {'json': {'category': 'Annuals'}, 'headers': MAINTENANCE_HEADERS},
+        None, None),
+    ('reassignPlantsJSON', 'POST', '/catalog/maintenance/reassign/',
+        {'json': {'from': 'alice@example.com', 'to': 'bob@example.com'},
+            'headers': MAINTENANCE_HEADERS}, None, None),
+    ('purgeCatalogJSON', 'POST', '/catalog/maintenance/purge/',
+        {'json': {'categories': True, 'users': True},
+            'headers': MAINTENANCE_HEADERS}, None, None),
+]
+
+
+def budgetedEndpoints(app):
+    """ Return the endpoints of the views that have a query budget """
+    return set(endpoint.split('.')[-1]
+        for endpoint, view in app.view_functions.items()
+        if getattr(view, 'query_budget', None) is not None)
+
+
+def test_every_budgeted_page_is_checked(app):
+    checked = set(request[0] for request in BUDGET_REQUESTS)
+    assert budgetedEndpoints(app) == checked
+
+
+@pytest.mark.parametrize('endpoint, method, url, kwargs, user, location',
+    BUDGET_REQUESTS, ids=['%s %s' % (request[1], request[2])
+        for request in BUDGET_REQUESTS])
+def test_page_within_budget(app, client, endpoint, method, url, kwargs,
+        user, location):
+    if user is not None:
+        login(client, user)
+    response = client.open(url, method=method, **kwargs)
+    if location is None:
+        assert response.status_code == 200
+    else:
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(location)
+    assert request_endpoint(app, url, method) == endpoint
+    budget = app.view_functions['catalog.' + endpoint].query_budget
+    assert 0 < int(response.headers['X-Query-Count']) <= budget
+
+
+def request_endpoint(app, url, method):
+    """ Return the endpoint, without its blueprint, that url is routed to """
+    adapter = app.url_map.bind('localhost')
+    return adapter.match(url.split('?')[0], method=method)[0].split('.')[-1]
+
+
+def test_cached_page_issues_no_queries(client):
+    client.get('/catalog/Annuals/Cosmos/')
+    response = client.get('/catalog/Annuals/Cosmos/')
+    assert response.status_code == 200
+    assert response.headers['X-Query-Count'] == '0'
+
+
+def test_page_over_budget_fails(app, client, monkeypatch):
+    view = app.view_functions['catalog.showCategory']
+    monkeypatch.setattr(view, 'query_budget', 1)
+    with pytest.raises(application.QueryBudgetExceeded):
+        client.get('/catalog/Annuals/')
+
+
+def test_budget_only_checked_when_testing(app, client, monkeypatch):
+    view = app.view_functions['catalog.showCategory']
+    monkeypatch.setattr(view, 'query_budget', 1)
+    app.testing = False
+    response = client.get('/catalog/Annuals/')
+    assert response.status_code == 200
+    assert 'X-Query-Count' not in response.headers
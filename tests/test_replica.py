@@ -0,0 +1,69 @@
+""" Tests of the read routing between the primary and a replica, with a
+second SQLite file standing in for a replica that never catches up
+"""
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import application
+from conftest import fillCatalog, login
+from database_setup import PlantItem, createEngine
+
+NEW_PLANT = {'name': 'Zinnia', 'botanical_name': 'Zinnia elegans',
+    'image': '', 'description': 'Bright flowers', 'category': 'Annuals'}
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """ A copy of the catalog as the replica """
+    url = 'sqlite:///%s' % tmp_path.joinpath('replica.db')
+    engine = createEngine(url)
+    fillCatalog(engine)
+    engine.dispose()
+    monkeypatch.setenv('CATALOG_DATABASE_REPLICA_URL', url)
+    return url
+
+
+def test_read_only_pages_read_the_replica(replica, client):
+    login(client, 'alice@example.com')
+    client.post('/catalog/newplant/', data=NEW_PLANT)
+    assert client.get('/catalog/Annuals/Zinnia/').status_code == 200
+    # Other visitors read the replica, which doesn't have the plant
+    other = application.create_app({'TESTING': True}).test_client()
+    assert other.get('/catalog/Annuals/Zinnia/').status_code == 302
+    assert b'Zinnia' not in other.get('/catalog/Annuals/JSON/').data
+
+
+def test_reads_after_write_go_to_the_primary(replica, client):
+    login(client, 'alice@example.com')
+    response = client.post('/catalog/newplant/', data=NEW_PLANT)
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/catalog/Annuals/Zinnia/')
+    assert b'Zinnia elegans' in client.get('/catalog/Annuals/Zinnia/').data
+    assert b'Zinnia' in client.get('/catalog/Annuals/').data
+    assert b'Zinnia' in client.get('/catalog/').data
+    response = client.post('/catalog/Zinnia/edit/', data=dict(NEW_PLANT,
+        description='Edited flowers'))
+    assert response.status_code == 302
+    assert b'Edited flowers' in client.get('/catalog/Annuals/Zinnia/').data
+    client.post('/catalog/Cosmos/delete/')
+    assert client.get('/catalog/Annuals/Cosmos/').status_code == 302
+
+
+def test_reads_return_to_the_replica_after_the_window(replica, client,
+        monkeypatch):
+    monkeypatch.setenv('CATALOG_READ_PRIMARY_AFTER_WRITE', '0')
+    login(client, 'alice@example.com')
+    client.post('/catalog/newplant/', data=NEW_PLANT)
+    assert client.get('/catalog/Annuals/Zinnia/').status_code == 302
+    primary = createEngine(application.settings.get('DATABASE_URL'))
+    with primary.connect() as connection:
+        assert connection.execute(PlantItem.__table__.select().where(
+            PlantItem.name == 'Zinnia')).first() is not None
+    primary.dispose()
+
+
+def test_replica_refuses_writes(replica, app):
+    with application.getEngine('replica').connect() as connection:
+        with pytest.raises(OperationalError) as error:
+            connection.execute(PlantItem.__table__.delete())
+    assert 'readonly database' in str(error.value)
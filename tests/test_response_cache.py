@@ -0,0 +1,125 @@
+""" Tests that cached responses and 304s follow the catalog version kept
+in the database, which every process shares
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database_setup import PlantCategory, PlantItem, User, createEngine
+from response_cache import catalog_version, response_cache
+
+
+@pytest.fixture
+def other_process(database_url, monkeypatch):
+    """ A session on an engine of its own, writing to the catalog as
+    another server process would. The application reads the catalog
+    version on every request.
+    """
+    monkeypatch.setattr(catalog_version, 'check_interval', 0)
+    engine = createEngine(database_url)
+    session = Session(bind=engine)
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def test_repeat_client_gets_304(client):
+    response = client.get('/catalog/Annuals/Cosmos/')
+    etag = response.headers['ETag']
+    response = client.get('/catalog/Annuals/Cosmos/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.headers['X-Query-Count'] == '0'
+
+
+def test_write_in_other_process_retires_cached_responses(client,
+        other_process):
+    response = client.get('/catalog/Annuals/JSON/')
+    etag = response.headers['ETag']
+    assert b'Zinnia' not in response.data
+    other_process.add(PlantItem(name='Zinnia', botanical_name='',
+        description='', image='',
+        category=other_process.query(PlantCategory).filter_by(
+            name='Annuals').one(),
+        user=other_process.query(User).filter_by(name='alice').one()))
+    other_process.commit()
+    response = client.get('/catalog/Annuals/JSON/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'Zinnia' in response.data
+
+
+def test_deleted_page_is_not_answered_with_304(client, other_process):
+    etag = client.get('/catalog/Annuals/Cosmos/').headers['ETag']
+    other_process.delete(other_process.query(PlantItem).filter_by(
+        name='Cosmos').one())
+    other_process.commit()
+    response = client.get('/catalog/Annuals/Cosmos/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 302
+
+
+def test_missing_page_is_not_answered_with_304(client):
+    etag = client.get('/catalog/Annuals/Cosmos/').headers['ETag']
+    response = client.get('/catalog/Annuals/No such plant/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 302
+
+
+def test_version_read_at_most_every_interval(client, other_process,
+        monkeypatch):
+    monkeypatch.setattr(catalog_version, 'check_interval', 3600)
+    etag = client.get('/catalog/Annuals/Cosmos/').headers['ETag']
+    plant = other_process.query(PlantItem).filter_by(name='Cosmos').one()
+    plant.description = 'Changed elsewhere'
+    other_process.commit()
+    response = client.get('/catalog/Annuals/Cosmos/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    # A write by this process reads the version again right away
+    catalog_version.bump()
+    response = client.get('/catalog/Annuals/Cosmos/',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Changed elsewhere' in response.data
+
+
+@pytest.fixture
+def plant_reads():
+    """ The number of statements reading the plant_item table """
+    reads = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM plant_item' in statement:
+            reads.append(statement)
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield reads
+    event.remove(Engine, 'before_cursor_execute', record)
+
+
+def test_streamed_catalog_answers_304(client, plant_reads):
+    response = client.get('/catalog/JSON/')
+    etag = response.headers['ETag']
+    assert b'Cosmos' in response.data
+    assert plant_reads
+    del plant_reads[:]
+    response = client.get('/catalog/JSON/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert plant_reads == []
+    # Without the validator the catalog is streamed again
+    response = client.get('/catalog/JSON/')
+    assert response.status_code == 200
+    assert b'Cosmos' in response.data
+
+
+def test_streamed_catalog_answers_304_before_reading(client, plant_reads):
+    etag = client.get('/catalog/JSON/').headers['ETag']
+    response_cache.clear()
+    del plant_reads[:]
+    response = client.get('/catalog/JSON/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert plant_reads == []
@@ -0,0 +1,24 @@
+""" Tests that the catalog URLs reach the handlers meant for them """
+import pytest
+
+ROUTES = [
+    ('/catalog/', 'catalog.showCategories', {}),
+    ('/catalog/JSON/', 'catalog.allPlantsJSON', {}),
+    ('/catalog/search/JSON/', 'catalog.searchJSON', {}),
+    ('/catalog/Annuals/', 'catalog.showCategory',
+        {'category_name': 'Annuals'}),
+    ('/catalog/Annuals/JSON/', 'catalog.categoryJSON',
+        {'category_name': 'Annuals'}),
+    ('/catalog/Annuals/Cosmos/', 'catalog.showPlantItem',
+        {'category_name': 'Annuals', 'plant_name': 'Cosmos'}),
+    ('/catalog/Annuals/Cosmos/JSON/', 'catalog.plantJSON',
+        {'category_name': 'Annuals', 'plant_name': 'Cosmos'}),
+    ('/catalog/Cosmos/edit/', 'catalog.editPlant', {'plant_name': 'Cosmos'}),
+]
+
+
+@pytest.mark.parametrize('url, endpoint, values', ROUTES,
+    ids=[route[0] for route in ROUTES])
+def test_url_reaches_its_handler(app, url, endpoint, values):
+    adapter = app.url_map.bind('localhost')
+    assert adapter.match(url) == (endpoint, values)
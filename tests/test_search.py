@@ -0,0 +1,41 @@
+""" Tests for plant search """
+import pytest
+
+import application
+from database_setup import PlantItem
+
+
+@pytest.fixture
+def search(app, monkeypatch):
+    """ searchPlants as a function returning the names found, through the
+    substring scan used when there is no full-text index
+    """
+    monkeypatch.setattr(application, 'hasSearchIndex', lambda: False)
+    def searchNames(query_text):
+        with app.test_request_context():
+            return [plant.name
+                for plant in application.searchPlants(query_text)]
+    return searchNames
+
+
+def addPlant(name):
+    application.db_session.add(PlantItem(name=name, botanical_name='',
+        description='', image='', category_id=1, user_id=1))
+    application.db_session.commit()
+    application.db_session.remove()
+
+
+def test_escape_like():
+    assert application.escapeLike('50%_off\\') == '50\\%\\_off\\\\'
+
+
+def test_substring_search(search):
+    assert search('flow') == ['Cosmos', 'Marigold']
+    assert search('tall flow') == ['Cosmos']
+
+
+def test_underscore_only_matches_itself(search):
+    addPlant('Dusty_Miller')
+    addPlant('DustyXMiller')
+    assert search('Dusty_Miller') == ['Dusty_Miller']
+    assert search('T_ll') == []
@@ -0,0 +1,130 @@
+""" Tests of the server-side session stores and the session interface
+that keeps only the session ID in the cookie
+"""
+import time
+
+import pytest
+
+import application
+from conftest import resetApplication
+from session_store import FilesystemStore, MemoryStore, SQLiteStore, \
+    SecureCookieSessionInterface, SESSION_ID_PATTERN, createSessionInterface
+from test_oauth import connect
+
+LIFETIME = 1000
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'filesystem'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore(100)
+    if request.param == 'sqlite':
+        return SQLiteStore('sqlite:///%s' % tmp_path.joinpath('sessions.db'))
+    return FilesystemStore(str(tmp_path.joinpath('sessions')))
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'filesystem'])
+def store_client(request, database_url, tmp_path, monkeypatch):
+    """ A test client of an application keeping its sessions in each of
+    the stores
+    """
+    locations = {'memory': '100',
+        'sqlite': 'sqlite:///%s' % tmp_path.joinpath('sessions.db'),
+        'filesystem': str(tmp_path.joinpath('sessions'))}
+    monkeypatch.setenv('CATALOG_SESSION_STORE', request.param)
+    monkeypatch.setenv('CATALOG_SESSION_LOCATION', locations[request.param])
+    monkeypatch.setenv('CATALOG_SESSION_LIFETIME', str(LIFETIME))
+    resetApplication()
+    app = application.create_app({'TESTING': True})
+    yield app.test_client()
+    resetApplication()
+
+
+def sessionCookie(response):
+    """ Return the session cookie's value set by the response, '' if it
+    deletes the cookie, or None if it leaves the cookie alone
+    """
+    for header in response.headers.getlist('Set-Cookie'):
+        name, value = header.split(';')[0].split('=', 1)
+        if name == 'session':
+            return value
+    return None
+
+
+def test_store_round_trip(store):
+    expires = time.time() + 60
+    assert store.load('a' * 43) is None
+    store.save('a' * 43, {'user_id': 1}, expires)
+    data, loaded_expires = store.load('a' * 43)
+    assert data == {'user_id': 1}
+    assert loaded_expires == pytest.approx(expires)
+    store.save('a' * 43, {'user_id': 2}, expires)
+    assert store.load('a' * 43)[0] == {'user_id': 2}
+    store.delete('a' * 43)
+    assert store.load('a' * 43) is None
+    store.delete('a' * 43)
+
+
+def test_store_purges_expired_sessions(store):
+    store.save('a' * 43, {'user_id': 1}, time.time() - 1)
+    store.save('b' * 43, {'user_id': 2}, time.time() + 60)
+    assert store.load('a' * 43) is None
+    assert store.purgeExpired() == 1
+    assert store.purgeExpired() == 0
+    assert store.load('b' * 43)[0] == {'user_id': 2}
+
+
+def test_create_session_interface():
+    assert isinstance(createSessionInterface('cookie'),
+        SecureCookieSessionInterface)
+    assert isinstance(createSessionInterface('memory').store, MemoryStore)
+    with pytest.raises(ValueError):
+        createSessionInterface('redis')
+
+
+def test_anonymous_pages_set_no_cookie(store_client):
+    assert sessionCookie(store_client.get('/catalog/')) is None
+    assert sessionCookie(store_client.get('/static/styles.css')) is None
+
+
+def test_cookie_holds_only_the_session_id(store_client):
+    sid = sessionCookie(store_client.get('/login'))
+    assert SESSION_ID_PATTERN.match(sid)
+    store = store_client.application.session_interface.store
+    data, expires = store.load(sid)
+    assert len(data['state']) == 32
+    assert expires == pytest.approx(time.time() + LIFETIME, abs=5)
+    # Reading the session again doesn't save it or set the cookie
+    store_client.get('/catalog/')
+    assert store.load(sid)[1] == expires
+
+
+def test_login_moves_session_to_new_id(store_client):
+    first_sid = sessionCookie(store_client.get('/login'))
+    store = store_client.application.session_interface.store
+    response = connect(store_client, b'alice')
+    assert response.status_code == 200
+    sid = sessionCookie(response)
+    assert sid and sid != first_sid
+    assert store.load(first_sid) is None
+    assert store.load(sid)[0]['email'] == 'alice@example.com'
+    store_client.get('/disconnect')
+    assert 'email' not in store.load(sid)[0]
+
+
+def test_emptied_session_is_deleted(store_client):
+    sid = sessionCookie(store_client.get('/login'))
+    store = store_client.application.session_interface.store
+    with store_client.session_transaction() as session:
+        session.clear()
+    assert store.load(sid) is None
+
+
+def test_half_spent_session_is_saved_again(store_client):
+    sid = sessionCookie(store_client.get('/login'))
+    store = store_client.application.session_interface.store
+    data, expires = store.load(sid)
+    store.save(sid, data, time.time() + LIFETIME / 4)
+    store_client.get('/catalog/')
+    assert store.load(sid)[1] == pytest.approx(time.time() + LIFETIME,
+        abs=5)
@@ -0,0 +1,130 @@
+""" Tests of the static export, in full and incrementally from the change
+feed
+"""
+import json
+import os
+
+import pytest
+from sqlalchemy.orm import Session
+
+import application
+import static_export
+from database_setup import PlantCategory, PlantItem, createEngine
+from maintenance import deleteCategory
+from response_cache import catalog_version
+
+
+@pytest.fixture
+def catalog(database_url, monkeypatch):
+    """ A session writing to the catalog from outside the application,
+    whose pages see each write at once
+    """
+    monkeypatch.setattr(catalog_version, 'check_interval', 0)
+    engine = createEngine(database_url)
+    session = Session(bind=engine)
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def export(app, tmp_path):
+    """ Export function returning the number of pages rendered """
+    root = str(tmp_path.joinpath('public'))
+
+    def runExport(full=False):
+        rendered, written, failed = static_export.export(root, full,
+            processes=1)
+        assert failed == []
+        return rendered
+    runExport.root = root
+    return runExport
+
+
+def readPage(root, *parts):
+    with open(os.path.join(root, *parts), 'rb') as f:
+        return f.read()
+
+
+def test_full_export(export):
+    assert export() == 12
+    root = export.root
+    assert b'Annuals' in readPage(root, 'index.html')
+    assert readPage(root, 'index.html') == readPage(root, 'catalog',
+        'index.html')
+    assert b'Tall pink flowers' in readPage(root, 'catalog', 'Annuals',
+        'Cosmos', 'index.html')
+    plants = json.loads(readPage(root, 'catalog', 'Annuals', 'JSON',
+        'index.json'))['Plants']
+    assert [plant['name'] for plant in plants] == ['Cosmos', 'Marigold']
+    assert json.loads(readPage(root, 'catalog', 'Annuals', 'Cosmos', 'JSON',
+        'index.json'))['Plant']['id'] == 1
+    assert len(json.loads(readPage(root, 'catalog', 'JSON',
+        'index.json'))['Plants']) == 3
+    assert os.path.isfile(os.path.join(root, 'static', 'styles.css'))
+    state = json.loads(readPage(root, static_export.STATE_FILE))
+    assert state['version'] == 3
+    # Nothing changed, so nothing is rendered again
+    assert export() == 0
+
+
+def test_incremental_export_follows_the_change_feed(export, catalog):
+    export()
+    root = export.root
+    oak_page = os.path.join(root, 'catalog', 'Trees', 'Oak', 'index.html')
+    with open(oak_page, 'wb') as f:
+        f.write(b'untouched')
+    trees = catalog.query(PlantCategory).filter_by(name='Trees').one()
+    catalog.query(PlantItem).filter_by(name='Cosmos').one().category = trees
+    catalog.query(PlantItem).filter_by(name='Marigold').one().name = \
+        'Marigold Gem'
+    catalog.commit()
+    # The home page and catalog JSON, both categories' page and JSON, and
+    # the two plants' page and JSON
+    assert export() == 10
+    assert readPage(root, 'catalog', 'Trees', 'Oak', 'index.html') == \
+        b'untouched'
+    assert os.path.isfile(os.path.join(root, 'catalog', 'Trees', 'Cosmos',
+        'index.html'))
+    assert os.path.isfile(os.path.join(root, 'catalog', 'Annuals',
+        'Marigold Gem', 'JSON', 'index.json'))
+    for gone in (('Annuals', 'Cosmos'), ('Annuals', 'Marigold')):
+        assert not os.path.exists(os.path.join(root, 'catalog', *gone))
+    plants = json.loads(readPage(root, 'catalog', 'Trees', 'JSON',
+        'index.json'))['Plants']
+    assert [plant['name'] for plant in plants] == ['Cosmos', 'Oak']
+    # A full export renders everything again
+    assert export(full=True) == 12
+    assert b'A shady tree' in readPage(root, 'catalog', 'Trees', 'Oak',
+        'index.html')
+
+
+def test_deleted_category_pages_are_removed(export, catalog):
+    export()
+    deleteCategory(catalog.connection(), 'Trees')
+    catalog.commit()
+    # Only the home page and the catalog JSON
+    assert export() == 2
+    root = export.root
+    assert not os.path.exists(os.path.join(root, 'catalog', 'Trees'))
+    assert b'Trees' not in readPage(root, 'catalog', 'index.html')
+    assert os.path.isfile(os.path.join(root, 'catalog', 'Annuals',
+        'index.html'))
+
+
+def test_category_page_links_point_at_files(export, catalog):
+    catalog.add_all([PlantItem(name='Plant %d' % i, botanical_name='',
+        description='', image='', category_id=1, user_id=1)
+        for i in range(application.CATEGORY_PAGE_SIZE)])
+    catalog.commit()
+    export()
+    root = export.root
+    first = readPage(root, 'catalog', 'Annuals', 'index.html')
+    # The first page ends at plant id 25, the 24th plant of Annuals
+    assert b'/catalog/Annuals/after/25/"' in first
+    assert b'?after=' not in first
+    second = readPage(root, 'catalog', 'Annuals', 'after', '25',
+        'index.html')
+    assert b'/catalog/Annuals/before/26/"' in second
+    assert readPage(root, 'catalog', 'Annuals', 'before', '26',
+        'index.html') == first